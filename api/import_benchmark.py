@@ -0,0 +1,93 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Cold start of src.utils measured with python -X importtime, each run in a fresh interpreter.
+# Also checks that the graph-only path doesn't load the modules meant to be imported on first use.
+# Run it from the api directory, it exits with 1 when over the budget or when a lazy module leaked:
+#
+#   python import_benchmark.py --runs 10 --budget-ms 150
+#   python import_benchmark.py --json results.json
+
+MODULE = "src.utils"
+
+# Imported by src.utils on first use only (vector search, pools, local index, metrics server, disk caches)
+LAZY_MODULES = ["langchain_openai", "openai", "numpy", "psycopg_pool", "http.server", "sqlite3"]
+
+PROBE = """
+import json, sys
+{import_module}
+print(json.dumps(sorted(name for name in {lazy!r} if name in sys.modules)))
+"""
+
+def parse_importtime(stderr):
+    """{module: (self us, cumulative us)} from the -X importtime report"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+def import_once(module=None):
+    """Import times and lazy modules loaded after importing 'module', or after the interpreter start only"""
+    probe = PROBE.format(import_module=f"import {module}" if module else "", lazy=LAZY_MODULES)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{process.stderr[-2000:]}")
+    return parse_importtime(process.stderr), json.loads(process.stdout.strip().splitlines()[-1])
+
+def run(n_runs, top):
+    # Modules imported by the interpreter itself (site, .pth files) aren't listed
+    startup_modules, _ = import_once()
+    totals, times, loaded = [], {}, []
+    for _ in range(n_runs):
+        times, loaded = import_once(MODULE)
+        totals.append(times[MODULE][1] / 1000)
+    # Cumulative times include the nested imports, e.g. psycopg's in src.utils'
+    ranked = sorted(
+        ((name, t) for name, t in times.items() if name not in startup_modules),
+        key=lambda item: item[1][1], reverse=True
+    )
+    result = {
+        "module": MODULE,
+        "runs": n_runs,
+        "p50_ms": statistics.median(totals),
+        "min_ms": min(totals),
+        "max_ms": max(totals),
+        "lazy_modules_loaded": loaded,
+        "top_modules": [{"module": name, "self_ms": t[0] / 1000, "cumulative_ms": t[1] / 1000} for name, t in ranked[:top]],
+    }
+
+    print(f"\nimport {MODULE}, {n_runs} runs: p50 {result['p50_ms']:.1f} ms "
+          f"(min {result['min_ms']:.1f}, max {result['max_ms']:.1f})")
+    print(f"\n{'module':<40}{'self ms':>10}{'cumul. ms':>12}")
+    for entry in result["top_modules"]:
+        print(f"{entry['module']:<40}{entry['self_ms']:>10.1f}{entry['cumulative_ms']:>12.1f}")
+    if loaded:
+        print(f"\nLoaded although only needed on first use: {', '.join(loaded)}")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Import time of {MODULE}, in fresh interpreters")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Modules listed by cumulative import time")
+    parser.add_argument("--budget-ms", type=float, help=f"Fail when the median import of {MODULE} takes longer")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    result = run(args.runs, args.top)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults written to {args.json}")
+    over_budget = args.budget_ms is not None and result["p50_ms"] > args.budget_ms
+    if over_budget:
+        print(f"\nOver the budget of {args.budget_ms:.0f} ms")
+    sys.exit(1 if over_budget or result["lazy_modules_loaded"] else 0)
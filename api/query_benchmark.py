@@ -0,0 +1,72 @@
+import argparse
+import json
+import statistics
+import time
+
+import psycopg
+from dotenv import load_dotenv
+
+from src import utils
+
+# Per-call latency of the graph helpers with their queries sent as plain text (psycopg's automatic
+# preparation off), with psycopg's default (prepared after prepare_threshold calls, FPKG_PREPARE_QUERIES=0)
+# and prepared from the first call. Run it from the api directory, the graph cache and snapshot stay disabled:
+#
+#   python query_benchmark.py --drug-id 61266250 --calls 500
+#   python query_benchmark.py --drug-id 61266250 --relation active_ingredients --json results.json
+
+load_dotenv()
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+def timed_calls(relation, drug_id, n_calls, cursor, conn):
+    latencies = []
+    for _ in range(n_calls):
+        start = time.perf_counter()
+        utils.get_drug_relation(relation, drug_id, cursor, conn)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def run(relation, drug_id, n_calls):
+    results = []
+    # A fresh connection per mode, so that the unprepared calls can't reuse prepared statements
+    for mode in ("text", "auto", "prepared"):
+        utils.PREPARE_QUERIES = mode == "prepared"
+        conn = psycopg.connect(**utils.get_connection_kwargs())
+        if mode == "text":
+            conn.prepare_threshold = None
+        utils.configure_connection(conn)
+        try:
+            with conn.cursor() as cursor:
+                # Warm call: loads the active graph and, when preparing, the statement itself
+                utils.get_drug_relation(relation, drug_id, cursor, conn)
+                latencies = timed_calls(relation, drug_id, n_calls, cursor, conn)
+        finally:
+            conn.close()
+        results.append({"mode": mode, "calls": n_calls, **summarize(latencies)})
+
+    print(f"\n{relation} of drug {drug_id}, {n_calls} calls")
+    print(f"{'mode':<10}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for result in results:
+        print(f"{result['mode']:<10}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['mean_ms']:>10.2f}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency of the graph helpers as text, auto-prepared and prepared statements")
+    parser.add_argument("--drug-id", required=True)
+    parser.add_argument("--relation", default="generics", choices=sorted(utils.DRUG_RELATIONS))
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.relation, args.drug_id, args.calls)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
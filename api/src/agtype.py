@@ -0,0 +1,52 @@
+import psycopg
+
+from psycopg.adapt import Loader
+from psycopg.types import TypeInfo
+
+try:
+    import orjson
+
+    def _loads(text: str):
+        return orjson.loads(text)
+except ImportError:
+    import json
+
+    def _loads(text: str):
+        return json.loads(text)
+
+
+# Type annotations AGE appends to the text form of graph values, e.g. {...}::vertex
+AGTYPE_SUFFIXES = ("::vertex", "::edge", "::path", "::numeric")
+
+
+def decode_agtype(value):
+    """
+    Decode the text form of an agtype value into Python objects
+    Values already decoded by AgtypeLoader are returned as is
+    """
+    if not isinstance(value, str):
+        return value
+    if value.endswith(AGTYPE_SUFFIXES):
+        value = value[:value.rindex("::")]
+    return _loads(value)
+
+
+class AgtypeLoader(Loader):
+    """psycopg loader turning agtype columns into Python objects as rows are fetched"""
+
+    def load(self, data):
+        return decode_agtype(bytes(data).decode("utf-8"))
+
+
+def register_agtype(conn: psycopg.Connection) -> None:
+    """Decode agtype results of this connection with AgtypeLoader, AGE must be on the search path"""
+    info = TypeInfo.fetch(conn, "agtype")
+    if info is not None:
+        conn.adapters.register_loader(info.oid, AgtypeLoader)
+
+
+async def aregister_agtype(conn: psycopg.AsyncConnection) -> None:
+    """Async variant of register_agtype"""
+    info = await TypeInfo.fetch(conn, "agtype")
+    if info is not None:
+        conn.adapters.register_loader(info.oid, AgtypeLoader)
@@ -0,0 +1,392 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from array import array
+from collections import OrderedDict
+
+from .metrics import timed
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fpkg")
+
+
+class LRUCache:
+    """
+    Bounded in-process mapping evicting the least recently used entries
+    Entries also expire 'ttl' seconds after being stored, when a ttl is given
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            expires_at, value = self._data[key]
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def copy_entry(value):
+    """Copy of a JSON-like value (dicts, lists and scalars), faster than copy.deepcopy"""
+    if isinstance(value, dict):
+        return {key: copy_entry(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_entry(item) for item in value]
+    return value
+
+
+def normalize_query(text: str) -> str:
+    """Case and whitespace insensitive form of a query, used as a cache key"""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class QueryEmbeddingCache:
+    """
+    Two-level cache of query embeddings, keyed on the normalized query text and the model name.
+
+    The first level is an in-process LRU, the second one a SQLite file shared between processes
+    and kept under 'max_disk_bytes' by evicting the least recently used vectors.
+    The SQLite file is only opened on first use.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        max_memory_entries: int = 1024,
+        max_disk_bytes: int = 256 * 1024 * 1024
+    ):
+        self.path = path or os.environ.get(
+            "FPKG_EMBEDDING_CACHE",
+            os.path.join(DEFAULT_CACHE_DIR, "query_embeddings.sqlite3")
+        )
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = LRUCache(max_memory_entries)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> "sqlite3.Connection":
+        if self._db is None:
+            # Imported when the file is first opened, graph-only callers never need it
+            import sqlite3
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    model TEXT,
+                    query TEXT,
+                    vector BLOB,
+                    last_used REAL,
+                    PRIMARY KEY (model, query)
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings(last_used)")
+            self._db.commit()
+            self._disk_bytes = self._db.execute(
+                "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM query_embeddings"
+            ).fetchone()[0]
+        return self._db
+
+    def _evict(self) -> None:
+        """Drop the least recently used vectors until the store is back under 90% of its budget"""
+        target = self.max_disk_bytes * 0.9
+        while self._disk_bytes > target:
+            rows = self._db.execute("""
+                SELECT model, query, LENGTH(vector) FROM query_embeddings
+                ORDER BY last_used LIMIT 100
+            """).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            for model, query, size in rows:
+                self._db.execute("DELETE FROM query_embeddings WHERE model = ? AND query = ?", (model, query))
+                self._disk_bytes -= size
+                if self._disk_bytes <= target:
+                    break
+        self._db.commit()
+
+    def _memory_get(self, key: tuple) -> list[float] | None:
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.memory_hits += 1
+        return vector
+
+    def _disk_get(self, key: tuple) -> list[float] | None:
+        with self._lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT vector FROM query_embeddings WHERE model = ? AND query = ?", key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            db.execute(
+                "UPDATE query_embeddings SET last_used = ? WHERE model = ? AND query = ?",
+                (time.time(), *key)
+            )
+            db.commit()
+            self.disk_hits += 1
+        return array("f", row[0]).tolist()
+
+    def get(self, query: str, model: str) -> list[float] | None:
+        key = (model, normalize_query(query))
+        vector = self._memory_get(key)
+        if vector is None:
+            vector = self._disk_get(key)
+            if vector is not None:
+                self.memory.put(key, vector)
+        return vector
+
+    def put(self, query: str, model: str, vector: list[float]) -> None:
+        key = (model, normalize_query(query))
+        self.memory.put(key, vector)
+        self._disk_put(key, vector)
+
+    def _disk_put(self, key: tuple, vector: list[float]) -> None:
+        blob = array("f", vector).tobytes()
+        with self._lock:
+            db = self._connect()
+            previous = db.execute(
+                "SELECT LENGTH(vector) FROM query_embeddings WHERE model = ? AND query = ?", key
+            ).fetchone()
+            db.execute(
+                "INSERT OR REPLACE INTO query_embeddings (model, query, vector, last_used) VALUES (?, ?, ?, ?)",
+                (*key, blob, time.time())
+            )
+            self._disk_bytes += len(blob) - (previous[0] if previous else 0)
+            db.commit()
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict()
+
+    def embed_query(self, query: str, embeddings) -> list[float]:
+        """Return the cached embedding of a query, calling the embedding API only on a miss"""
+        model = getattr(embeddings, "model", "unknown")
+        vector = self.get(query, model)
+        if vector is None:
+            with timed("embedding_request", model=model):
+                vector = embeddings.embed_query(query)
+            self.put(query, model, vector)
+        return vector
+
+    async def aembed_query(self, query: str, embeddings) -> list[float]:
+        """
+        Async variant of embed_query, the embedding API is awaited on a miss
+        Only the memory level is looked up on the event loop, SQLite is read and written in a thread
+        """
+        model = getattr(embeddings, "model", "unknown")
+        key = (model, normalize_query(query))
+        vector = self._memory_get(key)
+        if vector is not None:
+            return vector
+        vector = await asyncio.to_thread(self._disk_get, key)
+        if vector is None:
+            with timed("embedding_request", model=model):
+                vector = await embeddings.aembed_query(query)
+            self.memory.put(key, vector)
+            await asyncio.to_thread(self._disk_put, key, vector)
+        else:
+            self.memory.put(key, vector)
+        return vector
+
+    def stats(self) -> dict[str, int | float]:
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class SQLiteStore:
+    """
+    JSON values in a SQLite file, shared by every process pointing to the same path
+    Entries expire 'ttl' seconds after being stored, the least recently stored ones are dropped
+    beyond 'max_entries'
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000, ttl: float = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._db = None
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> "sqlite3.Connection":
+        if self._db is None:
+            # Imported when the file is first opened, graph-only callers never need it
+            import sqlite3
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    stored_at REAL,
+                    expires_at REAL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_stored_at ON entries(stored_at)")
+            self._db.commit()
+        return self._db
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def put(self, key: str, value) -> None:
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl is not None else None
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, expires_at)
+            )
+            # Trimming scans the table, so only do it once in a while
+            self._puts += 1
+            if self._puts % 1000 == 0:
+                db.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+                db.execute("""
+                    DELETE FROM entries WHERE key IN (
+                        SELECT key FROM entries ORDER BY stored_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,))
+            db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connect().execute("DELETE FROM entries")
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class GraphCache:
+    """
+    Read-through cache of graph lookups keyed by (relation, drug_id)
+
+    Keys are scoped by the graph version stamp bumped by csv_loader.py after each reload, so a reload
+    invalidates every entry, including the ones shared with other processes through the SQLite backend.
+    The version is looked up again at most every 'version_check_interval' seconds.
+    'backend' is either "memory" (in-process LRU) or "sqlite" (file at 'path').
+    Both return a new object on every hit: the memory backend stores and returns copies, so that callers
+    mutating their results (sorting, annotating rows) don't change the entry served to the next ones.
+    """
+
+    def __init__(
+        self,
+        backend: str = "memory",
+        path: str = None,
+        ttl: float = 3600,
+        max_entries: int = 10000,
+        version_check_interval: float = 5.0
+    ):
+        if backend == "memory":
+            self.store = LRUCache(max_entries, ttl)
+        elif backend == "sqlite":
+            self.store = SQLiteStore(
+                path or os.path.join(DEFAULT_CACHE_DIR, "graph_cache.sqlite3"), max_entries, ttl
+            )
+        else:
+            raise ValueError(f"Unknown graph cache backend '{backend}', expected 'memory' or 'sqlite'")
+        self.version_check_interval = version_check_interval
+        self.version = None
+        self.version_checked_at = None
+        self.hits = 0
+        self.misses = 0
+
+    def version_is_stale(self) -> bool:
+        """Whether the graph version should be looked up again before serving entries"""
+        return (
+            self.version_checked_at is None
+            or time.monotonic() - self.version_checked_at > self.version_check_interval
+        )
+
+    def update_version(self, version) -> None:
+        if version != self.version and isinstance(self.store, LRUCache):
+            # Entries of the previous version can never be hit again
+            self.store.clear()
+        self.version = version
+        self.version_checked_at = time.monotonic()
+
+    def _key(self, relation: str, drug_id: str) -> str:
+        return f"{self.version}:{relation}:{drug_id}"
+
+    def get(self, relation: str, drug_id: str):
+        value = self.store.get(self._key(relation, drug_id))
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # The SQLite backend decodes a new object already
+        return copy_entry(value) if isinstance(self.store, LRUCache) else value
+
+    def put(self, relation: str, drug_id: str, value) -> None:
+        # Failed lookups return None and are not cached
+        if value is not None:
+            if isinstance(self.store, LRUCache):
+                value = copy_entry(value)
+            self.store.put(self._key(relation, drug_id), value)
+
+    def stats(self) -> dict[str, int | float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "version": self.version,
+        }
@@ -0,0 +1,298 @@
+import csv
+import os
+import re
+import time
+
+from array import array
+
+import psycopg
+
+from .agtype import decode_agtype
+
+
+# Linear Cypher patterns as written in DRUG_RELATIONS, e.g. (d:Drug)-[r:HasIndication]->(i:Indication)
+NODE_PATTERN = re.compile(r"\((\w+):(\w+)\)")
+EDGE_PATTERN = re.compile(r"(<-|-)\[\w*:(\w+)\](->|-)")
+
+
+def parse_pattern(pattern: str) -> tuple[list[tuple[str, str]], list[tuple[str, bool]]] | None:
+    """
+    Nodes (variable, label) and edges (label, points right) of a linear pattern
+    None for patterns the snapshot can't follow
+    """
+    nodes, edges = [], []
+    position = 0
+    while True:
+        node = NODE_PATTERN.match(pattern, position)
+        if node is None:
+            return None
+        nodes.append((node.group(1), node.group(2)))
+        position = node.end()
+        if position == len(pattern):
+            return nodes, edges
+        edge = EDGE_PATTERN.match(pattern, position)
+        if edge is None or (edge.group(1) == "<-") == (edge.group(3) == "->"):
+            return None
+        edges.append((edge.group(2), edge.group(3) == "->"))
+        position = edge.end()
+
+
+class Adjacency:
+    """Compressed sparse rows of one edge label: neighbours of node i are targets[offsets[i]:offsets[i + 1]]"""
+
+    def __init__(self, node_count: int, sources: array, targets: array):
+        counts = array("l", [0]) * (node_count + 1)
+        for source in sources:
+            counts[source + 1] += 1
+        for i in range(node_count):
+            counts[i + 1] += counts[i]
+        self.offsets = array("l", counts)
+        self.targets = array("l", [0]) * len(targets)
+        # Edge number of each entry, so that a path never uses the same edge twice (as in Cypher)
+        self.edges = array("l", [0]) * len(targets)
+        cursor = array("l", counts[:-1])
+        for edge, (source, target) in enumerate(zip(sources, targets)):
+            self.targets[cursor[source]] = target
+            self.edges[cursor[source]] = edge
+            cursor[source] += 1
+
+    def neighbours(self, node: int):
+        start, end = self.offsets[node], self.offsets[node + 1]
+        return zip(self.targets[start:end], self.edges[start:end])
+
+
+class GraphSnapshot:
+    """
+    Read-only copy of the graph answering the per-drug relations of 'relations' (DRUG_RELATIONS) in-process
+
+    Nodes are interned to consecutive integers and each edge label is kept as CSR arrays in both
+    directions. Only the node properties returned by the relations are kept.
+    'version' is the graph version the snapshot was loaded from, None for snapshots that don't follow reloads.
+    """
+
+    def __init__(self, relations: dict[str, dict], version: int = None):
+        self.version = version
+        self.labels: list[str] = []
+        self.node_labels = array("B")
+        self.node_properties: list[dict | None] = []
+        self.ids: dict[str, dict[str, int]] = {}
+        self.outgoing: dict[str, Adjacency] = {}
+        self.incoming: dict[str, Adjacency] = {}
+        self.load_seconds = 0.0
+        self.edge_count = 0
+
+        self.relations = {}
+        for relation, spec in relations.items():
+            parsed = parse_pattern(spec["pattern"])
+            if parsed is None:
+                continue
+            nodes, edges = parsed
+            variables = [variable for variable, _ in nodes]
+            if "d" not in variables or spec["returns"] not in variables:
+                continue
+            self.relations[relation] = {
+                "nodes": nodes,
+                "edges": edges,
+                "start": variables.index("d"),
+                "end": variables.index(spec["returns"]),
+                "props_and_paths": spec["props_and_paths"],
+            }
+
+        # Labels looked up by id, and the properties to keep for each label (None keeps them all)
+        self.start_labels = {spec["nodes"][spec["start"]][1] for spec in self.relations.values()}
+        self.kept_properties: dict[str, set[str] | None] = {}
+        for spec in self.relations.values():
+            label = spec["nodes"][spec["end"]][1]
+            kept = self.kept_properties.setdefault(label, set())
+            for key_path in spec["props_and_paths"].values():
+                if key_path == ["properties"] or kept is None:
+                    kept = self.kept_properties[label] = None
+                else:
+                    kept.add(key_path[1])
+
+    def _add_node(self, label: str, properties: dict) -> int:
+        if label not in self.labels:
+            self.labels.append(label)
+        index = len(self.node_properties)
+        self.node_labels.append(self.labels.index(label))
+        if label in self.start_labels:
+            self.ids.setdefault(label, {})[str(properties.get("id"))] = index
+        kept = self.kept_properties.get(label, set())
+        if kept is None:
+            self.node_properties.append(dict(properties))
+        else:
+            self.node_properties.append({key: properties.get(key) for key in kept} if kept else None)
+        return index
+
+    def _add_edges(self, edge_label: str, sources: array, targets: array) -> None:
+        node_count = len(self.node_properties)
+        self.outgoing[edge_label] = Adjacency(node_count, sources, targets)
+        self.incoming[edge_label] = Adjacency(node_count, targets, sources)
+        self.edge_count += len(sources)
+
+    @classmethod
+    def from_database(
+        cls,
+        cursor: psycopg.Cursor,
+        graph_name: str,
+        relations: dict[str, dict],
+        version: int = None
+    ) -> "GraphSnapshot":
+        """Load the label tables of 'graph_name' directly, without going through Cypher"""
+        start_time = time.monotonic()
+        snapshot = cls(relations, version)
+        cursor.execute("""
+            SELECT name, kind FROM ag_catalog.ag_label
+            WHERE graph = (SELECT graphid FROM ag_catalog.ag_graph WHERE name = %s)
+            AND name NOT LIKE '\\_ag\\_label\\_%%';
+        """, (graph_name,))
+        labels = cursor.fetchall()
+
+        graph_ids = {}
+        for label, kind in labels:
+            if kind != "v":
+                continue
+            cursor.execute(f'SELECT id::text::bigint, properties FROM "{graph_name}"."{label}";')
+            for graph_id, properties in cursor:
+                graph_ids[graph_id] = snapshot._add_node(label, decode_agtype(properties))
+
+        for label, kind in labels:
+            if kind != "e":
+                continue
+            sources, targets = array("l"), array("l")
+            cursor.execute(f'SELECT start_id::text::bigint, end_id::text::bigint FROM "{graph_name}"."{label}";')
+            for start_id, end_id in cursor:
+                if start_id in graph_ids and end_id in graph_ids:
+                    sources.append(graph_ids[start_id])
+                    targets.append(graph_ids[end_id])
+            snapshot._add_edges(label, sources, targets)
+
+        snapshot.load_seconds = time.monotonic() - start_time
+        print(f"Loaded a snapshot of '{graph_name}': {snapshot.summary()}")
+        return snapshot
+
+    @classmethod
+    async def afrom_database(
+        cls,
+        cursor: psycopg.AsyncCursor,
+        graph_name: str,
+        relations: dict[str, dict],
+        version: int = None
+    ) -> "GraphSnapshot":
+        """Async variant of from_database"""
+        start_time = time.monotonic()
+        snapshot = cls(relations, version)
+        await cursor.execute("""
+            SELECT name, kind FROM ag_catalog.ag_label
+            WHERE graph = (SELECT graphid FROM ag_catalog.ag_graph WHERE name = %s)
+            AND name NOT LIKE '\\_ag\\_label\\_%%';
+        """, (graph_name,))
+        labels = await cursor.fetchall()
+
+        graph_ids = {}
+        for label, kind in labels:
+            if kind != "v":
+                continue
+            await cursor.execute(f'SELECT id::text::bigint, properties FROM "{graph_name}"."{label}";')
+            for graph_id, properties in await cursor.fetchall():
+                graph_ids[graph_id] = snapshot._add_node(label, decode_agtype(properties))
+
+        for label, kind in labels:
+            if kind != "e":
+                continue
+            sources, targets = array("l"), array("l")
+            await cursor.execute(f'SELECT start_id::text::bigint, end_id::text::bigint FROM "{graph_name}"."{label}";')
+            for start_id, end_id in await cursor.fetchall():
+                if start_id in graph_ids and end_id in graph_ids:
+                    sources.append(graph_ids[start_id])
+                    targets.append(graph_ids[end_id])
+            snapshot._add_edges(label, sources, targets)
+
+        snapshot.load_seconds = time.monotonic() - start_time
+        print(f"Loaded a snapshot of '{graph_name}': {snapshot.summary()}")
+        return snapshot
+
+    @classmethod
+    def from_csv(cls, csv_dir: str, relations: dict[str, dict], version: int = None) -> "GraphSnapshot":
+        """Load the AGE CSV files of csv_dir/nodes and csv_dir/edges, values are kept as strings like AGE does"""
+        start_time = time.monotonic()
+        snapshot = cls(relations, version)
+        indexes = {}
+        nodes_dir, edges_dir = os.path.join(csv_dir, "nodes"), os.path.join(csv_dir, "edges")
+        for filename in sorted(os.listdir(nodes_dir)):
+            if not filename.endswith(".csv"):
+                continue
+            label = os.path.splitext(filename)[0]
+            with open(os.path.join(nodes_dir, filename), newline="", encoding="utf-8-sig") as f:
+                for row in csv.DictReader(f):
+                    indexes[(label, row["id"])] = snapshot._add_node(label, row)
+
+        for filename in sorted(os.listdir(edges_dir)):
+            if not filename.endswith(".csv"):
+                continue
+            sources, targets = array("l"), array("l")
+            with open(os.path.join(edges_dir, filename), newline="", encoding="utf-8-sig") as f:
+                for row in csv.DictReader(f):
+                    start = indexes.get((row["start_vertex_type"], row["start_id"]))
+                    end = indexes.get((row["end_vertex_type"], row["end_id"]))
+                    if start is not None and end is not None:
+                        sources.append(start)
+                        targets.append(end)
+            snapshot._add_edges(os.path.splitext(filename)[0], sources, targets)
+
+        snapshot.load_seconds = time.monotonic() - start_time
+        print(f"Loaded a snapshot of '{csv_dir}': {snapshot.summary()}")
+        return snapshot
+
+    def summary(self) -> str:
+        return (f"{len(self.node_properties)} nodes, {self.edge_count} edges, "
+                f"{len(self.relations)} relations in {self.load_seconds:.1f}s")
+
+    def supports(self, relation: str) -> bool:
+        return relation in self.relations
+
+    def _follow(self, spec: dict, start: int) -> list[int]:
+        """End nodes of every path of the pattern starting at node 'start', one per path like Cypher"""
+        step = 1 if spec["end"] > spec["start"] else -1
+        paths = [(start, ())]
+        position = spec["start"]
+        while position != spec["end"]:
+            edge_label, points_right = spec["edges"][min(position, position + step)]
+            # Walking the pattern right to left reverses every edge
+            adjacency = self.outgoing if points_right == (step == 1) else self.incoming
+            position += step
+            label = spec["nodes"][position][1]
+            if edge_label not in adjacency or label not in self.labels:
+                return []
+            wanted = self.labels.index(label)
+            next_paths = []
+            for node, used in paths:
+                for neighbour, edge in adjacency[edge_label].neighbours(node):
+                    if self.node_labels[neighbour] == wanted and (edge_label, edge) not in used:
+                        next_paths.append((neighbour, used + ((edge_label, edge),)))
+            paths = next_paths
+        return [node for node, _ in paths]
+
+    def _project(self, node: int, props_and_paths: dict[str, list[str]]) -> dict:
+        """Same shape as the projected Cypher columns, missing properties are None"""
+        properties = self.node_properties[node] or {}
+        return {
+            prop: dict(properties) if key_path == ["properties"] else properties.get(key_path[1])
+            for prop, key_path in props_and_paths.items()
+        }
+
+    def relation(self, relation: str, drug_id: str) -> list[dict] | None:
+        """Results of 'relation' for one drug, None if the snapshot can't answer it"""
+        spec = self.relations.get(relation)
+        if spec is None:
+            return None
+        start = self.ids.get(spec["nodes"][spec["start"]][1], {}).get(str(drug_id))
+        if start is None:
+            return []
+        return [self._project(node, spec["props_and_paths"]) for node in self._follow(spec, start)]
+
+    def relation_for_drugs(self, relation: str, drug_ids: list[str]) -> dict[str, list[dict]] | None:
+        """Batch variant of relation, keyed by drug id in the requested order"""
+        if relation not in self.relations:
+            return None
+        return {drug_id: self.relation(relation, drug_id) for drug_id in drug_ids}
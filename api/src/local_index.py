@@ -0,0 +1,341 @@
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+import numpy as np
+import psycopg
+
+
+# On-disk copy of document_vectors searched in-process, so that vsearch doesn't need the database.
+# A directory holds:
+#   meta.json              version, dimensions, row count, storage type, model and the created_at watermark
+#                          of the next refresh
+#   vectors.<version>.bin  row-major matrix, float32 or int8 (one scale per row in scales.<version>.bin)
+#   nodes.<version>.json   [id, name, label] of each row, label is null for rows deleted since the export
+#
+# Exports and refreshes write the files of a new version, then switch meta.json to it: searches keep
+# reading the version they loaded, memory-mapped, until they see the new one. The previous version's
+# files are kept until the next switch for readers that are loading it
+#
+# Export or refresh it from the api directory:
+#
+#   python -m src.local_index export ./vector_index [--int8]
+#   python -m src.local_index refresh ./vector_index
+
+STORAGE_TYPES = {"float32": np.float32, "int8": np.int8}
+
+# Rows scored at a time, bounds the temporary arrays of int8 searches
+SEARCH_CHUNK_ROWS = 65536
+
+# Label code of deleted rows, never matched by a search
+DELETED = 255
+
+EXPORT_QUERY = """
+    SELECT id, node_name, label, embedding::real[], model, created_at
+    FROM document_vectors
+    {where}
+    ORDER BY id;
+"""
+
+# Rows written by a transaction still in progress become visible when it commits, but their created_at is its
+# start time (CURRENT_TIMESTAMP). The next refresh therefore starts from the start of the oldest transaction
+# still writing when the rows are fetched, minus a margin for the ones pg_stat_activity doesn't show (other roles)
+WATERMARK_QUERY = """
+    SELECT (LEAST(
+        clock_timestamp(),
+        (SELECT min(xact_start) FROM pg_stat_activity WHERE backend_xid IS NOT NULL AND pid <> pg_backend_pid())
+    ) - make_interval(secs => %s))::timestamp;
+"""
+WATERMARK_OVERLAP_SECONDS = 300
+
+DIMENSIONS_QUERY = """
+    SELECT atttypmod FROM pg_attribute WHERE attrelid = to_regclass('document_vectors') AND attname = 'embedding';
+"""
+
+
+def strip_agtype(value: str) -> str:
+    # node_name and id hold the raw agtype strings written by node_embedder.py
+    return value.strip('"') if isinstance(value, str) else value
+
+
+def quantize(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization, returns (int8 rows, float32 scales)"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def data_path(path: str, meta: dict, name: str) -> str:
+    """Path of the 'name' file ("vectors.bin", "scales.bin", "nodes.json") of the version of 'meta'"""
+    if meta.get("version") is None:
+        # Exported by earlier versions, without version
+        return os.path.join(path, name)
+    stem, extension = os.path.splitext(name)
+    return os.path.join(path, f"{stem}.{meta['version']}{extension}")
+
+
+def read_meta(path: str) -> dict | None:
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def remove_old_versions(path: str, keep: int) -> None:
+    """Delete the data files of the versions older than 'keep', those of unversioned exports count as 0"""
+    for filename in os.listdir(path):
+        match = re.fullmatch(r"(vectors|scales|nodes)\.(?:(\d+)\.)?(bin|json)", filename)
+        if match and int(match.group(2) or 0) < keep:
+            os.remove(os.path.join(path, filename))
+
+
+def write_json(path: str, value) -> None:
+    # Written aside then renamed, so that readers never see a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def fetch_watermark(cursor: psycopg.Cursor) -> str:
+    """Watermark of the rows about to be fetched, see WATERMARK_QUERY. Rows fetched again are overwritten"""
+    cursor.execute(WATERMARK_QUERY, (WATERMARK_OVERLAP_SECONDS,))
+    return cursor.fetchone()[0].isoformat()
+
+
+def fetch_rows(cursor: psycopg.Cursor, since=None) -> list[tuple]:
+    if since is None:
+        cursor.execute(EXPORT_QUERY.format(where=""))
+    else:
+        # Vectors written in the same instant as the watermark are fetched again, overwriting is harmless
+        cursor.execute(EXPORT_QUERY.format(where="WHERE created_at >= %s::timestamp"), (since,))
+    return cursor.fetchall()
+
+
+def export_vector_index(cursor: psycopg.Cursor, path: str, storage: str = "float32") -> dict:
+    """Dump the whole document_vectors table to 'path', returns the metadata"""
+    start_time = time.monotonic()
+    watermark = fetch_watermark(cursor)
+    rows = fetch_rows(cursor)
+    cursor.connection.rollback()
+    dimensions = len(rows[0][3]) if rows else 0
+    vectors = np.array([row[3] for row in rows], dtype=np.float32).reshape(len(rows), dimensions)
+
+    os.makedirs(path, exist_ok=True)
+    previous = read_meta(path)
+    meta = {
+        "version": (previous or {}).get("version", 0) + 1,
+        "dimensions": dimensions,
+        "count": len(rows),
+        "storage": storage,
+        "model": rows[0][4] if rows else None,
+        "watermark": watermark,
+    }
+    # Files of the new version, no reader opens them before meta.json points to it
+    if storage == "int8":
+        vectors, scales = quantize(vectors)
+        scales.tofile(data_path(path, meta, "scales.bin"))
+    vectors.tofile(data_path(path, meta, "vectors.bin"))
+    write_json(data_path(path, meta, "nodes.json"), [
+        [strip_agtype(node_id), strip_agtype(name), label] for node_id, name, label, *_ in rows
+    ])
+    write_json(os.path.join(path, "meta.json"), meta)
+    remove_old_versions(path, meta["version"] - 1)
+    print(f"Exported {len(rows)} vectors to {path} ({storage}) in {time.monotonic() - start_time:.1f}s")
+    return meta
+
+
+def refresh_vector_index(cursor: psycopg.Cursor, path: str) -> dict:
+    """
+    Bring an exported index up to date: vectors written by the embedder since the last export or refresh
+    are overwritten or appended in a copy of the files, rows whose node was removed are marked as deleted.
+    The index is exported again when the stored dimensions changed (e.g. vector_storage.py swap)
+    """
+    start_time = time.monotonic()
+    meta = read_meta(path)
+    with open(data_path(path, meta, "nodes.json"), encoding="utf-8") as f:
+        nodes = json.load(f)[:meta["count"]]
+
+    cursor.execute(DIMENSIONS_QUERY)
+    column = cursor.fetchone()
+    watermark = fetch_watermark(cursor)
+    rows = fetch_rows(cursor, meta["watermark"])
+    cursor.execute("SELECT id FROM document_vectors;")
+    existing = {strip_agtype(node_id) for (node_id,) in cursor.fetchall()}
+    cursor.connection.rollback()
+
+    # Rows of another size can't be written over the existing ones
+    if column is not None and column[0] > 0:
+        dimensions = column[0]
+    else:
+        dimensions = len(rows[0][3]) if rows else meta["dimensions"]
+    if dimensions != meta["dimensions"]:
+        print(f"document_vectors stores {dimensions} dimensions instead of {meta['dimensions']}, exporting again")
+        return export_vector_index(cursor, path, meta["storage"])
+    if meta.get("version") is None:
+        print("Index exported without version, exporting again")
+        return export_vector_index(cursor, path, meta["storage"])
+
+    # The new version starts as a copy of the current one, the search keeps reading the current files
+    previous = dict(meta)
+    meta["version"] += 1
+    files = ["vectors.bin", "scales.bin"] if meta["storage"] == "int8" else ["vectors.bin"]
+    for name in files:
+        shutil.copyfile(data_path(path, previous, name), data_path(path, meta, name))
+
+    dtype = STORAGE_TYPES[meta["storage"]]
+    row_bytes = meta["dimensions"] * np.dtype(dtype).itemsize
+    positions = {node[0]: i for i, node in enumerate(nodes)}
+    scale_updates = []
+    updated = appended = 0
+    with open(data_path(path, meta, "vectors.bin"), "r+b") as f:
+        for node_id, name, label, embedding, model, created_at in rows:
+            node_id = strip_agtype(node_id)
+            vector = np.asarray(embedding, dtype=np.float32)[None, :]
+            if meta["storage"] == "int8":
+                vector, scale = quantize(vector)
+            position = positions.get(node_id)
+            if position is None:
+                position = positions[node_id] = len(nodes)
+                nodes.append(None)
+                appended += 1
+            else:
+                updated += 1
+            nodes[position] = [node_id, strip_agtype(name), label]
+            f.seek(position * row_bytes)
+            f.write(vector.astype(dtype).tobytes())
+            if meta["storage"] == "int8":
+                scale_updates.append((position, scale))
+    if scale_updates:
+        with open(data_path(path, meta, "scales.bin"), "r+b") as f:
+            for position, scale in scale_updates:
+                f.seek(position * 4)
+                f.write(scale.tobytes())
+
+    deleted = 0
+    for node in nodes:
+        if node[2] is not None and node[0] not in existing:
+            node[2] = None
+            deleted += 1
+
+    meta["count"] = len(nodes)
+    meta["watermark"] = watermark
+    write_json(data_path(path, meta, "nodes.json"), nodes)
+    write_json(os.path.join(path, "meta.json"), meta)
+    remove_old_versions(path, meta["version"] - 1)
+    print(f"Refreshed {path}: {appended} appended, {updated} updated, {deleted} deleted "
+          f"in {time.monotonic() - start_time:.1f}s")
+    return meta
+
+
+class LocalVectorIndex:
+    """
+    Exact nearest neighbour search over an exported index, memory-mapped and scored with NumPy
+    Distances are Euclidean, like the <-> operator of the database search.
+    The files of a new version are opened when meta.json points to one, checked at most every
+    'check_interval' seconds
+    """
+
+    def __init__(self, path: str, check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.checked_at = None
+        self.load()
+
+    def load(self, meta: dict = None) -> None:
+        meta = meta or read_meta(self.path)
+        with open(data_path(self.path, meta, "nodes.json"), encoding="utf-8") as f:
+            nodes = json.load(f)[:meta["count"]]
+
+        count, dimensions = meta["count"], meta["dimensions"]
+        vectors = np.memmap(
+            data_path(self.path, meta, "vectors.bin"), dtype=STORAGE_TYPES[meta["storage"]], mode="r",
+            shape=(count, dimensions)
+        ) if count else np.zeros((0, dimensions), dtype=np.float32)
+        scales = np.fromfile(data_path(self.path, meta, "scales.bin"), dtype=np.float32, count=count) \
+            if meta["storage"] == "int8" else None
+
+        labels = sorted({label for _, _, label in nodes if label is not None})
+        codes = {label: i for i, label in enumerate(labels)}
+        label_codes = np.array([codes.get(label, DELETED) for _, _, label in nodes], dtype=np.uint8)
+
+        # Squared norms of the rows, so that each search is a single matrix-vector product
+        norms = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SEARCH_CHUNK_ROWS):
+            chunk = np.asarray(vectors[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32)
+            norms[start:start + len(chunk)] = np.einsum("ij,ij->i", chunk, chunk)
+        if scales is not None:
+            norms *= scales * scales
+
+        self.meta, self.nodes, self.vectors, self.scales = meta, nodes, vectors, scales
+        self.labels, self.label_codes, self.norms = codes, label_codes, norms
+        self.checked_at = time.monotonic()
+
+    def reload_if_changed(self) -> None:
+        if time.monotonic() - self.checked_at < self.check_interval:
+            return
+        self.checked_at = time.monotonic()
+        meta = read_meta(self.path)
+        if meta.get("version") != self.meta.get("version"):
+            self.load(meta)
+
+    def _dot(self, query: np.ndarray) -> np.ndarray:
+        if self.scales is None:
+            return np.asarray(self.vectors @ query)
+        dots = np.empty(len(self.nodes), dtype=np.float32)
+        for start in range(0, len(self.nodes), SEARCH_CHUNK_ROWS):
+            chunk = self.vectors[start:start + SEARCH_CHUNK_ROWS]
+            dots[start:start + len(chunk)] = chunk.astype(np.float32) @ query
+        return dots * self.scales
+
+    def search(self, embedding: list[float], labels: list[str] = None, limit: int = 5) -> list[dict]:
+        """Rows closest to 'embedding', optionally restricted to some labels, shaped like vsearch's results"""
+        self.reload_if_changed()
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape[0] != self.meta["dimensions"] or not self.nodes:
+            return []
+        distances = self.norms - 2 * self._dot(query) + query @ query
+
+        if labels:
+            allowed = np.isin(self.label_codes, [self.labels[label] for label in labels if label in self.labels])
+        else:
+            allowed = self.label_codes != DELETED
+        candidates = np.flatnonzero(allowed)
+        if not len(candidates):
+            return []
+        limit = min(limit, len(candidates))
+        top = candidates[np.argpartition(distances[candidates], limit - 1)[:limit]]
+        top = top[np.argsort(distances[top])]
+        return [
+            {
+                "name": self.nodes[i][1],
+                "id": self.nodes[i][0],
+                "label": self.nodes[i][2],
+                "distance": float(np.sqrt(max(distances[i], 0.0))),
+            }
+            for i in top
+        ]
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from .utils import configure_connection, get_connection_kwargs
+
+    load_dotenv()
+    if len(sys.argv) < 3 or sys.argv[1] not in ("export", "refresh"):
+        print("Usage: python -m src.local_index export|refresh PATH [--int8]")
+        sys.exit(1)
+    conn = psycopg.connect(**get_connection_kwargs())
+    configure_connection(conn)
+    try:
+        with conn.cursor() as cursor:
+            if sys.argv[1] == "export":
+                export_vector_index(cursor, sys.argv[2], "int8" if "--int8" in sys.argv else "float32")
+            else:
+                refresh_vector_index(cursor, sys.argv[2])
+    finally:
+        conn.close()
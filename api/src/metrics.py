@@ -0,0 +1,289 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+from collections import deque
+
+
+# Timers and counters of the hot paths (SQL, embedding API, result decoding, caches), off by default.
+# While disabled, timed() returns a shared no-op context manager and count() returns at once.
+#
+#   enable_metrics(hook=print_event, explain_slow_ms=200)
+#   ...
+#   print(export_metrics("prometheus"))       # or "json", or write_metrics("metrics.prom")
+#
+# Scripts enable it from the environment: FPKG_METRICS_FILE=metrics.json (or .prom) is written on exit,
+# FPKG_EXPLAIN_SLOW_MS captures EXPLAIN (ANALYZE, BUFFERS) of the queries slower than that
+#
+# The db scripts (csv_loader.py, node_embedder.py) import this same file, keep it standard library only
+
+METRICS_FILE = os.environ.get("FPKG_METRICS_FILE")
+EXPLAIN_SLOW_MS = float(os.environ["FPKG_EXPLAIN_SLOW_MS"]) if os.environ.get("FPKG_EXPLAIN_SLOW_MS") else None
+
+# Prefix of the exported metric names
+NAMESPACE = "fpkg"
+
+# Upper bounds of the timing buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Slow query plans kept for export
+SLOW_QUERIES_KEPT = 20
+
+
+class Metrics:
+    """
+    Counters and timing histograms keyed by name and labels, safe to update from several threads
+    'hooks' are called with (kind, name, value, labels) for every event, kind is "count", "timing" or "explain"
+    """
+
+    def __init__(self, hooks: list = None, explain_slow_ms: float = None):
+        self.hooks = list(hooks or [])
+        self.explain_slow_seconds = explain_slow_ms / 1000 if explain_slow_ms is not None else None
+        self.counters: dict[tuple, float] = {}
+        self.timings: dict[tuple, list] = {}
+        self.slow_queries = deque(maxlen=SLOW_QUERIES_KEPT)
+        # Callables returning {name: value} gauges, read at export time (e.g. cache statistics)
+        self.collectors: list = []
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: float, labels: dict) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        for hook in self.hooks:
+            hook("count", name, value, labels)
+
+    def observe(self, name: str, seconds: float, labels: dict) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                # count, sum, max, then one count per bucket
+                timing = self.timings[key] = [0, 0.0, 0.0] + [0] * len(BUCKETS)
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+            bucket = bisect.bisect_left(BUCKETS, seconds)
+            if bucket < len(BUCKETS):
+                timing[3 + bucket] += 1
+        for hook in self.hooks:
+            hook("timing", name, seconds, labels)
+
+    def add_slow_query(self, name: str, seconds: float, query: str, plan: str) -> None:
+        self.slow_queries.append({"query": name, "seconds": seconds, "text": query, "plan": plan})
+        for hook in self.hooks:
+            hook("explain", name, seconds, {"plan": plan})
+
+    def gauges(self) -> dict[str, float]:
+        values = {}
+        for collector in self.collectors:
+            try:
+                values.update(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        return values
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            timings = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": timing[0],
+                    "sum_seconds": timing[1],
+                    "mean_seconds": timing[1] / timing[0],
+                    "max_seconds": timing[2],
+                    "buckets": dict(zip(map(str, BUCKETS), timing[3:])),
+                }
+                for (name, labels), timing in sorted(self.timings.items())
+            ]
+        return {
+            "counters": counters,
+            "timings": timings,
+            "gauges": self.gauges(),
+            "slow_queries": list(self.slow_queries),
+        }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{NAMESPACE}_{name}_total{format_labels(labels)} {value}")
+            for (name, labels), timing in sorted(self.timings.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, timing[3:]):
+                    cumulative += bucket_count
+                    lines.append(f"{NAMESPACE}_{name}_seconds_bucket{format_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{NAMESPACE}_{name}_seconds_bucket{format_labels(labels, le='+Inf')} {timing[0]}")
+                lines.append(f"{NAMESPACE}_{name}_seconds_sum{format_labels(labels)} {timing[1]}")
+                lines.append(f"{NAMESPACE}_{name}_seconds_count{format_labels(labels)} {timing[0]}")
+        for name, value in sorted(self.gauges().items()):
+            if isinstance(value, (int, float)):
+                lines.append(f"{NAMESPACE}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: tuple, **extra) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+# Registry of the process, None while metrics are disabled
+registry: Metrics | None = None
+
+
+class Timer:
+    """Times its block, the elapsed time is then in 'seconds'"""
+    __slots__ = ("name", "labels", "start", "seconds")
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.seconds = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.seconds = time.perf_counter() - self.start
+        if registry is not None:
+            registry.observe(self.name, self.seconds, self.labels)
+
+
+class NullTimer:
+    __slots__ = ()
+    seconds = 0.0
+
+    def __enter__(self) -> "NullTimer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def enable_metrics(hook=None, explain_slow_ms: float = EXPLAIN_SLOW_MS) -> Metrics:
+    """
+    Start recording, 'hook' is an optional callable receiving every event as (kind, name, value, labels)
+    'explain_slow_ms' captures the plan of queries slower than that, None doesn't capture any
+    """
+    global registry
+    registry = Metrics([hook] if hook else [], explain_slow_ms)
+    return registry
+
+def disable_metrics() -> None:
+    global registry
+    registry = None
+
+def timed(name: str, **labels) -> Timer | NullTimer:
+    """Context manager recording the time of its block as the 'name' timing"""
+    if registry is None:
+        return NULL_TIMER
+    return Timer(name, labels)
+
+def count(name: str, value: float = 1, **labels) -> None:
+    if registry is not None:
+        registry.count(name, value, labels)
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Record a duration measured elsewhere as the 'name' timing"""
+    if registry is not None:
+        registry.observe(name, seconds, labels)
+
+def add_collector(collector) -> None:
+    """Export the {name: value} gauges returned by 'collector' along with the other metrics"""
+    if registry is not None:
+        registry.collectors.append(collector)
+
+def export_metrics(format: str = "json") -> str:
+    """Everything recorded so far, as JSON or in the Prometheus text format"""
+    if registry is None:
+        return "" if format == "prometheus" else "{}"
+    if format == "prometheus":
+        return registry.to_prometheus()
+    return json.dumps(registry.to_dict(), indent=2, default=str)
+
+def write_metrics(path: str) -> None:
+    """Write the metrics to 'path', in the Prometheus text format for .prom files and as JSON otherwise"""
+    if registry is None:
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(export_metrics("prometheus" if path.endswith(".prom") else "json"))
+    print(f"Metrics written to {path}")
+
+def serve_metrics(port: int = 9108) -> "ThreadingHTTPServer":
+    """Serve /metrics (Prometheus) and /metrics.json from a daemon thread"""
+    # Imported here, http.server alone takes longer to import than the rest of the API helpers
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") == "/metrics":
+                body, content_type = export_metrics("prometheus"), "text/plain; version=0.0.4"
+            elif self.path.rstrip("/") == "/metrics.json":
+                body, content_type = export_metrics("json"), "application/json"
+            else:
+                self.send_error(404)
+                return
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("localhost", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://localhost:{port}/metrics")
+    return server
+
+def is_slow(seconds: float) -> bool:
+    return (
+        registry is not None
+        and registry.explain_slow_seconds is not None
+        and seconds >= registry.explain_slow_seconds
+    )
+
+def explain_if_slow(cursor, name: str, query: str, params, seconds: float) -> None:
+    """
+    Run EXPLAIN (ANALYZE, BUFFERS) of a query that took 'seconds', if it is above the slow query threshold
+    The plan is taken on a cursor of its own, the results of 'cursor' are left untouched, and in a savepoint
+    so that a failure doesn't abort the caller's transaction. ANALYZE runs the query again, only use it
+    for read-only queries
+    """
+    if not is_slow(seconds):
+        return
+    try:
+        with cursor.connection.transaction(), cursor.connection.cursor() as explain_cursor:
+            explain_cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}", params)
+            plan = "\n".join(row[0] for row in explain_cursor.fetchall())
+        registry.add_slow_query(name, seconds, query, plan)
+    except Exception as e:
+        print(f"Could not explain the slow query '{name}': {e}")
+
+async def aexplain_if_slow(cursor, name: str, query: str, params, seconds: float) -> None:
+    """Async variant of explain_if_slow"""
+    if not is_slow(seconds):
+        return
+    try:
+        async with cursor.connection.transaction(), cursor.connection.cursor() as explain_cursor:
+            await explain_cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}", params)
+            plan = "\n".join(row[0] for row in await explain_cursor.fetchall())
+        registry.add_slow_query(name, seconds, query, plan)
+    except Exception as e:
+        print(f"Could not explain the slow query '{name}': {e}")
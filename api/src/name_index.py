@@ -0,0 +1,126 @@
+import re
+import time
+import unicodedata
+
+from collections import Counter
+
+import psycopg
+
+
+# Dosage and pharmaceutical form words, dropped from the base name of a drug
+# e.g. "DOLIPRANE 1000 mg, comprimé" and "Doliprane cpr" both have the base name "doliprane"
+FORM_WORDS = {
+    "mg", "g", "ml", "l", "ug", "mcg", "ui", "µg", "cp", "cpr", "comprime", "comprimes", "gelule", "gelules",
+    "sol", "solution", "inj", "injectable", "buv", "buvable", "susp", "suspension", "sirop", "pdre",
+    "poudre", "creme", "pommade", "collyre", "sachet", "sachets", "amp", "ampoule", "fl", "flacon",
+    "effervescent", "secable", "pellicule", "enrobe", "lp", "orodispersible",
+}
+
+
+def normalize_name(text: str) -> str:
+    """Accent, case and punctuation insensitive form of a name"""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^\w%]+", " ", text.casefold())
+    return " ".join(text.split())
+
+
+def base_name(text: str) -> str:
+    """Normalized name up to the first dosage or form word"""
+    words = []
+    for word in normalize_name(text).split():
+        if any(char.isdigit() for char in word) or word in FORM_WORDS or word == "%":
+            break
+        words.append(word)
+    return " ".join(words)
+
+
+def trigrams(text: str) -> set[str]:
+    """Trigrams of each word padded like pg_trgm does, so similarities are comparable with similarity()"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NameIndex:
+    """
+    In-process lexical index of node names: exact lookups on the normalized and base names,
+    and pg_trgm-like trigram similarity for misspelled or partial names
+    Entries are (name, id) pairs, 'min_similarity' drops weak fuzzy candidates
+    """
+
+    def __init__(self, entries: list[tuple[str, str]], min_similarity: float = 0.3):
+        self.min_similarity = min_similarity
+        self.entries = []
+        self.full: dict[str, list[int]] = {}
+        self.base: dict[str, list[int]] = {}
+        self.postings: dict[str, list[int]] = {}
+        self.gram_counts = []
+        start_time = time.monotonic()
+        for name, node_id in entries:
+            index = len(self.entries)
+            self.entries.append({"name": name, "id": node_id})
+            normalized = normalize_name(name)
+            self.full.setdefault(normalized, []).append(index)
+            base = base_name(name)
+            if base:
+                self.base.setdefault(base, []).append(index)
+            grams = trigrams(normalized)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(index)
+        self.build_seconds = time.monotonic() - start_time
+
+    @classmethod
+    def from_database(cls, cursor: psycopg.Cursor, labels: list[str] = None, **kwargs) -> "NameIndex":
+        """Names of the embedded nodes, the same ones vector search returns"""
+        cursor.execute("""
+            SELECT btrim(node_name, '"'), btrim(id, '"') FROM document_vectors
+            WHERE %(labels)s::text[] IS NULL OR label = ANY(%(labels)s::text[]);
+        """, {"labels": labels})
+        entries = cursor.fetchall()
+        cursor.connection.rollback()
+        return cls(entries, **kwargs)
+
+    @classmethod
+    async def afrom_database(cls, cursor: psycopg.AsyncCursor, labels: list[str] = None, **kwargs) -> "NameIndex":
+        """Async variant of from_database"""
+        await cursor.execute("""
+            SELECT btrim(node_name, '"'), btrim(id, '"') FROM document_vectors
+            WHERE %(labels)s::text[] IS NULL OR label = ANY(%(labels)s::text[]);
+        """, {"labels": labels})
+        entries = await cursor.fetchall()
+        await cursor.connection.rollback()
+        return cls(entries, **kwargs)
+
+    def exact(self, text: str) -> list[dict]:
+        """Entries whose normalized name is the normalized text"""
+        return [self.entries[i] for i in self.full.get(normalize_name(text), [])]
+
+    def search(self, text: str, limit: int = 10) -> list[dict]:
+        """
+        Lexical candidates ranked by score: 1.0 for the same normalized name, 0.9 for the same base name,
+        trigram similarity otherwise
+        """
+        scores = {i: 1.0 for i in self.full.get(normalize_name(text), [])}
+        base = base_name(text)
+        for i in self.base.get(base, []) if base else []:
+            scores.setdefault(i, 0.9)
+
+        grams = trigrams(normalize_name(text))
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        for i, count in shared.items():
+            similarity = count / (len(grams) + self.gram_counts[i] - count)
+            if similarity >= self.min_similarity and similarity > scores.get(i, 0.0):
+                scores[i] = similarity
+
+        # Ties are ordered by id, so that duplicate names rank the same way whatever the load order
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.entries[item[0]]["id"]))[:limit]
+        return [{**self.entries[i], "score": score} for i, score in ranked]
+
+    def __len__(self) -> int:
+        return len(self.entries)
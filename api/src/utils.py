@@ -1,11 +1,27 @@
+from __future__ import annotations
+
 import psycopg
+import contextlib
 import os
+import functools
 import json
 import textwrap
-import re
+import time
+
+from typing import TYPE_CHECKING, TypedDict
 
-from langchain_openai import OpenAIEmbeddings
-from typing import TypedDict
+from .agtype import aregister_agtype, decode_agtype, register_agtype
+from .cache import GraphCache, QueryEmbeddingCache
+from .graph_snapshot import GraphSnapshot
+from .metrics import EXPLAIN_SLOW_MS, Metrics, aexplain_if_slow, count, enable_metrics, explain_if_slow, timed
+from .name_index import NameIndex
+
+# The embedding client (langchain_openai), the pools and the local vector index (NumPy) are imported
+# on first use, so that graph lookups only load psycopg. import_benchmark.py keeps it that way
+if TYPE_CHECKING:
+    import psycopg_pool
+    from langchain_openai import OpenAIEmbeddings
+    from .local_index import LocalVectorIndex
 
 
 class DBConfig(TypedDict):
@@ -19,6 +35,146 @@ class NameWithID(TypedDict):
     name:str
     id:str
 
+# Shared by every vsearch_drug call that doesn't pass its own cache
+default_embedding_cache = QueryEmbeddingCache()
+
+# Read-through cache of the per-drug helpers, off until enable_graph_cache is called
+graph_cache: GraphCache | None = None
+
+def enable_graph_cache(backend: str = "memory", **kwargs) -> GraphCache:
+    """Cache the per-drug helpers' results, see GraphCache for the options"""
+    global graph_cache
+    graph_cache = GraphCache(backend, **kwargs)
+    return graph_cache
+
+def disable_graph_cache() -> None:
+    global graph_cache
+    graph_cache = None
+
+# In-memory copy of the graph answering the per-drug helpers, off until enable_graph_snapshot is called
+graph_snapshot: GraphSnapshot | None = None
+
+# Exported copy of document_vectors searched in-process by vsearch, off until enable_local_vector_index is called
+local_vector_index: LocalVectorIndex | None = None
+
+def enable_local_vector_index(path: str, cursor: psycopg.Cursor = None, storage: str = "float32") -> LocalVectorIndex:
+    """
+    Search the vectors exported to 'path' (see local_index.py) instead of document_vectors
+    With a cursor, the export is created if missing and brought up to date otherwise
+    """
+    from .local_index import LocalVectorIndex, export_vector_index, refresh_vector_index
+
+    global local_vector_index
+    if cursor is not None:
+        if os.path.exists(os.path.join(path, "meta.json")):
+            refresh_vector_index(cursor, path)
+        else:
+            export_vector_index(cursor, path, storage)
+    local_vector_index = LocalVectorIndex(path)
+    return local_vector_index
+
+def disable_local_vector_index() -> None:
+    global local_vector_index
+    local_vector_index = None
+
+def cache_gauges() -> dict[str, float]:
+    """Hit rates and sizes of the query embedding cache and of the graph cache"""
+    gauges = {f"embedding_cache_{key}": value for key, value in default_embedding_cache.stats().items()}
+    if graph_cache is not None:
+        gauges.update({f"graph_cache_{key}": value for key, value in graph_cache.stats().items() if key != "version"})
+    return gauges
+
+def enable_query_metrics(hook=None, explain_slow_ms: float = EXPLAIN_SLOW_MS) -> Metrics:
+    """
+    Time the SQL, embedding and decoding steps of the helpers and count their rows and errors,
+    see metrics.py for the hook and the exporters. Disable with metrics.disable_metrics()
+    """
+    registry = enable_metrics(hook, explain_slow_ms)
+    registry.collectors.append(cache_gauges)
+    return registry
+
+def get_connection_kwargs(
+    db_config: DBConfig = None,
+    dbname: str = "fpkg",
+    user: str = None,
+    password: str = None,
+    host: str = "localhost",
+    port: str = "5431"
+) -> dict[str, str]:
+    """Resolve connection parameters from 'db_config', the arguments and the environment"""
+    # Use db_config if provided, otherwise use individual parameters
+    if db_config:
+        dbname = db_config.get("dbname", dbname)
+        user = db_config.get("user", user or os.environ.get("PGUSER"))
+        password = db_config.get("password", password or os.environ.get("PGPASSWORD"))
+        host = db_config.get("host", host)
+        port = db_config.get("port", port)
+    else:
+        user = user or os.environ.get("PGUSER")
+        password = password or os.environ.get("PGPASSWORD")
+
+    return {
+        "dbname": dbname,
+        "user": user,
+        "password": password,
+        "host": host,
+        "port": port,
+    }
+
+def configure_connection(conn: psycopg.Connection) -> None:
+    """Load AGE, set the search path and register the agtype loader, once per connection"""
+    conn.execute("LOAD 'age';")
+    conn.execute("SET search_path = ag_catalog, \"$user\", public;")
+    register_agtype(conn)
+    conn.commit()
+
+async def aconfigure_connection(conn: psycopg.AsyncConnection) -> None:
+    """Async variant of configure_connection"""
+    await conn.execute("LOAD 'age';")
+    await conn.execute("SET search_path = ag_catalog, \"$user\", public;")
+    await aregister_agtype(conn)
+    await conn.commit()
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+class LazyEmbeddings:
+    """
+    Stands for an OpenAIEmbeddings client, only imported and created on the first embedding request,
+    so that graph-only callers and cached query embeddings never load langchain_openai.
+    'model' is known without the client, it keys the query embedding cache
+    """
+
+    def __init__(self, model: str = EMBEDDING_MODEL, **kwargs):
+        self.model = model
+        self.kwargs = kwargs
+        self._client = None
+
+    @property
+    def client(self) -> OpenAIEmbeddings:
+        if self._client is None:
+            with timed("embedding_client_init"):
+                from langchain_openai import OpenAIEmbeddings
+                self._client = OpenAIEmbeddings(model=self.model, **self.kwargs)
+        return self._client
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.client.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.client.aembed_query(text)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.client.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.client.aembed_documents(texts)
+
+    def __getattr__(self, name: str):
+        # Anything else is the client's
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
 def init_database(
     db_config: DBConfig = None,
     dbname: str = "fpkg",
@@ -26,37 +182,19 @@ def init_database(
     password: str = None,
     host: str = "localhost",
     port: str = "5431"
-) -> tuple[psycopg.Connection, psycopg.Cursor, OpenAIEmbeddings]:
-    """Initialize database connection and OpenAI embeddings"""
+) -> tuple[psycopg.Connection, psycopg.Cursor, LazyEmbeddings]:
+    """
+    Initialize database connection and OpenAI embeddings
+    The embedding client is created on its first use, see LazyEmbeddings
+    """
     try:
-        # Use db_config if provided, otherwise use individual parameters
-        if db_config:
-            dbname = db_config.get("dbname", dbname)
-            user = db_config.get("user", user or os.environ.get("PGUSER"))
-            password = db_config.get("password", password or os.environ.get("PGPASSWORD"))
-            host = db_config.get("host", host)
-            port = db_config.get("port", port)
-        else:
-            user = user or os.environ.get("PGUSER")
-            password = password or os.environ.get("PGPASSWORD")
-        
         # Connect to the Postgres database and to the OpenAI API
-        conn = psycopg.connect(
-            dbname=dbname,
-            user=user,
-            password=password,
-            host=host,
-            port=port
-        )
+        conn = psycopg.connect(**get_connection_kwargs(db_config, dbname, user, password, host, port))
+        configure_connection(conn)
 
         cursor = conn.cursor()
 
-        cursor.execute("LOAD 'age';")
-        cursor.execute("SET search_path = ag_catalog, \"$user\", public;")
-
-        conn.commit()
-
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+        embeddings = LazyEmbeddings()
         print("Successfully initialized database and OpenAI embeddings")
         
         return conn, cursor, embeddings
@@ -65,44 +203,635 @@ def init_database(
         print(e)
         raise
 
-def vsearch_drug(
-    drug: str,
-    cursor: psycopg.Cursor,
-    conn: psycopg.Connection,
-    embeddings: OpenAIEmbeddings
-) -> NameWithID | None:
-    """Search for the exact name and ID of a drug in the database"""
-    embedding = embeddings.embed_query(drug)
+def init_pool(
+    db_config: DBConfig = None,
+    min_size: int = 1,
+    max_size: int = 10,
+    prepare_queries: bool = False,
+    **connection_kwargs
+) -> psycopg_pool.ConnectionPool:
+    """
+    Open a pool of connections, each one configured for AGE when it is created
+    Connections are borrowed with the helpers' usual cursor and connection arguments:
+
+        with pool.connection() as conn, conn.cursor() as cursor:
+            generics = get_generics(drug_id, cursor, conn)
+
+    With 'prepare_queries', every helper query is also prepared as each connection opens,
+    instead of on its first call
+    """
+    import psycopg_pool
 
+    def configure(conn: psycopg.Connection) -> None:
+        configure_connection(conn)
+        if prepare_queries:
+            prepare_helper_queries(conn)
+
+    pool = psycopg_pool.ConnectionPool(
+        kwargs=get_connection_kwargs(db_config, **connection_kwargs),
+        min_size=min_size,
+        max_size=max_size,
+        configure=configure,
+        open=True,
+    )
+    print(f"Successfully opened a pool of {min_size} to {max_size} connections")
+    return pool
+
+async def init_async_pool(
+    db_config: DBConfig = None,
+    min_size: int = 1,
+    max_size: int = 10,
+    prepare_queries: bool = False,
+    **connection_kwargs
+) -> psycopg_pool.AsyncConnectionPool:
+    """
+    Async variant of init_pool, to be used with the a-prefixed helpers:
+
+        async with pool.connection() as conn, conn.cursor() as cursor:
+            generics = await aget_generics(drug_id, cursor, conn)
+    """
+    import psycopg_pool
+
+    async def configure(conn: psycopg.AsyncConnection) -> None:
+        await aconfigure_connection(conn)
+        if prepare_queries:
+            await aprepare_helper_queries(conn)
+
+    pool = psycopg_pool.AsyncConnectionPool(
+        kwargs=get_connection_kwargs(db_config, **connection_kwargs),
+        min_size=min_size,
+        max_size=max_size,
+        configure=configure,
+        open=False,
+    )
+    await pool.open()
+    print(f"Successfully opened an async pool of {min_size} to {max_size} connections")
+    return pool
+
+class VectorMatch(TypedDict):
+    name:str
+    id:str
+    label:str
+    distance:float
+
+# Storage of document_vectors.embedding, written by db/node_embedder.py and db/vector_storage.py
+VECTOR_COLUMN_QUERY = """
+    SELECT t.typname, a.atttypmod, EXISTS (
+        SELECT 1 FROM pg_attribute l
+        WHERE l.attrelid = a.attrelid AND l.attname = 'label' AND NOT l.attisdropped
+    )
+    FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid
+    WHERE a.attrelid = to_regclass('document_vectors') AND a.attname = 'embedding';
+"""
+
+# Same value as the generated label column, for tables restored from full_db.dump or embedded by
+# earlier versions that don't have it yet (see "python node_embedder.py migrate")
+LABEL_EXPRESSION = "btrim(node_label, '[]\" ')"
+
+# Candidates of the binary quantized coarse search reranked by exact distance, 0 searches the vectors directly
+BINARY_RERANK_CANDIDATES = int(os.environ.get("FPKG_BINARY_RERANK_CANDIDATES", "0"))
+
+class VectorColumn:
+    """
+    Type ("vector" or "halfvec") and dimensions of document_vectors.embedding, and whether the table has
+    the label column, looked up again at most every 'check_interval' seconds so that a storage migration
+    is picked up without restarting the API
+    """
+
+    def __init__(self, check_interval: float = 60.0):
+        self.storage = "vector"
+        self.dimensions = None
+        self.has_label = True
+        self.check_interval = check_interval
+        self.checked_at = None
+
+    def is_stale(self) -> bool:
+        return self.checked_at is None or time.monotonic() - self.checked_at > self.check_interval
+
+    def update(self, row: tuple | None) -> None:
+        if row is not None:
+            self.storage, self.dimensions, self.has_label = row
+        self.checked_at = time.monotonic()
+
+    @property
+    def label(self) -> str:
+        """Column, or expression when the column is missing, to select and filter the bare label"""
+        return "label" if self.has_label else LABEL_EXPRESSION
+
+vector_column = VectorColumn()
+
+def refresh_vector_column(cursor: psycopg.Cursor) -> VectorColumn:
+    if vector_column.is_stale():
+        cursor.execute(VECTOR_COLUMN_QUERY)
+        vector_column.update(cursor.fetchone())
+    return vector_column
+
+async def arefresh_vector_column(cursor: psycopg.AsyncCursor) -> VectorColumn:
+    """Async variant of refresh_vector_column"""
+    if vector_column.is_stale():
+        await cursor.execute(VECTOR_COLUMN_QUERY)
+        vector_column.update(await cursor.fetchone())
+    return vector_column
+
+def shorten_embedding(embedding: list[float], dimensions: int | None) -> list[float]:
+    """
+    First 'dimensions' values of a text-embedding-3 vector, renormalized: the same vector the API
+    returns when asked for fewer dimensions, so full size query embeddings can search shortened ones
+    """
+    if not dimensions or len(embedding) <= dimensions:
+        return embedding
+    shortened = embedding[:dimensions]
+    norm = sum(x * x for x in shortened) ** 0.5 or 1.0
+    return [x / norm for x in shortened]
+
+def build_vsearch_query(
+    embedding: list[float],
+    labels: list[str] = None,
+    limit: int = 5,
+    rerank_candidates: int = 0,
+    storage: str = "vector",
+    label_column: str = "label"
+) -> tuple[str, dict]:
+    """
+    Build the nearest neighbour query of vsearch and its parameters
+    With 'rerank_candidates', the closest vectors by Hamming distance between binary quantizations are
+    fetched first (index built by node_embedder.py with VECTOR_BINARY_INDEX), then reranked by exact distance
+    'label_column' is VectorColumn.label, LABEL_EXPRESSION on tables without the label column
+    """
     embedding_string = "[" + ','.join(str(x) for x in embedding) + "]"
 
+    # The predicate must be written exactly like the partial indexes' one to be able to use them
+    if not labels:
+        label_filter = ""
+    elif len(labels) == 1:
+        label_filter = f"WHERE {label_column} = %(label)s"
+    else:
+        label_filter = f"WHERE {label_column} = ANY(%(labels)s)"
+
     # Using vector search to find nodes 
     query = f"""
-        SELECT node_name, id, embedding
+        SELECT node_name, id, {label_column}, embedding <-> %(vector)s AS distance
         FROM document_vectors
+        {label_filter}
         ORDER BY embedding <-> %(vector)s
-        LIMIT 5;
+        LIMIT %(limit)s;
+    """
+    if rerank_candidates:
+        # The expression must be written exactly like the binary indexes' one to be able to use them
+        binary = f"binary_quantize(embedding)::bit({len(embedding)})"
+        query = f"""
+            SELECT node_name, id, label, embedding <-> %(vector)s AS distance FROM (
+                SELECT node_name, id, {label_column} AS label, embedding
+                FROM document_vectors
+                {label_filter}
+                ORDER BY {binary} <~> binary_quantize(%(vector)s::{storage})
+                LIMIT %(candidates)s
+            ) candidates
+            ORDER BY distance
+            LIMIT %(limit)s;
+        """
+    params = {
+        'vector': embedding_string,
+        'label': labels[0] if labels else None,
+        'labels': labels,
+        'limit': limit,
+        'candidates': max(rerank_candidates, limit),
+    }
+    return query, params
+
+def build_search_settings(ef_search: int = None, probes: int = None) -> list[tuple[str, tuple]]:
+    """Statements applying the ANN index knobs to the current transaction only, see search_settings_scope"""
+    # is_local = true: the setting only lasts until the end of the current transaction
+    settings = []
+    if ef_search is not None:
+        settings.append(("SELECT set_config('hnsw.ef_search', %s, true);", (str(ef_search),)))
+    if probes is not None:
+        settings.append(("SELECT set_config('ivfflat.probes', %s, true);", (str(probes),)))
+    return settings
+
+def search_settings_scope(conn: psycopg.Connection | psycopg.AsyncConnection, settings: list):
+    """
+    Block in which to apply 'settings' and run the search: a transaction (or a savepoint, when the connection
+    is already in one) rolled back on exit. Helper connections are never committed, so local settings
+    would otherwise last for every later query of the connection
+    """
+    if not settings:
+        return contextlib.nullcontext()
+    return conn.transaction(force_rollback=True)
+
+def parse_vsearch_results(results: list[tuple]) -> list[VectorMatch]:
+    count("rows", len(results), kind="vector")
+    with timed("decode", kind="vector"):
+        return [
+            {
+                "name": name.strip('"'),
+                "id": node_id.strip('"'),
+                "label": label,
+                "distance": distance,
+            }
+            for name, node_id, label, distance in results
+        ]
+
+def vsearch(
+    text: str,
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection,
+    embeddings: OpenAIEmbeddings,
+    labels: list[str] = None,
+    limit: int = 5,
+    embedding_cache: QueryEmbeddingCache = None,
+    ef_search: int = None,
+    probes: int = None,
+    rerank_candidates: int = None
+) -> list[VectorMatch] | None:
     """
+    Find the nodes closest to 'text' in embedding space, optionally restricted to some node labels
+    Query embeddings are served from 'embedding_cache' (or the module's default cache) when possible,
+    and shortened to the stored dimensions (see db/vector_storage.py)
+
+    Filtering on a single label (e.g. labels=["Drug"]) matches the per-label partial indexes built
+    by node_embedder.py, so only that label's vectors are visited
+
+    'ef_search' (HNSW index) and 'probes' (IVFFlat index) trade latency for recall, they default to
+    the server settings and apply to this search only: it then runs in a savepoint rolled back afterwards.
+    'rerank_candidates' (BINARY_RERANK_CANDIDATES by default) enables the binary quantized two-stage search
+
+    With a local vector index enabled, the search is exact and runs in-process, the database is only queried
+    when the local search fails
+    """
+    embedding_cache = embedding_cache or default_embedding_cache
+    embedding = embedding_cache.embed_query(text, embeddings)
+    if local_vector_index is not None:
+        try:
+            with timed("vector_search", backend="local"):
+                return local_vector_index.search(
+                    shorten_embedding(embedding, local_vector_index.meta["dimensions"]), labels, limit
+                )
+        except Exception as e:
+            # e.g. an export being replaced or removed, the database is searched instead
+            count("query_errors", error=type(e).__name__)
+            print(e)
 
     try:
-        cursor.execute(query, {'vector':embedding_string})
-        results = cursor.fetchall()
-        print(f"found {len(results)} results")
-        drug_of_interest = {}
-        drug_of_interest["name"] = results[0][0].strip('"')
-        drug_of_interest["id"] = results[0][1].strip('"')
-        print(textwrap.dedent(f"""
-        Top result:
-            Name: {drug_of_interest['name']}
-            ID: {drug_of_interest['id']}
-        """))
-        return drug_of_interest
+        column = refresh_vector_column(cursor)
+        query, params = build_vsearch_query(
+            shorten_embedding(embedding, column.dimensions), labels, limit,
+            BINARY_RERANK_CANDIDATES if rerank_candidates is None else rerank_candidates, column.storage,
+            column.label
+        )
+        settings = build_search_settings(ef_search, probes)
+        with search_settings_scope(conn, settings):
+            for setting_query, setting_params in settings:
+                cursor.execute(setting_query, setting_params)
+            with timed("vector_search", backend="database") as timer:
+                cursor.execute(query, params)
+            explain_if_slow(cursor, "vsearch", query, params, timer.seconds)
+            results = cursor.fetchall()
+        return parse_vsearch_results(results)
 
     except Exception as e:
+        count("query_errors", error=type(e).__name__)
         print(e)
         conn.rollback()
         return
+
+async def avsearch(
+    text: str,
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection,
+    embeddings: OpenAIEmbeddings,
+    labels: list[str] = None,
+    limit: int = 5,
+    embedding_cache: QueryEmbeddingCache = None,
+    ef_search: int = None,
+    probes: int = None,
+    rerank_candidates: int = None
+) -> list[VectorMatch] | None:
+    """Async variant of vsearch"""
+    embedding_cache = embedding_cache or default_embedding_cache
+    embedding = await embedding_cache.aembed_query(text, embeddings)
+    if local_vector_index is not None:
+        try:
+            with timed("vector_search", backend="local"):
+                return local_vector_index.search(
+                    shorten_embedding(embedding, local_vector_index.meta["dimensions"]), labels, limit
+                )
+        except Exception as e:
+            # e.g. an export being replaced or removed, the database is searched instead
+            count("query_errors", error=type(e).__name__)
+            print(e)
+
+    try:
+        column = await arefresh_vector_column(cursor)
+        query, params = build_vsearch_query(
+            shorten_embedding(embedding, column.dimensions), labels, limit,
+            BINARY_RERANK_CANDIDATES if rerank_candidates is None else rerank_candidates, column.storage,
+            column.label
+        )
+        settings = build_search_settings(ef_search, probes)
+        async with search_settings_scope(conn, settings):
+            for setting_query, setting_params in settings:
+                await cursor.execute(setting_query, setting_params)
+            with timed("vector_search", backend="database") as timer:
+                await cursor.execute(query, params)
+            await aexplain_if_slow(cursor, "vsearch", query, params, timer.seconds)
+            results = await cursor.fetchall()
+        return parse_vsearch_results(results)
+
+    except Exception as e:
+        count("query_errors", error=type(e).__name__)
+        print(e)
+        await conn.rollback()
+        return
+
+def vsearch_drug(
+    drug: str,
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection,
+    embeddings: OpenAIEmbeddings,
+    embedding_cache: QueryEmbeddingCache = None,
+    ef_search: int = None,
+    probes: int = None
+) -> NameWithID | None:
+    """
+    Search for the exact name and ID of a drug in the database
+    Only Drug vectors are searched, see vsearch for the other parameters
+    """
+    results = vsearch(
+        text = drug,
+        cursor = cursor,
+        conn = conn,
+        embeddings = embeddings,
+        labels = ["Drug"],
+        limit = 5,
+        embedding_cache = embedding_cache,
+        ef_search = ef_search,
+        probes = probes,
+    )
+    return top_drug_result(results)
+
+async def avsearch_drug(
+    drug: str,
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection,
+    embeddings: OpenAIEmbeddings,
+    embedding_cache: QueryEmbeddingCache = None,
+    ef_search: int = None,
+    probes: int = None
+) -> NameWithID | None:
+    """Async variant of vsearch_drug"""
+    results = await avsearch(
+        text = drug,
+        cursor = cursor,
+        conn = conn,
+        embeddings = embeddings,
+        labels = ["Drug"],
+        limit = 5,
+        embedding_cache = embedding_cache,
+        ef_search = ef_search,
+        probes = probes,
+    )
+    return top_drug_result(results)
+
+def top_drug_result(results: list[VectorMatch] | None) -> NameWithID | None:
+    if not results:
+        print("found 0 results")
+        return
+
+    print(f"found {len(results)} results")
+    drug_of_interest = {}
+    drug_of_interest["name"] = results[0]["name"]
+    drug_of_interest["id"] = results[0]["id"]
+    print(textwrap.dedent(f"""
+    Top result:
+        Name: {drug_of_interest['name']}
+        ID: {drug_of_interest['id']}
+    """))
+    return drug_of_interest
+
+# Lexical index of drug names tried by resolve_drug before any embedding, off until enable_name_index is called
+name_index: NameIndex | None = None
+
+# A lexical candidate is accepted without vector search above this score, when it is this far ahead of the next one
+LEXICAL_ACCEPT_SCORE = 0.75
+LEXICAL_ACCEPT_MARGIN = 0.1
+# Reciprocal rank fusion constant, higher values flatten the difference between ranks
+RANK_FUSION_K = 60
+
+def enable_name_index(cursor: psycopg.Cursor = None, labels: list[str] = None, **kwargs) -> NameIndex:
+    """
+    Index the names of the nodes of 'labels' (Drug by default) for resolve_drug, read from document_vectors
+    through 'cursor', or from the local vector index when no cursor is given. See NameIndex for the options
+    """
+    global name_index
+    labels = labels or ["Drug"]
+    if cursor is not None:
+        name_index = NameIndex.from_database(cursor, labels, **kwargs)
+    elif local_vector_index is not None:
+        name_index = NameIndex([
+            (name, node_id) for node_id, name, label in local_vector_index.nodes
+            if label in labels
+        ], **kwargs)
+    else:
+        raise ValueError("enable_name_index needs a cursor or an enabled local vector index")
+    print(f"Indexed {len(name_index)} names in {name_index.build_seconds:.1f}s")
+    return name_index
+
+async def aenable_name_index(cursor: psycopg.AsyncCursor, labels: list[str] = None, **kwargs) -> NameIndex:
+    """Async variant of enable_name_index, reading from document_vectors"""
+    global name_index
+    labels = labels or ["Drug"]
+    name_index = await NameIndex.afrom_database(cursor, labels, **kwargs)
+    print(f"Indexed {len(name_index)} names in {name_index.build_seconds:.1f}s")
+    return name_index
+
+def disable_name_index() -> None:
+    global name_index
+    name_index = None
+
+def accept_lexical_match(candidates: list[dict]) -> NameWithID | None:
+    """
+    The top lexical candidate if it is the only exact name match or a clear winner
+    Several exact matches (drugs sharing a name) are left to vector search and rank fusion
+    """
+    if not candidates:
+        return None
+    top = candidates[0]
+    runner_up = candidates[1]["score"] if len(candidates) > 1 else 0.0
+    if top["score"] >= 1.0:
+        accepted = runner_up < 1.0
+    else:
+        accepted = top["score"] >= LEXICAL_ACCEPT_SCORE and top["score"] - runner_up >= LEXICAL_ACCEPT_MARGIN
+    return {"name": top["name"], "id": top["id"]} if accepted else None
+
+def fuse_rankings(*rankings: list[dict]) -> list[NameWithID]:
+    """Merge ranked candidate lists with reciprocal rank fusion, candidates are matched by id"""
+    scores, names = {}, {}
+    for ranking in rankings:
+        for rank, candidate in enumerate(ranking):
+            scores[candidate["id"]] = scores.get(candidate["id"], 0.0) + 1.0 / (RANK_FUSION_K + rank + 1)
+            names.setdefault(candidate["id"], candidate["name"])
+    return [{"name": names[node_id], "id": node_id} for node_id in sorted(scores, key=scores.get, reverse=True)]
+
+def resolve_drug(
+    drug: str,
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection,
+    embeddings: OpenAIEmbeddings = None,
+    embedding_cache: QueryEmbeddingCache = None,
+    limit: int = 10
+) -> NameWithID | None:
+    """
+    Find the name and ID of a drug, trying the cheapest methods first:
+    an exact or normalized name match, then a clear fuzzy (trigram) match, both in-process,
+    and only then vector search, whose candidates are fused with the lexical ones by rank
+    Without a name index (see enable_name_index) this is the same as vsearch_drug
+    """
+    candidates = name_index.search(drug, limit) if name_index is not None else []
+    match = accept_lexical_match(candidates)
+    if match is not None:
+        count("drug_resolutions", method="lexical")
+        return match
+    if embeddings is None:
+        count("drug_resolutions", method="lexical_only")
+        return top_drug_result(candidates)
+    count("drug_resolutions", method="vector")
+
+    vector_results = vsearch(
+        text = drug,
+        cursor = cursor,
+        conn = conn,
+        embeddings = embeddings,
+        labels = ["Drug"],
+        limit = limit,
+        embedding_cache = embedding_cache,
+    ) or []
+    return top_drug_result(fuse_rankings(candidates, vector_results))
+
+async def aresolve_drug(
+    drug: str,
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection,
+    embeddings: OpenAIEmbeddings = None,
+    embedding_cache: QueryEmbeddingCache = None,
+    limit: int = 10
+) -> NameWithID | None:
+    """Async variant of resolve_drug"""
+    candidates = name_index.search(drug, limit) if name_index is not None else []
+    match = accept_lexical_match(candidates)
+    if match is not None:
+        count("drug_resolutions", method="lexical")
+        return match
+    if embeddings is None:
+        count("drug_resolutions", method="lexical_only")
+        return top_drug_result(candidates)
+    count("drug_resolutions", method="vector")
+
+    vector_results = await avsearch(
+        text = drug,
+        cursor = cursor,
+        conn = conn,
+        embeddings = embeddings,
+        labels = ["Drug"],
+        limit = limit,
+        embedding_cache = embedding_cache,
+    ) or []
+    return top_drug_result(fuse_rankings(candidates, vector_results))
     
+def parse_property_lists(
+    results: list[tuple],
+    props_and_paths: dict[str, list[str]]
+) -> list[dict[str, str]]:
+    """Parse agtype result rows into the output format described by 'props_and_paths'"""
+    count("rows", len(results), kind="properties")
+    with timed("decode", kind="properties"):
+        return _parse_property_lists(results, props_and_paths)
+
+def _parse_property_lists(
+    results: list[tuple],
+    props_and_paths: dict[str, list[str]]
+) -> list[dict[str, str]]:
+    output = []
+    # Parse all of the cursor's results into the desired output format
+    for res in results:
+        # Strip the text and load as json, unless the agtype loader already did
+        res = decode_agtype(res[0])
+        # Initialize the parsed result as an empty dictionary
+        parsed_res = {}
+        # Each desired property is extracted from the result and added to the dictionary
+        for prop, key_path in props_and_paths.items():
+            res_property = res
+            # Filter the result according to the key path of the property
+            for key in key_path:
+                res_property = res_property[key]
+            parsed_res[prop] = res_property
+        # The dictionary is added to the list of output dictionaries
+        output.append(parsed_res)
+    return output
+
+def parse_projected_rows(
+    results: list[tuple],
+    props: list[str]
+) -> list[dict[str, str]]:
+    """Parse rows of projected agtype columns, one column per property in 'props'"""
+    count("rows", len(results), kind="projected")
+    with timed("decode", kind="projected"):
+        return [dict(zip(props, map(decode_agtype, res))) for res in results]
+
+def get_projected_property_lists_from_query(
+    drug_id: str,
+    query: str,
+    props: list[str],
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> list[dict[str, str]] | None:
+    """
+    Faster variant of get_stripped_property_lists_from_query for queries returning only the needed
+    properties, one agtype column per entry of 'props' (see build_drug_query)
+    Wide nodes are never transferred nor parsed as a whole
+    """
+    refresh_active_graph(cursor, conn)
+    try:
+        execute_helper_query(cursor, query, params={
+            "cypher_params": json.dumps(
+                {
+                    "drug_id": drug_id,
+                }
+            )
+        })
+        return parse_projected_rows(cursor.fetchall(), props)
+
+    except Exception as e:
+        count("query_errors", error=type(e).__name__)
+        print(e)
+        conn.rollback()
+        return
+
+async def aget_projected_property_lists_from_query(
+    drug_id: str,
+    query: str,
+    props: list[str],
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection
+) -> list[dict[str, str]] | None:
+    """Async variant of get_projected_property_lists_from_query"""
+    await arefresh_active_graph(cursor, conn)
+    try:
+        await aexecute_helper_query(cursor, query, params={
+            "cypher_params": json.dumps(
+                {
+                    "drug_id": drug_id,
+                }
+            )
+        })
+        return parse_projected_rows(await cursor.fetchall(), props)
+
+    except Exception as e:
+        count("query_errors", error=type(e).__name__)
+        print(e)
+        await conn.rollback()
+        return
+
 def get_stripped_property_lists_from_query(
     drug_id: str,
     query: str,
@@ -123,64 +852,559 @@ def get_stripped_property_lists_from_query(
     The parsed result will be { 'name' :  res['properties']['name'], 'id' : res['properties']['id']] } 
     And the output will be a list containing all parsed results
     """
+    refresh_active_graph(cursor, conn)
     try:
-        cursor.execute(query,params={
+        execute_helper_query(cursor, query, params={
             "cypher_params": json.dumps(
                 {
                     "drug_id": drug_id,
                 }
             )
         })
-        results = cursor.fetchall()
-        output = []
-        # Parse all of the cursor's results into the desired output format
-        for res in results:
-            # Strip the text and load as json
-            res = re.sub(r'::\w+$', '', res[0])
-            res = json.loads(res)
-            # Initialize the parsed result as an empty dictionary
-            parsed_res = {}
-            # Each desired property is extracted from the result and added to the dictionary
-            for prop, key_path in props_and_paths.items():
-                res_property = res
-                # Filter the result according to the key path of the property
-                for key in key_path:
-                    res_property = res_property[key]
-                parsed_res[prop] = res_property
-            # The dictionary is added to the list of output dictionaries
-            output.append(parsed_res)
-        return output
+        return parse_property_lists(cursor.fetchall(), props_and_paths)
 
     except Exception as e:
+        count("query_errors", error=type(e).__name__)
         print(e)
         conn.rollback()
         return
 
-
-def get_generics(
+async def aget_stripped_property_lists_from_query(
     drug_id: str,
+    query: str,
+    props_and_paths: dict[str, list[str]],
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection
+) -> list[dict[str, str]] | None:
+    """Async variant of get_stripped_property_lists_from_query"""
+    await arefresh_active_graph(cursor, conn)
+    try:
+        await aexecute_helper_query(cursor, query, params={
+            "cypher_params": json.dumps(
+                {
+                    "drug_id": drug_id,
+                }
+            )
+        })
+        return parse_property_lists(await cursor.fetchall(), props_and_paths)
+
+    except Exception as e:
+        count("query_errors", error=type(e).__name__)
+        print(e)
+        await conn.rollback()
+        return
+
+
+def group_property_lists_by_drug(
+    drug_ids: list[str],
+    results: list[tuple],
+    props: list[str]
+) -> dict[str, list[dict[str, str]]]:
+    """Parse (drug id, *projected properties) rows into one result list per requested drug"""
+    count("rows", len(results), kind="batch")
+    with timed("decode", kind="batch"):
+        grouped = {drug_id: [] for drug_id in drug_ids}
+        for res in results:
+            drug_id = decode_agtype(res[0])
+            grouped.setdefault(drug_id, []).append(dict(zip(props, map(decode_agtype, res[1:]))))
+        return grouped
+
+def split_cached_drugs(
+    relation: str,
+    drug_ids: list[str],
+    use_cache: bool
+) -> tuple[dict[str, list[dict[str, str]]], list[str]]:
+    """Results of 'relation' already in the graph cache, and the drug ids still to be queried"""
+    if not use_cache:
+        return {}, list(drug_ids)
+    cached, missing = {}, []
+    for drug_id in drug_ids:
+        result = graph_cache.get(relation, drug_id)
+        if result is None:
+            missing.append(drug_id)
+        else:
+            cached[drug_id] = result
+    return cached, missing
+
+def merge_cached_drugs(
+    relation: str,
+    drug_ids: list[str],
+    cached: dict[str, list[dict[str, str]]],
+    queried: dict[str, list[dict[str, str]]],
+    use_cache: bool
+) -> dict[str, list[dict[str, str]]]:
+    """Store freshly queried results in the graph cache and merge them with the cached ones"""
+    if use_cache:
+        for drug_id, result in queried.items():
+            graph_cache.put(relation, drug_id, result)
+    merged = {**cached, **queried}
+    # Keep the requested order
+    return {drug_id: merged.get(drug_id, []) for drug_id in drug_ids}
+
+def get_relation_for_drugs(
+    relation: str,
+    drug_ids: list[str],
     cursor: psycopg.Cursor,
     conn: psycopg.Connection
-) -> list[NameWithID] | None:
-    """Find generic drugs using graph search"""
+) -> dict[str, list[dict[str, str]]] | None:
+    """
+    Batch variant of the per-drug helpers: run the query of 'relation' (a key of DRUG_RELATIONS)
+    for every drug in 'drug_ids' in a single round trip
+    Returns a dictionary mapping each drug id to the list its own helper would return
+    With the graph snapshot enabled, the query isn't run at all.
+    With the graph cache enabled, only the drugs missing from the cache are queried
+    """
+    use_cache = refresh_active_graph(cursor, conn) and graph_cache is not None
+    snapshot = snapshot_relation_for_drugs(relation, drug_ids)
+    if snapshot is not None:
+        return snapshot
+    cached, missing = split_cached_drugs(relation, drug_ids, use_cache)
+    if not missing:
+        return cached
 
-    query = f"""
+    query = DRUG_BATCH_QUERIES[relation]
+    try:
+        execute_helper_query(cursor, query["query"], params={
+            "cypher_params": json.dumps({"drug_ids": missing})
+        })
+        grouped = group_property_lists_by_drug(missing, cursor.fetchall(), query["props"])
+
+    except Exception as e:
+        count("query_errors", error=type(e).__name__)
+        print(e)
+        conn.rollback()
+        return
+
+    return merge_cached_drugs(relation, drug_ids, cached, grouped, use_cache)
+
+async def aget_relation_for_drugs(
+    relation: str,
+    drug_ids: list[str],
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection
+) -> dict[str, list[dict[str, str]]] | None:
+    """Async variant of get_relation_for_drugs"""
+    use_cache = await arefresh_active_graph(cursor, conn) and graph_cache is not None
+    snapshot = snapshot_relation_for_drugs(relation, drug_ids)
+    if snapshot is not None:
+        return snapshot
+    cached, missing = split_cached_drugs(relation, drug_ids, use_cache)
+    if not missing:
+        return cached
+
+    query = DRUG_BATCH_QUERIES[relation]
+    try:
+        await aexecute_helper_query(cursor, query["query"], params={
+            "cypher_params": json.dumps({"drug_ids": missing})
+        })
+        grouped = group_property_lists_by_drug(missing, await cursor.fetchall(), query["props"])
+
+    except Exception as e:
+        count("query_errors", error=type(e).__name__)
+        print(e)
+        await conn.rollback()
+        return
+
+    return merge_cached_drugs(relation, drug_ids, cached, grouped, use_cache)
+
+
+# Graph pattern, returned variable and result key paths of each per-drug relation
+# The pattern must bind the queried drug to 'd'
+NAME_AND_ID = {
+    "name": ["properties", "name"],
+    "id": ["properties", "id"],
+}
+DRUG_RELATIONS = {
+    "generics": {
+        "pattern": "(x:Drug)-[r:IsPartOfGenericGroup]->(g:GenericGroup)<-[q:IsPartOfGenericGroup]-(d:Drug)",
+        "returns": "x",
+        "props_and_paths": NAME_AND_ID,
+    },
+    "excipients": {
+        "pattern": "(d:Drug)-[r:ContainsExcipient]->(e:Excipient)",
+        "returns": "e",
+        "props_and_paths": NAME_AND_ID,
+    },
+    "indications": {
+        "pattern": "(d:Drug)-[r:HasIndication]->(i:Indication)",
+        "returns": "i",
+        "props_and_paths": {
+            "name": ["properties"],
+            "id": ["properties"],
+        },
+    },
+    "contraindications": {
+        "pattern": "(d:Drug)-[r:HasContraindication]->(c:Contraindication)",
+        "returns": "c",
+        "props_and_paths": {
+            "name": ["properties", "type"],
+            "id": ["properties", "id"],
+        },
+    },
+    "active_ingredients": {
+        "pattern": "(d:Drug)-[r:ContainsActiveIngredient]->(a:ActiveIngredient)",
+        "returns": "a",
+        "props_and_paths": NAME_AND_ID,
+    },
+    "routes": {
+        "pattern": "(d:Drug)-[r:IsAdministeredVia]->(a:ROA)",
+        "returns": "a",
+        "props_and_paths": NAME_AND_ID,
+    },
+}
+
+def project_key_path(variable: str, key_path: list[str]) -> str:
+    """
+    Cypher expression selecting a key path of a node directly in the query
+    ['properties', 'name'] becomes x.name and ['properties'] becomes properties(x)
+    """
+    if key_path == ["properties"]:
+        return f"properties({variable})"
+    if len(key_path) == 2 and key_path[0] == "properties":
+        return f"{variable}.{key_path[1]}"
+    raise ValueError(f"Key path {key_path} can't be projected")
+
+def build_return_clause(returns: str, props_and_paths: dict[str, list[str]]) -> tuple[str, str]:
+    """RETURN expressions and matching column definitions, one agtype column per property"""
+    # Aliased so that properties projected twice don't clash (indications return properties(i) twice)
+    expressions = ", ".join(
+        f"{project_key_path(returns, key_path)} AS c{i}" for i, key_path in enumerate(props_and_paths.values())
+    )
+    columns = ", ".join(f'"{prop}" agtype' for prop in props_and_paths)
+    return expressions, columns
+
+def build_drug_query(pattern: str, returns: str, props_and_paths: dict[str, list[str]]) -> str:
+    """Cypher query returning the needed properties of the nodes related to one drug, passed as $drug_id"""
+    expressions, columns = build_return_clause(returns, props_and_paths)
+    return f"""
     SELECT * FROM cypher('fcsv', $$ 
-        MATCH(x:Drug)-[r:IsPartOfGenericGroup]->(g:GenericGroup)<-[q:IsPartOfGenericGroup]-(d:Drug)
+        MATCH{pattern}
         WHERE d.id = $drug_id
-        RETURN x
-    $$, %(cypher_params)s) AS (x agtype);
+        RETURN {expressions}
+    $$, %(cypher_params)s) AS ({columns});
     """
 
-    props_and_paths = {
-        "name": ["properties", "name"],
-        "id": ["properties", "id"],
+def build_batch_drug_query(pattern: str, returns: str, props_and_paths: dict[str, list[str]]) -> str:
+    """Same as build_drug_query for a list of drugs, passed as $drug_ids, each row starting with the drug id"""
+    expressions, columns = build_return_clause(returns, props_and_paths)
+    return f"""
+    SELECT * FROM cypher('fcsv', $$ 
+        MATCH{pattern}
+        WHERE d.id IN $drug_ids
+        RETURN d.id AS drug_id, {expressions}
+    $$, %(cypher_params)s) AS (drug_id agtype, {columns});
+    """
+
+# Query and returned properties behind each per-drug helper, shared by the sync and async variants
+DRUG_QUERIES = {
+    relation: {
+        "query": build_drug_query(spec["pattern"], spec["returns"], spec["props_and_paths"]),
+        "props": list(spec["props_and_paths"]),
+    }
+    for relation, spec in DRUG_RELATIONS.items()
+}
+
+# Same for the multi-drug variants
+DRUG_BATCH_QUERIES = {
+    relation: {
+        "query": build_batch_drug_query(spec["pattern"], spec["returns"], spec["props_and_paths"]),
+        "props": list(spec["props_and_paths"]),
     }
+    for relation, spec in DRUG_RELATIONS.items()
+}
 
-    result = get_stripped_property_lists_from_query(
+# All of a drug's neighbour sets in one query: the drug is matched once, then each
+# relation is collected in turn so that the row count stays at one
+DRUG_PROFILE_QUERY = """
+    SELECT * FROM cypher('fcsv', $$ 
+        MATCH(d:Drug)
+        WHERE d.id = $drug_id
+        OPTIONAL MATCH(d)-[:IsPartOfGenericGroup]->(:GenericGroup)<-[:IsPartOfGenericGroup]-(x:Drug)
+        WITH d, collect(properties(x)) AS generics
+        OPTIONAL MATCH(d)-[:ContainsExcipient]->(e:Excipient)
+        WITH d, generics, collect(properties(e)) AS excipients
+        OPTIONAL MATCH(d)-[:HasIndication]->(i:Indication)
+        WITH d, generics, excipients, collect(properties(i)) AS indications
+        OPTIONAL MATCH(d)-[:HasContraindication]->(c:Contraindication)
+        WITH d, generics, excipients, indications, collect(properties(c)) AS contraindications
+        OPTIONAL MATCH(d)-[:ContainsActiveIngredient]->(a:ActiveIngredient)
+        WITH d, generics, excipients, indications, contraindications, collect(properties(a)) AS active_ingredients
+        OPTIONAL MATCH(d)-[:IsAdministeredVia]->(r:ROA)
+        RETURN properties(d), generics, excipients, indications, contraindications, active_ingredients,
+               collect(properties(r))
+    $$, %(cypher_params)s) AS (
+        drug agtype, generics agtype, excipients agtype, indications agtype,
+        contraindications agtype, active_ingredients agtype, routes agtype
+    );
+"""
+
+# Column order of DRUG_PROFILE_QUERY after the drug itself
+DRUG_PROFILE_RELATIONS = [
+    "generics", "excipients", "indications", "contraindications", "active_ingredients", "routes"
+]
+
+# Label of each registry query in the metrics
+QUERY_NAMES = {
+    **{spec["query"]: relation for relation, spec in DRUG_QUERIES.items()},
+    **{spec["query"]: f"{relation}_for_drugs" for relation, spec in DRUG_BATCH_QUERIES.items()},
+    DRUG_PROFILE_QUERY: "drug_profile",
+}
+
+
+# Written by db/container/csv_loader.py after each reload. Each reload is built into a new
+# "fcsv_v{version}" graph, and the row of the "fcsv" alias then points to it in a single transaction.
+# to_jsonb keeps the query valid on tables created before the active_graph column existed
+GRAPH_ALIAS = "fcsv"
+GRAPH_VERSION_TABLE_QUERY = "SELECT to_regclass('public.graph_version') IS NOT NULL;"
+GRAPH_VERSION_QUERY = """
+    SELECT version, COALESCE(to_jsonb(g) ->> 'active_graph', graph_name)
+    FROM public.graph_version g WHERE graph_name = %s;
+"""
+
+class ActiveGraph:
+    """
+    Graph currently served under GRAPH_ALIAS, looked up again at most every 'check_interval' seconds
+    so that a reload is picked up without restarting the API
+    """
+
+    def __init__(self, alias: str = GRAPH_ALIAS, check_interval: float = 5.0):
+        self.alias = alias
+        self.name = alias
+        self.version = None
+        self.check_interval = check_interval
+        self.checked_at = None
+
+    def is_stale(self) -> bool:
+        return self.checked_at is None or time.monotonic() - self.checked_at > self.check_interval
+
+    def update(self, version: int, name: str) -> None:
+        self.version = version
+        self.name = name
+        self.checked_at = time.monotonic()
+
+active_graph = ActiveGraph()
+
+@functools.lru_cache(maxsize=256)
+def _rename_graph(query: str, graph_name: str) -> str:
+    return query.replace(f"cypher('{GRAPH_ALIAS}',", f"cypher('{graph_name}',")
+
+def for_active_graph(query: str) -> str:
+    """Point the Cypher calls of a query written against GRAPH_ALIAS to the active graph"""
+    if active_graph.name == GRAPH_ALIAS:
+        return query
+    return _rename_graph(query, active_graph.name)
+
+# Helper queries run as prepared statements: each connection parses the Cypher and plans the query
+# once, later calls only send the parameter map. FPKG_PREPARE_QUERIES=0 leaves it to psycopg, which
+# prepares a query after prepare_threshold (5) executions on the connection
+PREPARE_QUERIES = os.environ.get("FPKG_PREPARE_QUERIES", "1") != "0"
+
+def prepare_mode() -> bool | None:
+    # None rather than False, which would also turn psycopg's automatic preparation off
+    return True if PREPARE_QUERIES else None
+
+def execute_helper_query(cursor: psycopg.Cursor, query: str, params: dict) -> None:
+    """Run a query of the registry on the active graph, prepared on the cursor's connection"""
+    name = QUERY_NAMES.get(query, "other")
+    query = for_active_graph(query)
+    with timed("sql", query=name) as timer:
+        cursor.execute(query, params, prepare=prepare_mode())
+    explain_if_slow(cursor, name, query, params, timer.seconds)
+
+async def aexecute_helper_query(cursor: psycopg.AsyncCursor, query: str, params: dict) -> None:
+    """Async variant of execute_helper_query"""
+    name = QUERY_NAMES.get(query, "other")
+    query = for_active_graph(query)
+    with timed("sql", query=name) as timer:
+        await cursor.execute(query, params, prepare=prepare_mode())
+    await aexplain_if_slow(cursor, name, query, params, timer.seconds)
+
+def registered_queries() -> list[tuple[str, dict]]:
+    """Every helper query with parameters matching no drug, used to prepare them ahead of the first call"""
+    no_drug = {"cypher_params": json.dumps({"drug_id": "", "drug_ids": []})}
+    queries = [spec["query"] for spec in DRUG_QUERIES.values()]
+    queries += [spec["query"] for spec in DRUG_BATCH_QUERIES.values()]
+    queries.append(DRUG_PROFILE_QUERY)
+    return [(query, no_drug) for query in queries]
+
+def prepare_helper_queries(conn: psycopg.Connection) -> None:
+    """Prepare every helper query on a connection, e.g. when a pool opens it"""
+    with conn.cursor() as cursor:
+        refresh_active_graph(cursor, conn)
+        for query, params in registered_queries():
+            execute_helper_query(cursor, query, params)
+    conn.commit()
+
+async def aprepare_helper_queries(conn: psycopg.AsyncConnection) -> None:
+    """Async variant of prepare_helper_queries"""
+    async with conn.cursor() as cursor:
+        await arefresh_active_graph(cursor, conn)
+        for query, params in registered_queries():
+            await aexecute_helper_query(cursor, query, params)
+    await conn.commit()
+
+def get_graph_state(cursor: psycopg.Cursor, graph_name: str = GRAPH_ALIAS) -> tuple[int, str]:
+    """Version stamp and active graph of the alias, (0, alias) if the loader never recorded one"""
+    cursor.execute(GRAPH_VERSION_TABLE_QUERY)
+    if not cursor.fetchone()[0]:
+        return 0, graph_name
+    cursor.execute(GRAPH_VERSION_QUERY, (graph_name,))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (0, graph_name)
+
+async def aget_graph_state(cursor: psycopg.AsyncCursor, graph_name: str = GRAPH_ALIAS) -> tuple[int, str]:
+    """Async variant of get_graph_state"""
+    await cursor.execute(GRAPH_VERSION_TABLE_QUERY)
+    if not (await cursor.fetchone())[0]:
+        return 0, graph_name
+    await cursor.execute(GRAPH_VERSION_QUERY, (graph_name,))
+    row = await cursor.fetchone()
+    return (row[0], row[1]) if row else (0, graph_name)
+
+def get_graph_version(cursor: psycopg.Cursor, graph_name: str = GRAPH_ALIAS) -> int:
+    """Version stamp of the graph, 0 if the loader never recorded one"""
+    return get_graph_state(cursor, graph_name)[0]
+
+async def aget_graph_version(cursor: psycopg.AsyncCursor, graph_name: str = GRAPH_ALIAS) -> int:
+    """Async variant of get_graph_version"""
+    return (await aget_graph_state(cursor, graph_name))[0]
+
+def update_graph_state(version: int, name: str) -> None:
+    active_graph.update(version, name)
+    if graph_cache is not None:
+        graph_cache.update_version(version)
+
+def refresh_active_graph(cursor: psycopg.Cursor, conn: psycopg.Connection) -> bool:
+    """
+    Look the active graph and its version up again if it is due
+    Returns False if the lookup failed, the previous graph is then still used but the cache can't be trusted
+    """
+    if active_graph.is_stale() or (graph_cache is not None and graph_cache.version_is_stale()):
+        try:
+            update_graph_state(*get_graph_state(cursor))
+        except Exception as e:
+            count("query_errors", error=type(e).__name__)
+            print(e)
+            conn.rollback()
+            return False
+    return True
+
+async def arefresh_active_graph(cursor: psycopg.AsyncCursor, conn: psycopg.AsyncConnection) -> bool:
+    """Async variant of refresh_active_graph"""
+    if active_graph.is_stale() or (graph_cache is not None and graph_cache.version_is_stale()):
+        try:
+            update_graph_state(*(await aget_graph_state(cursor)))
+        except Exception as e:
+            count("query_errors", error=type(e).__name__)
+            print(e)
+            await conn.rollback()
+            return False
+    return True
+
+def enable_graph_snapshot(cursor: psycopg.Cursor = None, csv_dir: str = None) -> GraphSnapshot:
+    """
+    Answer the per-drug helpers from an in-memory snapshot of the active graph, read through 'cursor',
+    or of the CSV files of 'csv_dir'. A database snapshot is bypassed once the graph is reloaded,
+    a CSV snapshot is used until it is disabled. Anything else still goes through Cypher
+    """
+    global graph_snapshot
+    if csv_dir is not None:
+        graph_snapshot = GraphSnapshot.from_csv(csv_dir, DRUG_RELATIONS)
+    else:
+        version, graph_name = get_graph_state(cursor)
+        graph_snapshot = GraphSnapshot.from_database(cursor, graph_name, DRUG_RELATIONS, version)
+        cursor.connection.rollback()
+    return graph_snapshot
+
+async def aenable_graph_snapshot(cursor: psycopg.AsyncCursor = None, csv_dir: str = None) -> GraphSnapshot:
+    """Async variant of enable_graph_snapshot"""
+    global graph_snapshot
+    if csv_dir is not None:
+        graph_snapshot = GraphSnapshot.from_csv(csv_dir, DRUG_RELATIONS)
+    else:
+        version, graph_name = await aget_graph_state(cursor)
+        graph_snapshot = await GraphSnapshot.afrom_database(cursor, graph_name, DRUG_RELATIONS, version)
+        await cursor.connection.rollback()
+    return graph_snapshot
+
+def disable_graph_snapshot() -> None:
+    global graph_snapshot
+    graph_snapshot = None
+
+def snapshot_relation_for_drugs(relation: str, drug_ids: list[str]) -> dict[str, list[dict[str, str]]] | None:
+    """Results of 'relation' from the graph snapshot, None if there is none, it is stale or can't answer"""
+    if graph_snapshot is None:
+        return None
+    if graph_snapshot.version is not None and graph_snapshot.version != active_graph.version:
+        return None
+    return graph_snapshot.relation_for_drugs(relation, drug_ids)
+
+def get_drug_relation(
+    relation: str,
+    drug_id: str,
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> list[dict[str, str]] | None:
+    """
+    Run the query of 'relation' (a key of DRUG_RELATIONS) for one drug, answered by the graph snapshot
+    or the graph cache when they are enabled
+    """
+    use_cache = refresh_active_graph(cursor, conn) and graph_cache is not None
+    snapshot = snapshot_relation_for_drugs(relation, [drug_id])
+    if snapshot is not None:
+        return snapshot[drug_id]
+    if use_cache:
+        result = graph_cache.get(relation, drug_id)
+        if result is not None:
+            return result
+
+    result = get_projected_property_lists_from_query(
+        drug_id = drug_id,
+        **DRUG_QUERIES[relation],
+        cursor = cursor,
+        conn = conn,
+    )
+    if use_cache:
+        graph_cache.put(relation, drug_id, result)
+    return result
+
+async def aget_drug_relation(
+    relation: str,
+    drug_id: str,
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection
+) -> list[dict[str, str]] | None:
+    """Async variant of get_drug_relation"""
+    use_cache = await arefresh_active_graph(cursor, conn) and graph_cache is not None
+    snapshot = snapshot_relation_for_drugs(relation, [drug_id])
+    if snapshot is not None:
+        return snapshot[drug_id]
+    if use_cache:
+        result = graph_cache.get(relation, drug_id)
+        if result is not None:
+            return result
+
+    result = await aget_projected_property_lists_from_query(
+        drug_id = drug_id,
+        **DRUG_QUERIES[relation],
+        cursor = cursor,
+        conn = conn,
+    )
+    if use_cache:
+        graph_cache.put(relation, drug_id, result)
+    return result
+
+
+def get_generics(
+    drug_id: str,
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> list[NameWithID] | None:
+    """Find generic drugs using graph search"""
+
+    result = get_drug_relation(
+        relation = "generics",
         drug_id = drug_id,
-        query = query,
-        props_and_paths = props_and_paths,
         cursor = cursor,
         conn = conn,
     )
@@ -196,23 +1420,9 @@ def get_excipients(
 ) -> list[NameWithID]:
     """Find a drugs' ingredients using graph search"""
 
-    query = f"""
-    SELECT * FROM cypher('fcsv', $$ 
-        MATCH(d:Drug)-[r:ContainsExcipient]->(e:Excipient)
-        WHERE d.id = $drug_id
-        RETURN e
-    $$, %(cypher_params)s) AS (x agtype);
-    """
-
-    props_and_paths = {
-        "name": ["properties", "name"],
-        "id": ["properties", "id"],
-    }
-
-    result = get_stripped_property_lists_from_query(
+    result = get_drug_relation(
+        relation = "excipients",
         drug_id = drug_id,
-        query = query,
-        props_and_paths = props_and_paths,
         cursor = cursor,
         conn = conn,
     )
@@ -226,23 +1436,9 @@ def get_indications(
 ) -> list[NameWithID]:
     """Find a drug's indications using graph search"""
 
-    query = f"""
-    SELECT * FROM cypher('fcsv', $$ 
-        MATCH(d:Drug)-[r:HasIndication]->(i:Indication)
-        WHERE d.id = $drug_id
-        RETURN i
-    $$, %(cypher_params)s) AS (x agtype);
-    """
-
-    props_and_paths = {
-        "name": ["properties"],
-        "id": ["properties"],
-    }
-
-    result = get_stripped_property_lists_from_query(
+    result = get_drug_relation(
+        relation = "indications",
         drug_id = drug_id,
-        query = query,
-        props_and_paths = props_and_paths,
         cursor = cursor,
         conn = conn,
     )
@@ -256,27 +1452,260 @@ def get_contraindications(
 ) -> list[NameWithID]:
     """Find a drug's contraindications using graph search"""
 
-    query = f"""
-    SELECT * FROM cypher('fcsv', $$ 
-        MATCH(d:Drug)-[r:HasContraindication]->(c:Contraindication)
-        WHERE d.id = $drug_id
-        RETURN c
-    $$, %(cypher_params)s) AS (x agtype);
-    """
+    result = get_drug_relation(
+        relation = "contraindications",
+        drug_id = drug_id,
+        cursor = cursor,
+        conn = conn,
+    )
 
-    props_and_paths = {
-        "name": ["properties", "type"],
-        "id": ["properties", "id"],
-    }
+    return result
 
-    result = get_stripped_property_lists_from_query(
+
+def get_active_ingredients(
+    drug_id: str,
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> list[NameWithID]:
+    """Find a drug's active ingredients using graph search"""
+
+    result = get_drug_relation(
+        relation = "active_ingredients",
         drug_id = drug_id,
-        query = query,
-        props_and_paths = props_and_paths,
         cursor = cursor,
         conn = conn,
     )
 
     return result
 
+def get_routes(
+    drug_id: str,
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> list[NameWithID]:
+    """Find a drug's routes of administration using graph search"""
+
+    result = get_drug_relation(
+        relation = "routes",
+        drug_id = drug_id,
+        cursor = cursor,
+        conn = conn,
+    )
+
+    return result
+
+
+def get_generics_for_drugs(
+    drug_ids: list[str],
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> dict[str, list[NameWithID]] | None:
+    """Find the generics of several drugs in one query, grouped by drug id"""
+    return get_relation_for_drugs("generics", drug_ids, cursor, conn)
+
+def get_excipients_for_drugs(
+    drug_ids: list[str],
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> dict[str, list[NameWithID]] | None:
+    """Find the excipients of several drugs in one query, grouped by drug id"""
+    return get_relation_for_drugs("excipients", drug_ids, cursor, conn)
+
+def get_indications_for_drugs(
+    drug_ids: list[str],
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> dict[str, list[dict]] | None:
+    """Find the indications of several drugs in one query, grouped by drug id"""
+    return get_relation_for_drugs("indications", drug_ids, cursor, conn)
+
+def get_contraindications_for_drugs(
+    drug_ids: list[str],
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> dict[str, list[NameWithID]] | None:
+    """Find the contraindications of several drugs in one query, grouped by drug id"""
+    return get_relation_for_drugs("contraindications", drug_ids, cursor, conn)
+
+def get_active_ingredients_for_drugs(
+    drug_ids: list[str],
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> dict[str, list[NameWithID]] | None:
+    """Find the active ingredients of several drugs in one query, grouped by drug id"""
+    return get_relation_for_drugs("active_ingredients", drug_ids, cursor, conn)
+
+def get_routes_for_drugs(
+    drug_ids: list[str],
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> dict[str, list[NameWithID]] | None:
+    """Find the routes of administration of several drugs in one query, grouped by drug id"""
+    return get_relation_for_drugs("routes", drug_ids, cursor, conn)
+
+
+class DrugProfile(TypedDict):
+    drug:dict
+    generics:list[NameWithID]
+    excipients:list[NameWithID]
+    indications:list[dict]
+    contraindications:list[NameWithID]
+    active_ingredients:list[NameWithID]
+    routes:list[NameWithID]
+
+def parse_drug_profile(row: tuple | None) -> DrugProfile | None:
+    """
+    Parse the single row of DRUG_PROFILE_QUERY
+    Each relation is shaped like the result of its own helper (get_generics, get_indications...)
+    """
+    if row is None:
+        return None
+    with timed("decode", kind="profile"):
+        columns = [decode_agtype(column) for column in row]
+        profile = {"drug": columns[0]}
+        for relation, properties_list in zip(DRUG_PROFILE_RELATIONS, columns[1:]):
+            # The query collects properties maps, wrap them back like full vertices for the key paths
+            profile[relation] = _parse_property_lists(
+                [({"properties": properties},) for properties in properties_list],
+                DRUG_RELATIONS[relation]["props_and_paths"],
+            )
+        count("rows", sum(len(profile[relation]) for relation in DRUG_PROFILE_RELATIONS), kind="profile")
+        return profile
+
+def get_drug_profile(
+    drug_id: str,
+    cursor: psycopg.Cursor,
+    conn: psycopg.Connection
+) -> DrugProfile | None:
+    """
+    Build a full drug card in a single round trip: the drug's properties, generics, excipients,
+    indications, contraindications, active ingredients and routes of administration
+    """
+    use_cache = refresh_active_graph(cursor, conn) and graph_cache is not None
+    if use_cache:
+        profile = graph_cache.get("profile", drug_id)
+        if profile is not None:
+            return profile
+
+    try:
+        execute_helper_query(cursor, DRUG_PROFILE_QUERY, params={
+            "cypher_params": json.dumps({"drug_id": drug_id})
+        })
+        profile = parse_drug_profile(cursor.fetchone())
+
+    except Exception as e:
+        count("query_errors", error=type(e).__name__)
+        print(e)
+        conn.rollback()
+        return
+
+    if use_cache:
+        graph_cache.put("profile", drug_id, profile)
+    return profile
+
+
+async def aget_generics(
+    drug_id: str,
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection
+) -> list[NameWithID] | None:
+    """Async variant of get_generics"""
+    return await aget_drug_relation(
+        relation = "generics",
+        drug_id = drug_id,
+        cursor = cursor,
+        conn = conn,
+    )
+
+async def aget_excipients(
+    drug_id: str,
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection
+) -> list[NameWithID] | None:
+    """Async variant of get_excipients"""
+    return await aget_drug_relation(
+        relation = "excipients",
+        drug_id = drug_id,
+        cursor = cursor,
+        conn = conn,
+    )
+
+async def aget_indications(
+    drug_id: str,
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection
+) -> list[NameWithID] | None:
+    """Async variant of get_indications"""
+    return await aget_drug_relation(
+        relation = "indications",
+        drug_id = drug_id,
+        cursor = cursor,
+        conn = conn,
+    )
+
+async def aget_contraindications(
+    drug_id: str,
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection
+) -> list[NameWithID] | None:
+    """Async variant of get_contraindications"""
+    return await aget_drug_relation(
+        relation = "contraindications",
+        drug_id = drug_id,
+        cursor = cursor,
+        conn = conn,
+    )
+
+async def aget_active_ingredients(
+    drug_id: str,
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection
+) -> list[NameWithID] | None:
+    """Async variant of get_active_ingredients"""
+    return await aget_drug_relation(
+        relation = "active_ingredients",
+        drug_id = drug_id,
+        cursor = cursor,
+        conn = conn,
+    )
+
+async def aget_routes(
+    drug_id: str,
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection
+) -> list[NameWithID] | None:
+    """Async variant of get_routes"""
+    return await aget_drug_relation(
+        relation = "routes",
+        drug_id = drug_id,
+        cursor = cursor,
+        conn = conn,
+    )
+
+async def aget_drug_profile(
+    drug_id: str,
+    cursor: psycopg.AsyncCursor,
+    conn: psycopg.AsyncConnection
+) -> DrugProfile | None:
+    """Async variant of get_drug_profile"""
+    use_cache = await arefresh_active_graph(cursor, conn) and graph_cache is not None
+    if use_cache:
+        profile = graph_cache.get("profile", drug_id)
+        if profile is not None:
+            return profile
+
+    try:
+        await aexecute_helper_query(cursor, DRUG_PROFILE_QUERY, params={
+            "cypher_params": json.dumps({"drug_id": drug_id})
+        })
+        profile = parse_drug_profile(await cursor.fetchone())
+
+    except Exception as e:
+        count("query_errors", error=type(e).__name__)
+        print(e)
+        await conn.rollback()
+        return
 
+    if use_cache:
+        graph_cache.put("profile", drug_id, profile)
+    return profile
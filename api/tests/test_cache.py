@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from src.cache import GraphCache, QueryEmbeddingCache
+
+# Graph and query embedding caches, on temporary files:
+#
+#   python -m unittest discover -s tests -t .      (from the api directory)
+
+
+class CountingEmbeddings:
+    model = "stub"
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [0.5, 0.25]
+
+    async def aembed_query(self, text):
+        self.calls += 1
+        return [0.5, 0.25]
+
+
+class GraphCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = GraphCache("memory")
+        self.cache.update_version(1)
+
+    def test_hits_are_copies(self):
+        self.cache.put("generics", "1", [{"name": "B", "id": "2"}, {"name": "A", "id": "3"}])
+        first = self.cache.get("generics", "1")
+        first.sort(key=lambda row: row["name"])
+        first[0]["name"] = "changed"
+        self.assertEqual(self.cache.get("generics", "1"), [{"name": "B", "id": "2"}, {"name": "A", "id": "3"}])
+
+    def test_stored_value_is_a_copy(self):
+        value = [{"name": "B", "id": "2"}]
+        self.cache.put("generics", "1", value)
+        value.append({"name": "A", "id": "3"})
+        self.assertEqual(self.cache.get("generics", "1"), [{"name": "B", "id": "2"}])
+
+    def test_version_change_invalidates(self):
+        self.cache.put("generics", "1", [])
+        self.cache.update_version(2)
+        self.assertIsNone(self.cache.get("generics", "1"))
+
+
+class QueryEmbeddingCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.path = os.path.join(cache_dir.name, "embeddings.sqlite3")
+
+    async def test_async_disk_level_shared(self):
+        embeddings = CountingEmbeddings()
+        first = QueryEmbeddingCache(self.path)
+        self.addCleanup(first.close)
+        self.assertEqual(await first.aembed_query("Doliprane ", embeddings), [0.5, 0.25])
+        self.assertEqual(await first.aembed_query("doliprane", embeddings), [0.5, 0.25])
+
+        second = QueryEmbeddingCache(self.path)
+        self.addCleanup(second.close)
+        self.assertEqual(await second.aembed_query("DOLIPRANE", embeddings), [0.5, 0.25])
+        self.assertEqual(embeddings.calls, 1)
+        self.assertEqual(second.stats()["disk_hits"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
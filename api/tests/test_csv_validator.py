@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+import unittest
+
+# The validator is a script of the loader image, in db/container
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "db", "container"))
+from csv_validator import validate_csv_dir, validate_file
+
+# CSV checks run before the load, on temporary files:
+#
+#   python -m unittest discover -s tests -t .      (from the api directory)
+
+MODEL = """## Node Properties
+### Drug
+- `id`
+- `name`
+"""
+
+
+class CsvValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.csv_dir = os.path.join(tmp_dir.name, "csv")
+        self.out_dir = os.path.join(tmp_dir.name, "csv_clean")
+        for kind in ("nodes", "edges"):
+            os.makedirs(os.path.join(self.csv_dir, kind))
+        with open(os.path.join(self.csv_dir, "model.md"), "w", encoding="utf-8") as f:
+            f.write(MODEL)
+
+    def write_nodes(self, label, text):
+        path = os.path.join(self.csv_dir, "nodes", f"{label}.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+        return path
+
+    def test_invalid_rows_left_out(self):
+        path = self.write_nodes("Drug", "id,name\n1,DOLIPRANE\nx,EFFERALGAN\n1,ASPEGIC\n")
+        out_path = os.path.join(self.csv_dir, "Drug.clean.csv")
+        result = validate_file("nodes", "Drug", path, out_path, ({"Drug": ["id", "name"]}, {}))
+        self.assertEqual((result["rows"], result["written"]), (3, 1))
+        self.assertEqual([line for line, _ in result["errors"]], [3, 4])
+        with open(out_path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "id,name\n1,DOLIPRANE\n")
+
+    def test_header_error_writes_no_clean_file(self):
+        path = self.write_nodes("Drug", "name,id\nDOLIPRANE,1\n")
+        out_path = os.path.join(self.csv_dir, "Drug.clean.csv")
+        result = validate_file("nodes", "Drug", path, out_path, ({"Drug": ["id", "name"]}, {}))
+        self.assertTrue(result["header_errors"])
+        self.assertFalse(os.path.exists(out_path))
+
+    def test_header_error_is_fatal(self):
+        self.write_nodes("Drug", "name,id\nDOLIPRANE,1\nEFFERALGAN,2\n")
+        with self.assertRaises(RuntimeError):
+            validate_csv_dir(self.csv_dir, self.out_dir, workers=1)
+        self.assertTrue(os.path.exists(os.path.join(self.out_dir, "validation_errors.csv")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import csv
+import os
+import tempfile
+import unittest
+
+from src.graph_snapshot import GraphSnapshot, parse_pattern
+from src.utils import DRUG_RELATIONS
+
+# In-process graph snapshot, loaded from a few CSV files in the loader's format:
+#
+#   python -m unittest discover -s tests -t .      (from the api directory)
+
+NODES = {
+    "Drug": [["id", "name"], ["1", "DOLIPRANE"], ["2", "EFFERALGAN"], ["3", "ASPEGIC"]],
+    "GenericGroup": [["id", "name"], ["10", "PARACETAMOL"]],
+    "Excipient": [["id", "name"], ["20", "AMIDON"], ["21", "TALC"]],
+}
+EDGES = {
+    "IsPartOfGenericGroup": [
+        ["start_id", "start_vertex_type", "end_id", "end_vertex_type"],
+        ["1", "Drug", "10", "GenericGroup"],
+        ["2", "Drug", "10", "GenericGroup"],
+    ],
+    "ContainsExcipient": [
+        ["start_id", "start_vertex_type", "end_id", "end_vertex_type"],
+        ["1", "Drug", "20", "Excipient"],
+        ["1", "Drug", "21", "Excipient"],
+    ],
+}
+
+
+def write_csv_dir(csv_dir):
+    for kind, files in (("nodes", NODES), ("edges", EDGES)):
+        os.makedirs(os.path.join(csv_dir, kind))
+        for label, rows in files.items():
+            with open(os.path.join(csv_dir, kind, f"{label}.csv"), "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(rows)
+
+
+class GraphSnapshotTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        csv_dir = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(csv_dir.cleanup)
+        write_csv_dir(csv_dir.name)
+        cls.snapshot = GraphSnapshot.from_csv(csv_dir.name, DRUG_RELATIONS)
+
+    def test_parse_pattern(self):
+        self.assertEqual(
+            parse_pattern("(d:Drug)-[r:HasIndication]->(i:Indication)"),
+            ([("d", "Drug"), ("i", "Indication")], [("HasIndication", True)])
+        )
+        self.assertIsNone(parse_pattern("(d:Drug)<-[r:HasIndication]->(i:Indication)"))
+
+    def test_generics_exclude_the_drug_itself(self):
+        # The path back to the drug would use its own edge to the group twice
+        self.assertEqual(self.snapshot.relation("generics", "1"), [{"name": "EFFERALGAN", "id": "2"}])
+
+    def test_relation_for_drugs(self):
+        results = self.snapshot.relation_for_drugs("excipients", ["3", "1", "99"])
+        self.assertEqual(list(results), ["3", "1", "99"])
+        self.assertEqual(results["3"], [])
+        self.assertEqual(sorted(row["name"] for row in results["1"]), ["AMIDON", "TALC"])
+        self.assertEqual(results["99"], [])
+
+    def test_unknown_relation(self):
+        self.assertIsNone(self.snapshot.relation_for_drugs("unknown", ["1"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from src.name_index import NameIndex
+from src.utils import accept_lexical_match
+
+# Lexical drug resolution: ranking of NameIndex.search and the acceptance rule of resolve_drug.
+# No database needed:
+#
+#   python -m unittest discover -s tests -t .      (from the api directory)
+
+
+class NameIndexTest(unittest.TestCase):
+
+    def test_ties_ordered_by_id(self):
+        entries = [("DOLIPRANE 1000 mg, comprimé", "30"), ("Doliprane 1000 mg comprime", "12")]
+        for order in (entries, entries[::-1]):
+            results = NameIndex(order).search("doliprane 1000 mg comprimé")
+            self.assertEqual([result["id"] for result in results], ["12", "30"])
+            self.assertEqual([result["score"] for result in results], [1.0, 1.0])
+
+    def test_exact_before_base_name(self):
+        index = NameIndex([("DOLIPRANE 500 mg, gélule", "1"), ("DOLIPRANE", "2")])
+        results = index.search("Doliprane")
+        self.assertEqual([(result["id"], result["score"]) for result in results[:2]], [("2", 1.0), ("1", 0.9)])
+
+
+class AcceptLexicalMatchTest(unittest.TestCase):
+
+    def test_single_exact_match_accepted(self):
+        index = NameIndex([("DOLIPRANE 500 mg, gélule", "1"), ("DOLIPRANE", "2")])
+        self.assertEqual(accept_lexical_match(index.search("doliprane")), {"name": "DOLIPRANE", "id": "2"})
+
+    def test_shared_exact_name_left_to_vector_search(self):
+        index = NameIndex([("DOLIPRANE", "1"), ("DOLIPRANE", "2")])
+        self.assertIsNone(accept_lexical_match(index.search("doliprane")))
+
+    def test_close_fuzzy_candidates_rejected(self):
+        candidates = [{"name": "A", "id": "1", "score": 0.8}, {"name": "B", "id": "2", "score": 0.75}]
+        self.assertIsNone(accept_lexical_match(candidates))
+
+    def test_clear_fuzzy_winner_accepted(self):
+        candidates = [{"name": "A", "id": "1", "score": 0.8}, {"name": "B", "id": "2", "score": 0.4}]
+        self.assertEqual(accept_lexical_match(candidates), {"name": "A", "id": "1"})
+
+    def test_no_candidates(self):
+        self.assertIsNone(accept_lexical_match([]))
+
+
+if __name__ == "__main__":
+    unittest.main()
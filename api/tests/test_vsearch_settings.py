@@ -0,0 +1,121 @@
+import os
+import tempfile
+import unittest
+
+import psycopg
+from dotenv import load_dotenv
+
+from src import utils
+from src.cache import QueryEmbeddingCache
+
+# vsearch's ef_search/probes must not outlive the search on connections left in a transaction.
+# Runs against the database of the API (PGUSER, PGPASSWORD, port 5431) and is skipped without it:
+#
+#   python -m unittest discover -s tests -t .      (from the api directory)
+
+load_dotenv()
+
+SETTINGS_QUERY = "SELECT current_setting('hnsw.ef_search', true), current_setting('ivfflat.probes', true);"
+
+
+class StubEmbeddings:
+    """Unit vector of the stored dimensions, no embedding API call"""
+    model = "stub"
+
+    def __init__(self, dimensions):
+        self.vector = [1.0] + [0.0] * (dimensions - 1)
+
+    def embed_query(self, text):
+        return self.vector
+
+    async def aembed_query(self, text):
+        return self.vector
+
+
+def connect_or_skip(test):
+    try:
+        conn = psycopg.connect(**utils.get_connection_kwargs(), connect_timeout=3)
+    except psycopg.OperationalError as e:
+        test.skipTest(f"No database: {e}")
+    test.addCleanup(conn.close)
+    utils.configure_connection(conn)
+    return conn
+
+
+class VsearchSettingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = connect_or_skip(self)
+        self.cursor = self.conn.cursor()
+        column = utils.refresh_vector_column(self.cursor)
+        self.conn.rollback()
+        if column.dimensions is None:
+            self.skipTest("No document_vectors table")
+        self.embeddings = StubEmbeddings(column.dimensions)
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.embedding_cache = QueryEmbeddingCache(os.path.join(cache_dir.name, "embeddings.sqlite3"))
+
+    def test_settings_reset_after_search(self):
+        # Leave the connection idle in transaction, like the helpers do
+        self.cursor.execute(SETTINGS_QUERY)
+        before = self.cursor.fetchone()
+
+        results = utils.vsearch(
+            "doliprane", self.cursor, self.conn, self.embeddings,
+            embedding_cache=self.embedding_cache, ef_search=7, probes=3
+        )
+
+        self.assertIsNotNone(results)
+        self.cursor.execute(SETTINGS_QUERY)
+        self.assertEqual(self.cursor.fetchone(), before)
+
+    def test_settings_reset_without_open_transaction(self):
+        self.cursor.execute(SETTINGS_QUERY)
+        before = self.cursor.fetchone()
+        self.conn.rollback()
+
+        utils.vsearch(
+            "doliprane", self.cursor, self.conn, self.embeddings,
+            embedding_cache=self.embedding_cache, ef_search=7, probes=3
+        )
+
+        self.cursor.execute(SETTINGS_QUERY)
+        self.assertEqual(self.cursor.fetchone(), before)
+
+
+class AsyncVsearchSettingsTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        try:
+            self.conn = await psycopg.AsyncConnection.connect(**utils.get_connection_kwargs(), connect_timeout=3)
+        except psycopg.OperationalError as e:
+            self.skipTest(f"No database: {e}")
+        self.addAsyncCleanup(self.conn.close)
+        await utils.aconfigure_connection(self.conn)
+        self.cursor = self.conn.cursor()
+        column = await utils.arefresh_vector_column(self.cursor)
+        await self.conn.rollback()
+        if column.dimensions is None:
+            self.skipTest("No document_vectors table")
+        self.embeddings = StubEmbeddings(column.dimensions)
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.embedding_cache = QueryEmbeddingCache(os.path.join(cache_dir.name, "embeddings.sqlite3"))
+
+    async def test_settings_reset_after_search(self):
+        await self.cursor.execute(SETTINGS_QUERY)
+        before = await self.cursor.fetchone()
+
+        results = await utils.avsearch(
+            "doliprane", self.cursor, self.conn, self.embeddings,
+            embedding_cache=self.embedding_cache, ef_search=7, probes=3
+        )
+
+        self.assertIsNotNone(results)
+        await self.cursor.execute(SETTINGS_QUERY)
+        self.assertEqual(await self.cursor.fetchone(), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,337 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import psycopg
+from dotenv import load_dotenv
+
+# End-to-end benchmark on synthetic data: generates the graph CSV files at each scale, loads them
+# with csv_loader.py, embeds the nodes with node_embedder.py against the stub embedding server,
+# then times the API helpers. Results are written as JSON, and compared with a previous run:
+#
+#   python benchmark_suite.py --scales 0.1,1,10 --json bench_main.json
+#   python benchmark_suite.py --scales 0.1,1,10 --json bench_branch.json --compare bench_main.json
+#   python benchmark_suite.py --scales 1 --phases query --skip-generate   # graph already loaded
+#
+# Postgres must be able to read the generated files (AGE loads them server-side), run it where
+# csv_loader.py usually runs or point --work-dir to a directory shared with the server.
+# Every run replaces the loaded graph, don't point it at a database you care about
+
+load_dotenv()
+
+DB_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTAINER_DIR = os.path.join(DB_DIR, "container")
+API_DIR = os.path.join(os.path.dirname(DB_DIR), "api")
+sys.path.insert(0, CONTAINER_DIR)
+
+from synthetic_csv import generate, parse_degrees  # noqa: E402
+
+PHASES = ["load", "embed", "query"]
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        "calls": len(latencies),
+        "throughput_per_s": len(latencies) / sum(latencies) if sum(latencies) else None,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+def connection_kwargs(args):
+    return {
+        "dbname": args.dbname,
+        "user": os.environ.get("PGUSER"),
+        "password": os.environ.get("PGPASSWORD"),
+        "host": args.host,
+        "port": args.port,
+    }
+
+def run_script(command, cwd, env, log_path):
+    """Run a script with its output sent to log_path, returns the wall time in seconds"""
+    start = time.perf_counter()
+    with open(log_path, "w", encoding="utf-8") as log:
+        result = subprocess.run(command, cwd=cwd, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        with open(log_path, encoding="utf-8") as log:
+            print("".join(log.readlines()[-20:]))
+        raise RuntimeError(f"{' '.join(command)} failed, see {log_path}")
+    return elapsed
+
+def loader_env(args):
+    """Connection of csv_loader.py, set to the server the other phases use"""
+    kwargs = connection_kwargs(args)
+    return {
+        "POSTGRES_DB": kwargs["dbname"],
+        "POSTGRES_USER": kwargs["user"] or "",
+        "POSTGRES_PASSWORD": kwargs["password"] or "",
+        "POSTGRES_HOST": kwargs["host"],
+        "POSTGRES_PORT": str(kwargs["port"]),
+    }
+
+def embedder_env(args):
+    """Connection of node_embedder.py, set to the server the other phases use"""
+    kwargs = connection_kwargs(args)
+    return {"PGDATABASE": kwargs["dbname"], "PGHOST": kwargs["host"], "PGPORT": str(kwargs["port"])}
+
+def run_load(args, csv_dir, summary, run_dir):
+    seconds = run_script(
+        [sys.executable, "csv_loader.py"],
+        cwd=CONTAINER_DIR,
+        env={
+            "CSV_DIR": csv_dir,
+            "CLEAN_CSV_DIR": os.path.join(run_dir, "csv_clean"),
+            **loader_env(args),
+        },
+        log_path=os.path.join(run_dir, "load.log"),
+    )
+    rows = summary["node_rows"] + summary["edge_rows"]
+    return {
+        "seconds": seconds,
+        "rows": rows,
+        "rows_per_s": rows / seconds,
+        "megabytes_per_s": summary["bytes"] / seconds / 1e6,
+    }
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("localhost", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+def start_stub_server(args, run_dir):
+    log = open(os.path.join(run_dir, "stub_server.log"), "w", encoding="utf-8")
+    server = subprocess.Popen(
+        [sys.executable, "stub_embedding_server.py", "--port", str(args.stub_port),
+         "--latency", str(args.stub_latency), "--dimensions", str(args.dimensions)],
+        cwd=DB_DIR, stdout=log, stderr=subprocess.STDOUT,
+    )
+    wait_for_port(args.stub_port)
+    return server, log
+
+def run_embed(args, run_dir):
+    with psycopg.connect(**connection_kwargs(args), autocommit=True) as conn:
+        started_at = conn.execute("SELECT clock_timestamp();").fetchone()[0]
+    seconds = run_script(
+        [sys.executable, "node_embedder.py"],
+        cwd=DB_DIR,
+        env={
+            "OPENAI_BASE_URL": f"http://localhost:{args.stub_port}/v1",
+            "OPENAI_API_KEY": "stub",
+            "NEW_SESSION": "true",
+            **embedder_env(args),
+        },
+        log_path=os.path.join(run_dir, "embed.log"),
+    )
+    with psycopg.connect(**connection_kwargs(args), autocommit=True) as conn:
+        embedded = conn.execute(
+            "SELECT count(*) FROM document_vectors WHERE created_at >= %s;", (started_at,)
+        ).fetchone()[0]
+    return {"seconds": seconds, "nodes": embedded, "nodes_per_s": embedded / seconds}
+
+def sample_drugs(csv_dir, count, seed):
+    """(id, name) of 'count' random drugs of the generated Drug.csv"""
+    with open(os.path.join(csv_dir, "nodes", "Drug.csv"), encoding="utf-8", newline="") as f:
+        drugs = [(row["id"], row["name"]) for row in csv.DictReader(f)]
+    return random.Random(seed).sample(drugs, min(count, len(drugs)))
+
+def time_workload(function, inputs, warmup):
+    for value in inputs[:warmup]:
+        function(value)
+    latencies = []
+    for value in inputs:
+        start = time.perf_counter()
+        function(value)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+def has_drug_vectors(cursor):
+    cursor.execute("SELECT to_regclass('document_vectors') IS NOT NULL;")
+    if not cursor.fetchone()[0]:
+        return False
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM document_vectors WHERE label = 'Drug');")
+    return cursor.fetchone()[0]
+
+def run_query(args, csv_dir, run_dir):
+    sys.path.insert(0, API_DIR)
+    from langchain_openai import OpenAIEmbeddings
+    from src import utils
+
+    drugs = sample_drugs(csv_dir, args.queries, args.seed)
+    ids = [drug_id for drug_id, _ in drugs]
+    names = [name for _, name in drugs]
+    batches = [ids[i:i + args.batch_size] for i in range(0, len(ids), args.batch_size)]
+
+    conn = psycopg.connect(**utils.get_connection_kwargs(**connection_kwargs(args)))
+    utils.configure_connection(conn)
+    cursor = conn.cursor()
+    try:
+        workloads = {
+            f"relation.{relation}": (lambda drug_id, relation=relation:
+                                     utils.get_drug_relation(relation, drug_id, cursor, conn), ids)
+            for relation in utils.DRUG_RELATIONS
+        }
+        workloads["relation_for_drugs.generics"] = (
+            lambda batch: utils.get_relation_for_drugs("generics", batch, cursor, conn), batches
+        )
+        workloads["drug_profile"] = (lambda drug_id: utils.get_drug_profile(drug_id, cursor, conn), ids)
+
+        # Name and vector search need the vectors of the embed phase
+        embedded = has_drug_vectors(cursor)
+        conn.rollback()
+        if embedded:
+            embeddings = OpenAIEmbeddings(
+                model="text-embedding-3-small",
+                base_url=f"http://localhost:{args.stub_port}/v1",
+                api_key="stub",
+                check_embedding_ctx_length=False,
+            )
+            # A cache of its own, so that every search embeds its query like a cold one
+            embedding_cache = utils.QueryEmbeddingCache(os.path.join(run_dir, "query_embeddings.sqlite3"))
+            workloads["vsearch_drug"] = (
+                lambda name: utils.vsearch_drug(name, cursor, conn, embeddings, embedding_cache), names
+            )
+            utils.enable_name_index(cursor)
+            workloads["resolve_drug.lexical"] = (lambda name: utils.resolve_drug(name, cursor, conn), names)
+
+        results = {}
+        for name, (function, inputs) in workloads.items():
+            results[name] = time_workload(function, inputs, args.warmup)
+            print(f"  {name:<36}{results[name]['p50_ms']:>9.2f} ms p50{results[name]['p99_ms']:>9.2f} ms p99")
+        return results
+    finally:
+        utils.disable_name_index()
+        cursor.close()
+        conn.close()
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=DB_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_scale(scale, args):
+    run_dir = os.path.abspath(os.path.join(args.work_dir, f"scale_{scale:g}"))
+    csv_dir = os.path.join(run_dir, "csv")
+    os.makedirs(run_dir, exist_ok=True)
+    print(f"\n=== Scale {scale:g} ({run_dir})")
+
+    result = {"scale": scale}
+    summary_path = os.path.join(csv_dir, "synthetic.json")
+    if args.skip_generate and os.path.exists(summary_path):
+        with open(summary_path, encoding="utf-8") as f:
+            summary = json.load(f)
+    else:
+        summary = generate(
+            os.path.join(CONTAINER_DIR, "csv", "model.md"), csv_dir, scale, args.degrees, args.target_skew,
+            parse_degrees(args.degree), args.text_length, args.seed
+        )
+    result["generate"] = summary
+
+    if "load" in args.phases:
+        print("Loading...")
+        result["load"] = run_load(args, csv_dir, summary, run_dir)
+        print(f"  {result['load']['rows_per_s']:.0f} rows/s")
+
+    stub_server = None
+    try:
+        if "embed" in args.phases or "query" in args.phases:
+            stub_server = start_stub_server(args, run_dir)
+        if "embed" in args.phases:
+            print("Embedding...")
+            result["embed"] = run_embed(args, run_dir)
+            print(f"  {result['embed']['nodes_per_s']:.0f} nodes/s")
+        if "query" in args.phases:
+            print("Querying...")
+            result["query"] = run_query(args, csv_dir, run_dir)
+    finally:
+        if stub_server is not None:
+            server, log = stub_server
+            server.terminate()
+            server.wait()
+            log.close()
+    return result
+
+def comparable_metrics(run):
+    """Flat {metric: value} of the throughputs and latencies of one scale"""
+    metrics = {}
+    if "load" in run:
+        metrics["load.rows_per_s"] = run["load"]["rows_per_s"]
+    if "embed" in run:
+        metrics["embed.nodes_per_s"] = run["embed"]["nodes_per_s"]
+    for name, result in run.get("query", {}).items():
+        metrics[f"{name}.p50_ms"] = result["p50_ms"]
+        metrics[f"{name}.p99_ms"] = result["p99_ms"]
+    return metrics
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {run["scale"]: run for run in json.load(f)["runs"]}
+    for run in results["runs"]:
+        if run["scale"] not in baseline:
+            continue
+        before, after = comparable_metrics(baseline[run["scale"]]), comparable_metrics(run)
+        print(f"\nScale {run['scale']:g} compared with {baseline_path}")
+        print(f"{'metric':<48}{'before':>12}{'after':>12}{'change':>9}")
+        for metric in sorted(before.keys() & after.keys()):
+            change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+            print(f"{metric:<48}{before[metric]:>12.2f}{after[metric]:>12.2f}{change:>+8.1f}%")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load, embed and query benchmark on synthetic graphs")
+    parser.add_argument("--scales", default="1", help="Comma separated multipliers of the node counts")
+    parser.add_argument("--phases", default=",".join(PHASES), help=f"Comma separated subset of {','.join(PHASES)}")
+    parser.add_argument("--work-dir", default="./benchmark_runs")
+    parser.add_argument("--skip-generate", action="store_true", help="Reuse the files of a previous run")
+    parser.add_argument("--degrees", choices=["poisson", "fixed", "powerlaw"], default="poisson")
+    parser.add_argument("--target-skew", type=float, default=0.0)
+    parser.add_argument("--degree", action="append", metavar="EDGE=MEAN")
+    parser.add_argument("--text-length", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200, help="Drugs queried by each workload")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--stub-port", type=int, default=8089)
+    parser.add_argument("--stub-latency", type=float, default=0.0)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--dbname", default="fpkg")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5431")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Results file of a previous run to compare with")
+    args = parser.parse_args()
+    args.phases = [phase for phase in args.phases.split(",") if phase]
+
+    results = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "arguments": vars(args),
+        },
+        "runs": [run_scale(float(scale), args) for scale in args.scales.split(",")],
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"\nResults written to {args.json}")
+    if args.compare:
+        compare(results, args.compare)
@@ -1,40 +1,116 @@
-from json import load
+import contextlib
+import csv
+import hashlib
+import json
 import psycopg
 import os
+import sys
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
-conn = psycopg.connect(
-    dbname="fpkg",
-    user=os.environ.get("POSTGRES_USER"),
-    password=os.environ.get("POSTGRES_PASSWORD"),
-    host="localhost",
-    port="5432"
-)
+from csv_validator import validate_csv_dir
 
+# Timings come from api/src/metrics.py, which the image doesn't include unless it's copied in (see the readme)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api", "src"))
+try:
+    import metrics
+    from metrics import count, observe, timed
+except ImportError:
+    metrics = None
+
+    def timed(name, **labels):
+        return contextlib.nullcontext()
+
+    def count(name, value=1, **labels):
+        pass
+
+    def observe(name, seconds, **labels):
+        pass
+
+# Number of connections loading label files at the same time, 1 loads them one by one
+LOADER_WORKERS = int(os.environ.get("LOADER_WORKERS", "1"))
+
+# Source CSV files, and the checked and normalized copies that are actually loaded
+CSV_DIR = os.environ.get("CSV_DIR", "./csv")
+CLEAN_CSV_DIR = os.environ.get("CLEAN_CSV_DIR", "./csv_clean")
+# Load the valid rows even if some rows failed validation, instead of stopping before the import
+SKIP_INVALID_ROWS = os.environ.get("SKIP_INVALID_ROWS", "0") == "1"
+
+# Rows sent per Cypher statement when applying a delta
+DELTA_BATCH_SIZE = int(os.environ.get("DELTA_BATCH_SIZE", "500"))
+
+# Longest wait for the locks of an old graph: API connections left idle in transaction keep theirs,
+# the graph is then kept and dropped by a later full reload instead
+DROP_LOCK_TIMEOUT = os.environ.get("DROP_LOCK_TIMEOUT", "5s")
+
+# Name the API uses for the graph, each reload is built into a new "{GRAPH_ALIAS}_v{version}" graph
+# and public.graph_version then points the alias to it
+GRAPH_ALIAS = "fcsv"
+
+def connect():
+    # Defaults are the server of the container, POSTGRES_HOST/POSTGRES_PORT point the loader elsewhere
+    new_conn = psycopg.connect(
+        dbname=os.environ.get("POSTGRES_DB", "fpkg"),
+        user=os.environ.get("POSTGRES_USER"),
+        password=os.environ.get("POSTGRES_PASSWORD"),
+        host=os.environ.get("POSTGRES_HOST", "localhost"),
+        port=os.environ.get("POSTGRES_PORT", "5432")
+    )
+    new_cursor = new_conn.cursor()
+    # Load the AGE extension (only needed once per session if not already loaded)
+    new_cursor.execute("LOAD 'age';")
+    # Set the search path to include AGE
+    new_cursor.execute("SET search_path = ag_catalog, \"$user\", public;")
+    new_conn.commit()
+    return new_conn
+
+conn = connect()
 cursor = conn.cursor()
 
-# Load the AGE extension (only needed once per session if not already loaded)
-cursor.execute("LOAD 'age';")
-# Set the search path to include AGE
-cursor.execute("SET search_path = ag_catalog, \"$user\", public;")
-conn.commit()
-
-# Creating a new graph for the database, if it doesn't exist
-# Check if the graph exists
-cursor.execute("SELECT * FROM ag_catalog.ag_graph WHERE name = 'fcsv';")
-if cursor.fetchone() is None:
-    # Graph doesn't exist, so create it
-    cursor.execute("SELECT * FROM ag_catalog.create_graph('fcsv');")
+def graph_exists(graph_name):
+    cursor.execute("SELECT 1 FROM ag_catalog.ag_graph WHERE name = %s;", (graph_name,))
+    return cursor.fetchone() is not None
+
+def drop_graph(graph_name):
+    cursor.execute("SELECT * FROM ag_catalog.drop_graph(%s, true);", (graph_name,))
     conn.commit()
-    print("Created new graph 'fcsv'")
-else:
-    # Graph exists, drop it and recreate for a clean start
-    cursor.execute("SELECT * FROM ag_catalog.drop_graph('fcsv', true);") 
-    cursor.execute("SELECT * FROM ag_catalog.create_graph('fcsv');")
+    print(f"Dropped graph '{graph_name}'")
+
+# Which graph the alias currently points to, and the version it was loaded as
+def get_active_graph():
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS public.graph_version (
+            graph_name TEXT PRIMARY KEY,
+            version BIGINT NOT NULL,
+            loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    # Graphs loaded before blue/green reloads were queried under the alias itself
+    cursor.execute("ALTER TABLE public.graph_version ADD COLUMN IF NOT EXISTS active_graph TEXT;")
     conn.commit()
-    print("Recreated graph 'fcsv'")
+    cursor.execute("""
+        SELECT version, COALESCE(active_graph, graph_name) FROM public.graph_version
+        WHERE graph_name = %s;
+    """, (GRAPH_ALIAS,))
+    row = cursor.fetchone()
+    if row is None:
+        return 0, GRAPH_ALIAS if graph_exists(GRAPH_ALIAS) else None
+    return row[0], row[1]
+
+# Create the shadow graph the reload is built into, the active graph is left untouched
+def create_shadow_graph(version):
+    graph_name = f"{GRAPH_ALIAS}_v{version}"
+    if graph_exists(graph_name):
+        # Leftover of an interrupted reload, it was never switched to
+        drop_graph(graph_name)
+    cursor.execute("SELECT * FROM ag_catalog.create_graph(%s);", (graph_name,))
+    conn.commit()
+    print(f"Created shadow graph '{graph_name}'")
+    return graph_name
 
 # Register vertex and edge labels
-def register_labels():
+def register_labels(graph_name):
     # Register vertex labels
     node_types = [
         "Drug", "ActiveIngredient", "Excipient", "GenericGroup", 
@@ -44,7 +120,7 @@ def register_labels():
     print("\nRegistering node labels...")
     for node_type in node_types:
         try:
-            cursor.execute(f"SELECT create_vlabel('fcsv', '{node_type}');")
+            cursor.execute(f"SELECT create_vlabel('{graph_name}', '{node_type}');")
             print(f"  - Registered '{node_type}' node label")
         except Exception as e:
             if "already exists" in str(e):
@@ -62,7 +138,7 @@ def register_labels():
     print("\nRegistering edge labels...")
     for edge_type in edge_types:
         try:
-            cursor.execute(f"SELECT create_elabel('fcsv', '{edge_type}');")
+            cursor.execute(f"SELECT create_elabel('{graph_name}', '{edge_type}');")
             print(f"  - Registered '{edge_type}' edge label")
         except Exception as e:
             if "already exists" in str(e):
@@ -73,93 +149,507 @@ def register_labels():
     conn.commit()
     print("All labels registered successfully")
 
-# Loading all nodes from the CSV files
-def load_nodes_from_csv():
-    csv_dir = './csv/nodes'
-    
-    # Check if the csv directory exists
-    if not os.path.exists(csv_dir):
-        print(f"Directory '{csv_dir}' not found.")
-        return
-    
-    # Iterate through all files in the csv directory
+# AGE function loading each kind of label file
+LOAD_FUNCTIONS = {
+    "nodes": "load_labels_from_file",
+    "edges": "load_edges_from_file",
+}
+
+def list_csv_files(csv_dir):
+    """(label, absolute path) of every CSV file in csv_dir, largest first"""
+    files = []
     for filename in os.listdir(csv_dir):
         if filename.endswith('.csv'):
-            file_path = os.path.abspath(os.path.join(csv_dir, filename))
-            print(f"Processing {file_path}...")
-            
-            # Assuming the file name without extension represents the node type
-            node_type = os.path.splitext(filename)[0]
-            
-            # Read the CSV file and create nodes
-            try:
-                cursor.execute(f"""
-                    SELECT * FROM ag_catalog.load_labels_from_file(
-                        'fcsv', 
-                        '{node_type}', 
-                        '{file_path}'
-                    );
-                """)
-                conn.commit()
-                print(f"Successfully loaded nodes from {filename}")
-            except Exception as e:
-                conn.rollback()
-                print(f"Error loading {filename}: {str(e)}")
+            # Assuming the file name without extension represents the label
+            label = os.path.splitext(filename)[0]
+            files.append((label, os.path.abspath(os.path.join(csv_dir, filename))))
+    # Starting with the largest files keeps the total time close to the largest file's
+    files.sort(key=lambda file: os.path.getsize(file[1]), reverse=True)
+    return files
 
-def load_edges_from_csv():
-    csv_dir = './csv/edges'
-    
+def load_file(load_conn, graph_name, kind, label, file_path):
+    """Load one label file, returns the time it took or None if it failed"""
+    filename = os.path.basename(file_path)
+    print(f"Processing {file_path}...")
+    start_time = time.monotonic()
+    try:
+        load_conn.execute(f"""
+            SELECT * FROM ag_catalog.{LOAD_FUNCTIONS[kind]}(
+                '{graph_name}', 
+                '{label}', 
+                '{file_path}'
+            );
+        """)
+        load_conn.commit()
+        elapsed = time.monotonic() - start_time
+        observe("load_file", elapsed, kind=kind, label=label)
+        print(f"Successfully loaded {kind} from {filename} in {elapsed:.1f}s")
+        return elapsed
+    except Exception as e:
+        load_conn.rollback()
+        count("load_errors", kind=kind, label=label)
+        print(f"Error loading {filename}: {str(e)}")
+        return None
+
+def load_files(graph_name, kind, csv_dir, workers=LOADER_WORKERS):
+    """
+    Load every label file of csv_dir. Files of the same kind don't depend on each other,
+    so with several workers each one is loaded on its own connection at the same time.
+    Returns the (label, path) of the files that failed to load
+    """
     # Check if the csv directory exists
     if not os.path.exists(csv_dir):
-        print(f"Directory '{csv_dir}' not found.")
-        return
+        raise FileNotFoundError(f"Directory '{csv_dir}' not found.")
     
-    # Iterate through all files in the csv directory
-    for filename in os.listdir(csv_dir):
-        if filename.endswith('.csv'):
-            file_path = os.path.abspath(os.path.join(csv_dir, filename))
-            print(f"Processing {file_path}...")
-            
-            # Assuming the file name without extension represents the edge type
-            edge_type = os.path.splitext(filename)[0]
-            
-            # Read the CSV file and create edges
+    files = list_csv_files(csv_dir)
+    start_time = time.monotonic()
+    
+    if workers <= 1:
+        timings = [load_file(conn, graph_name, kind, label, file_path) for label, file_path in files]
+    else:
+        # Each task borrows one of the worker connections for the duration of its file
+        connections = queue.Queue()
+        for _ in range(min(workers, len(files))):
+            connections.put(connect())
+        
+        def load_with_pooled_connection(label, file_path):
+            load_conn = connections.get()
+            try:
+                return load_file(load_conn, graph_name, kind, label, file_path)
+            finally:
+                connections.put(load_conn)
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            timings = list(executor.map(lambda file: load_with_pooled_connection(*file), files))
+        
+        while not connections.empty():
+            connections.get().close()
+    
+    wall_time = time.monotonic() - start_time
+    print(f"\n{kind.capitalize()} timings:")
+    for (label, file_path), elapsed in zip(files, timings):
+        status = f"{elapsed:8.1f}s" if elapsed is not None else "  failed"
+        print(f"  {label:<30}{status}")
+    print(f"  {'wall time':<30}{wall_time:8.1f}s "
+          f"(sum of files {sum(t for t in timings if t is not None):.1f}s, {workers} worker(s))")
+    return [file for file, elapsed in zip(files, timings) if elapsed is None]
+
+def label_dir(kind):
+    """Directory of the clean node or edge files"""
+    return os.path.join(CLEAN_CSV_DIR, kind)
+
+# Check the CSV files and write the clean copies, before anything is loaded
+def prepare_csv_files(allow_invalid=SKIP_INVALID_ROWS):
+    print("\nValidating CSV files...")
+    with timed("validate_csv"):
+        invalid = validate_csv_dir(CSV_DIR, CLEAN_CSV_DIR)
+    count("invalid_rows", invalid)
+    if invalid and not allow_invalid:
+        raise RuntimeError(
+            f"{invalid} invalid row(s), see {os.path.join(CLEAN_CSV_DIR, 'validation_errors.csv')}. "
+            "Fix them, or set SKIP_INVALID_ROWS=1 to load the valid rows only"
+        )
+
+# Loading all nodes from the CSV files
+def load_nodes_from_csv(graph_name):
+    return load_files(graph_name, "nodes", label_dir("nodes"))
+
+def load_edges_from_csv(graph_name):
+    return load_files(graph_name, "edges", label_dir("edges"))
+
+def count_csv_records(file_path):
+    """Number of records of a CSV file, not counting the header"""
+    with open(file_path, newline='', encoding='utf-8') as f:
+        return max(sum(1 for _ in csv.reader(f)) - 1, 0)
+
+# Compare the row count of every label table with its CSV file, returns the mismatches
+def validate_graph(graph_name):
+    problems = []
+    print(f"\nValidating graph '{graph_name}'...")
+    for csv_dir in (label_dir("nodes"), label_dir("edges")):
+        for label, file_path in list_csv_files(csv_dir):
+            expected = count_csv_records(file_path)
+            cursor.execute(f'SELECT count(*) FROM "{graph_name}"."{label}";')
+            loaded = cursor.fetchone()[0]
+            conn.rollback()
+            count("rows_loaded", loaded, label=label)
+            status = "ok" if loaded == expected else "MISMATCH"
+            print(f"  {label:<30}{loaded:>10} / {expected:<10}{status}")
+            if loaded != expected:
+                problems.append(f"{label}: {loaded} rows loaded, {expected} in the CSV file")
+    return problems
+
+# Vertex properties looked up by the API and the delta mode, indexed after each full load
+INDEXED_PROPERTIES = ["id", "theriaque_id", "name"]
+
+def read_csv_header(file_path):
+    with open(file_path, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f), [])
+
+def timed_index(statement):
+    start_time = time.monotonic()
+    cursor.execute(statement)
+    conn.commit()
+    return time.monotonic() - start_time
+
+# Index the label tables of a freshly loaded graph: the load functions create none, so every
+# property lookup scans the whole label table otherwise
+def create_property_indexes(graph_name):
+    print(f"\nIndexing graph '{graph_name}'...")
+    timings = []
+    for label, file_path in list_csv_files(label_dir("nodes")):
+        table = f'"{graph_name}"."{label}"'
+        header = read_csv_header(file_path)
+        # Expression indexes serve WHERE v.prop = ... filters
+        for prop in INDEXED_PROPERTIES:
+            if prop in header:
+                timings.append((f"{label}.{prop}", timed_index(f"""
+                    CREATE INDEX IF NOT EXISTS "idx_{label}_{prop}" ON {table}
+                    USING btree (ag_catalog.agtype_access_operator(VARIADIC ARRAY[properties, '"{prop}"'::agtype]));
+                """)))
+        # The GIN index serves property maps, as in MATCH (v:Label {id: ...})
+        timings.append((f"{label}.properties", timed_index(f"""
+            CREATE INDEX IF NOT EXISTS "idx_{label}_properties" ON {table} USING gin (properties);
+        """)))
+        timings.append((f"{label} analyze", timed_index(f"ANALYZE {table};")))
+    for label, file_path in list_csv_files(label_dir("edges")):
+        table = f'"{graph_name}"."{label}"'
+        for column in ("start_id", "end_id"):
+            timings.append((f"{label}.{column}", timed_index(f"""
+                CREATE INDEX IF NOT EXISTS "idx_{label}_{column}" ON {table} USING btree ({column});
+            """)))
+        timings.append((f"{label} analyze", timed_index(f"ANALYZE {table};")))
+
+    print("\nIndex timings:")
+    for name, elapsed in timings:
+        observe("index", elapsed, index=name)
+        print(f"  {name:<45}{elapsed:8.1f}s")
+    print(f"  {'total':<45}{sum(elapsed for _, elapsed in timings):8.1f}s")
+
+# Point the alias to the new graph. A single transaction, so readers either see the previous
+# graph or the new one; the version bump also invalidates the API caches
+def switch_active_graph(graph_name, version):
+    cursor.execute("""
+        INSERT INTO public.graph_version (graph_name, version, active_graph)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (graph_name) DO UPDATE SET
+            version = EXCLUDED.version,
+            active_graph = EXCLUDED.active_graph,
+            loaded_at = CURRENT_TIMESTAMP;
+    """, (GRAPH_ALIAS, version, graph_name))
+    conn.commit()
+    print(f"Graph '{GRAPH_ALIAS}' now points to '{graph_name}' (version {version})")
+
+# Drop the graphs older than the previous one, which is kept for queries still running against it
+def drop_old_graphs(active_graph, previous_graph):
+    cursor.execute("""
+        SELECT name FROM ag_catalog.ag_graph
+        WHERE name = %s OR name LIKE %s;
+    """, (GRAPH_ALIAS, f"{GRAPH_ALIAS}\\_v%"))
+    for (name,) in cursor.fetchall():
+        if name not in (active_graph, previous_graph):
             try:
-                cursor.execute(f"""
-                    SELECT * FROM ag_catalog.load_edges_from_file(
-                        'fcsv', 
-                        '{edge_type}', 
-                        '{file_path}'
-                    );
-                """)
-                conn.commit()
-                print(f"Successfully loaded edges from {filename}")
-            except Exception as e:
+                # Local to the transaction drop_graph commits
+                cursor.execute("SELECT set_config('lock_timeout', %s, true);", (DROP_LOCK_TIMEOUT,))
+                drop_graph(name)
+            except psycopg.errors.LockNotAvailable:
                 conn.rollback()
-                print(f"Error loading {filename}: {str(e)}")
+                print(f"Graph '{name}' is still in use, it will be dropped by the next full reload")
 
-# Main execution
-try:
+# Snapshot of the row hashes of the last load, compared with the CSV files by the delta mode
+def create_snapshot_table():
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS public.csv_row_hashes (
+            graph_name TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            label TEXT NOT NULL,
+            key TEXT NOT NULL,
+            row_hash TEXT NOT NULL,
+            PRIMARY KEY (graph_name, label, key)
+        );
+    """)
+
+# Key under which the header of each file is kept, a changed header needs a full reload
+HEADER_KEY = "__header__"
+
+def hash_row(row):
+    return hashlib.sha1("\x1f".join(row).encode("utf-8")).hexdigest()
+
+# Columns of the edge files locating both endpoints
+ENDPOINT_COLUMNS = ("start_id", "start_vertex_type", "end_id", "end_vertex_type")
+
+def edge_key(start_id, start_type, end_id, end_type):
+    return f"{start_type}:{start_id}->{end_type}:{end_id}"
+
+def parse_edge_key(key):
+    start, end = key.split("->", 1)
+    start_type, start_id = start.split(":", 1)
+    end_type, end_id = end.split(":", 1)
+    return start_id, start_type, end_id, end_type
+
+def read_csv_rows(kind, file_path):
+    """
+    Header and rows of a label file, grouped by key: the 'id' column for nodes,
+    the pair of endpoints for edges, since edges have no id of their own
+    """
+    with open(file_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        rows = {}
+        if kind == "nodes":
+            id_index = header.index("id")
+            for row in reader:
+                rows[row[id_index]] = [row]
+        else:
+            endpoints = [header.index(column) for column in ENDPOINT_COLUMNS]
+            for row in reader:
+                rows.setdefault(edge_key(*(row[i] for i in endpoints)), []).append(row)
+    return header, rows
+
+def hash_csv_rows(header, rows):
+    """One hash per key, edges between the same pair of nodes are hashed together"""
+    hashes = {key: hash_row([hash_row(row) for row in sorted(group)]) for key, group in rows.items()}
+    hashes[HEADER_KEY] = hash_row(header)
+    return hashes
+
+def record_snapshot(graph_name, kind, label, hashes):
+    cursor.execute(
+        "DELETE FROM public.csv_row_hashes WHERE graph_name = %s AND label = %s;", (graph_name, label)
+    )
+    with cursor.copy("COPY public.csv_row_hashes (graph_name, kind, label, key, row_hash) FROM STDIN") as copy:
+        for key, row_hash in hashes.items():
+            copy.write_row((graph_name, kind, label, key, row_hash))
+
+# Remember what was loaded into a freshly built graph, so that the next delta has a baseline
+def record_full_snapshot(graph_name):
+    create_snapshot_table()
+    for kind, csv_dir in (("nodes", label_dir("nodes")), ("edges", label_dir("edges"))):
+        for label, file_path in list_csv_files(csv_dir):
+            header, rows = read_csv_rows(kind, file_path)
+            record_snapshot(graph_name, kind, label, hash_csv_rows(header, rows))
+    cursor.execute("""
+        DELETE FROM public.csv_row_hashes
+        WHERE graph_name NOT IN (SELECT name::text FROM ag_catalog.ag_graph);
+    """)
+    conn.commit()
+    print(f"Recorded the row hashes of '{graph_name}'")
+
+def has_snapshot(graph_name):
+    cursor.execute("SELECT 1 FROM public.csv_row_hashes WHERE graph_name = %s LIMIT 1;", (graph_name,))
+    return cursor.fetchone() is not None
+
+def load_snapshot(graph_name, label):
+    cursor.execute(
+        "SELECT key, row_hash FROM public.csv_row_hashes WHERE graph_name = %s AND label = %s;",
+        (graph_name, label)
+    )
+    return dict(cursor.fetchall())
+
+def diff_hashes(previous, current):
+    """Keys inserted, updated and deleted since the previous snapshot"""
+    inserted = [key for key in current if key not in previous and key != HEADER_KEY]
+    updated = [key for key in current if key in previous and key != HEADER_KEY and current[key] != previous[key]]
+    deleted = [key for key in previous if key not in current and key != HEADER_KEY]
+    return inserted, updated, deleted
+
+def run_cypher_batches(graph_name, statement, rows):
+    """Run 'statement' with $rows bound to consecutive batches of 'rows'"""
+    for start in range(0, len(rows), DELTA_BATCH_SIZE):
+        batch = rows[start:start + DELTA_BATCH_SIZE]
+        with timed("delta_batch"):
+            cursor.execute(
+                f"SELECT * FROM cypher('{graph_name}', $$ {statement} $$, %s) AS (result agtype);",
+                (json.dumps({"rows": batch}),)
+            )
+        count("delta_rows", len(batch))
+
+def cypher_map(variable, columns):
+    return "{" + ", ".join(f"{column}: {variable}.{column}" for column in columns) + "}"
+
+# Vertices created by Cypher take their id from the label sequence, which the CSV loader doesn't
+# advance when it derives ids from the id column. Move it past the loaded ids to avoid clashes
+def advance_label_sequence(graph_name, label):
+    cursor.execute(f"""
+        SELECT setval(
+            '"{graph_name}"."{label}_id_seq"',
+            GREATEST(
+                (SELECT COALESCE(max((id::text)::bigint & 281474976710655), 0) FROM "{graph_name}"."{label}"),
+                (SELECT last_value FROM "{graph_name}"."{label}_id_seq")
+            )
+        );
+    """)
+
+def apply_node_delta(graph_name, label, header, rows, inserted, updated):
+    columns = list(header)
+    properties = [column for column in header if column != "id"]
+    if updated:
+        assignments = ", ".join(f"v.{column} = row.{column}" for column in properties)
+        run_cypher_batches(graph_name, f"""
+            UNWIND $rows AS row
+            MATCH (v:{label} {{id: row.id}})
+            SET {assignments}
+        """, [dict(zip(columns, rows[key][0])) for key in updated])
+    if inserted:
+        advance_label_sequence(graph_name, label)
+        run_cypher_batches(graph_name, f"""
+            UNWIND $rows AS row
+            CREATE (v:{label} {cypher_map("row", columns)})
+        """, [dict(zip(columns, rows[key][0])) for key in inserted])
+
+def delete_edges(graph_name, label, keys):
+    by_types = {}
+    for key in keys:
+        start_id, start_type, end_id, end_type = parse_edge_key(key)
+        by_types.setdefault((start_type, end_type), []).append({"start_id": start_id, "end_id": end_id})
+    for (start_type, end_type), pairs in by_types.items():
+        run_cypher_batches(graph_name, f"""
+            UNWIND $rows AS row
+            MATCH (a:{start_type} {{id: row.start_id}})-[e:{label}]->(b:{end_type} {{id: row.end_id}})
+            DELETE e
+        """, pairs)
+
+def create_edges(graph_name, label, header, rows, keys):
+    properties = [column for column in header if column not in ENDPOINT_COLUMNS]
+    # Endpoint labels come from each row, one statement per pair of labels
+    by_types = {}
+    for key in keys:
+        for row in rows[key]:
+            record = dict(zip(header, row))
+            by_types.setdefault((record["start_vertex_type"], record["end_vertex_type"]), []).append(record)
+    for (start_type, end_type), records in by_types.items():
+        edge_properties = f" {cypher_map('row', properties)}" if properties else ""
+        run_cypher_batches(graph_name, f"""
+            UNWIND $rows AS row
+            MATCH (a:{start_type} {{id: row.start_id}}), (b:{end_type} {{id: row.end_id}})
+            CREATE (a)-[e:{label}{edge_properties}]->(b)
+        """, records)
+
+def delete_nodes(graph_name, label, keys):
+    run_cypher_batches(graph_name, f"""
+        UNWIND $rows AS row
+        MATCH (v:{label} {{id: row.id}})
+        DETACH DELETE v
+    """, [{"id": key} for key in keys])
+
+def delta_reload():
+    """
+    Apply only the rows that changed since the last load to the active graph, in one transaction.
+    Node rows are compared by id, edge rows by (start_id, end_id)
+    """
+    version, graph_name = get_active_graph()
+    prepare_csv_files()
+    create_snapshot_table()
+    conn.commit()
+    if graph_name is None or not has_snapshot(graph_name):
+        raise RuntimeError("No snapshot of the active graph, run a full load first")
+    print(f"Applying CSV changes to '{graph_name}'...")
+    start_time = time.monotonic()
+
+    changes = {}
+    for kind, csv_dir in (("nodes", label_dir("nodes")), ("edges", label_dir("edges"))):
+        for label, file_path in list_csv_files(csv_dir):
+            header, rows = read_csv_rows(kind, file_path)
+            hashes = hash_csv_rows(header, rows)
+            previous = load_snapshot(graph_name, label)
+            if previous.get(HEADER_KEY) != hashes[HEADER_KEY]:
+                raise RuntimeError(f"The columns of {label} changed, run a full load instead")
+            changes[label] = (kind, header, rows, hashes, *diff_hashes(previous, hashes))
+
+    # Nodes first so that new edges find their endpoints, node deletions last since they
+    # also remove the edges attached to them
+    for label, (kind, header, rows, hashes, inserted, updated, deleted) in changes.items():
+        if kind == "nodes" and (inserted or updated):
+            apply_node_delta(graph_name, label, header, rows, inserted, updated)
+    for label, (kind, header, rows, hashes, inserted, updated, deleted) in changes.items():
+        if kind == "edges":
+            if updated or deleted:
+                delete_edges(graph_name, label, updated + deleted)
+            if inserted or updated:
+                create_edges(graph_name, label, header, rows, inserted + updated)
+    for label, (kind, header, rows, hashes, inserted, updated, deleted) in changes.items():
+        if kind == "nodes" and deleted:
+            delete_nodes(graph_name, label, deleted)
+
+    print("\nDelta:")
+    for label, (kind, header, rows, hashes, inserted, updated, deleted) in changes.items():
+        if inserted or updated or deleted:
+            record_snapshot(graph_name, kind, label, hashes)
+        print(f"  {label:<30}{len(inserted):>8} inserted{len(updated):>8} updated{len(deleted):>8} deleted")
+
+    # Same transaction as the changes, readers see either none or all of them
+    cursor.execute("""
+        UPDATE public.graph_version SET version = version + 1, loaded_at = CURRENT_TIMESTAMP
+        WHERE graph_name = %s;
+    """, (GRAPH_ALIAS,))
+    conn.commit()
+    print(f"Graph '{graph_name}' is now at version {version + 1} ({time.monotonic() - start_time:.1f}s)")
+
+# Build the whole graph again into a shadow graph, then switch to it
+def full_reload():
+    global shadow_graph
+    current_version, previous_graph = get_active_graph()
+    version = current_version + 1
+    prepare_csv_files()
+    shadow_graph = create_shadow_graph(version)
+    
     # First register all labels
-    register_labels()
+    register_labels(shadow_graph)
     
     # Then load nodes
     print("\nLoading nodes...")
-    load_nodes_from_csv()
+    failed = load_nodes_from_csv(shadow_graph)
     
-    # Then load edges
+    # Then load edges, once every node they point to exists
     print("\nLoading edges...")
-    load_edges_from_csv()
+    failed += load_edges_from_csv(shadow_graph)
+    
+    if failed:
+        raise RuntimeError(f"{len(failed)} file(s) failed to load: {', '.join(label for label, _ in failed)}")
+    problems = validate_graph(shadow_graph)
+    if problems:
+        raise RuntimeError("Validation failed:\n  " + "\n  ".join(problems))
+    # Built before the switch, so the API never queries an unindexed graph
+    create_property_indexes(shadow_graph)
+    record_full_snapshot(shadow_graph)
+    
+    switch_active_graph(shadow_graph, version)
+    shadow_graph = None
+    drop_old_graphs(f"{GRAPH_ALIAS}_v{version}", previous_graph)
+
+# Main execution
+# python csv_loader.py        full reload into a new graph
+# python csv_loader.py delta  apply only the changed rows to the active graph
+# python csv_loader.py index  index the active graph, for graphs loaded without indexes
+# FPKG_METRICS_FILE=load_metrics.json (or .prom) writes the timings of the run, see metrics.py
+shadow_graph = None
+if metrics is None and os.environ.get("FPKG_METRICS_FILE"):
+    print("metrics.py not found, FPKG_METRICS_FILE is ignored")
+elif metrics is not None and metrics.METRICS_FILE:
+    metrics.enable_metrics()
+try:
+    if len(sys.argv) > 1 and sys.argv[1] == "delta":
+        delta_reload()
+    elif len(sys.argv) > 1 and sys.argv[1] == "index":
+        # Only the headers of the clean files are needed
+        prepare_csv_files(allow_invalid=True)
+        create_property_indexes(get_active_graph()[1])
+    else:
+        full_reload()
     
     print("\nDatabase loading completed successfully!")
 
 except Exception as e:
     conn.rollback()
     print(f"Error: {str(e)}")
-    print("Connection was rolled back")
+    # The half-loaded graph is never switched to, the active one keeps serving queries
+    if shadow_graph is not None and graph_exists(shadow_graph):
+        drop_graph(shadow_graph)
+    print("Connection was rolled back, the active graph was left untouched")
 
 finally:
     # Close the connection
     cursor.close()
     conn.close()
     print("\nDatabase connection closed.")
+    if metrics is not None and metrics.METRICS_FILE:
+        metrics.write_metrics(metrics.METRICS_FILE)
@@ -0,0 +1,249 @@
+import csv
+import multiprocessing
+import os
+import re
+import sys
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+# Streaming checks of the graph CSV files before they are handed to AGE, whose load functions
+# stop at the first bad row of a file (or load it wrongly) after minutes of work:
+#
+#   python csv_validator.py ./csv ./csv_clean
+#
+# Rows are read one at a time, only the node ids are kept in memory (for the uniqueness and
+# edge endpoint checks). Clean copies of the files are written to the output directory,
+# UTF-8 without BOM, minimally quoted, with "\n" line endings and NFC normalized text
+
+# Files are checked in parallel, one process per file
+VALIDATOR_WORKERS = int(os.environ.get("VALIDATOR_WORKERS", str(os.cpu_count() or 1)))
+
+# Errors printed per file, every error is written to the report file
+PRINTED_ERRORS = 20
+
+# Columns AGE reads before the properties of each kind of file
+NODE_ID_COLUMN = "id"
+EDGE_COLUMNS = ["start_id", "start_vertex_type", "end_id", "end_vertex_type"]
+
+# Encodings tried in order, files exported from spreadsheets are often Windows-1252
+ENCODINGS = ["utf-8-sig", "cp1252"]
+
+def parse_model(model_path):
+    """
+    Node properties and edge endpoints described in model.md:
+    ({label: [properties]}, {label: {"from": label, "to": label, "properties": [properties]}})
+    """
+    nodes, edges = {}, {}
+    section, current = None, None
+    with open(model_path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("## "):
+                section = "nodes" if "Node Properties" in line else "edges" if "Relationships" in line else None
+                current = None
+            elif line.startswith("### ") and section:
+                current = re.sub(r"^###\s+(\d+\.\s*)?", "", line).strip()
+                if section == "nodes":
+                    nodes[current] = []
+                else:
+                    edges[current] = {"from": None, "to": None, "properties": []}
+            elif current and section == "nodes":
+                match = re.match(r"\s*-\s*`(\w+)`", line)
+                if match:
+                    nodes[current].append(match.group(1))
+            elif current and section == "edges":
+                endpoint = re.match(r"\s*-\s*\*\*(From|To)\*\*:\s*`(\w+)`", line)
+                prop = re.match(r"\s+-\s*`(\w+)`", line)
+                if endpoint:
+                    edges[current][endpoint.group(1).lower()] = endpoint.group(2)
+                elif prop:
+                    edges[current]["properties"].append(prop.group(1))
+    return nodes, edges
+
+def detect_encoding(file_path):
+    """First encoding of ENCODINGS able to decode the whole file, read in chunks"""
+    for encoding in ENCODINGS:
+        try:
+            with open(file_path, encoding=encoding, newline="") as f:
+                while f.read(1 << 20):
+                    pass
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "latin-1"
+
+def normalize_field(value):
+    # NUL bytes end the field early in AGE's parser, stray carriage returns come from Windows exports
+    value = value.replace("\x00", "").replace("\r\n", "\n").replace("\r", "\n")
+    return unicodedata.normalize("NFC", value).strip()
+
+def check_header(kind, label, header, model):
+    """(errors, warnings) of a header, compared with the columns AGE needs and model.md"""
+    errors, warnings = [], []
+    nodes, edges = model
+    if len(set(header)) != len(header):
+        errors.append("duplicate column names")
+    if kind == "nodes":
+        if not header or header[0] != NODE_ID_COLUMN:
+            errors.append(f"the first column must be '{NODE_ID_COLUMN}'")
+        expected = nodes.get(label)
+        columns = header[1:]
+    else:
+        if header[:len(EDGE_COLUMNS)] != EDGE_COLUMNS:
+            errors.append(f"the first columns must be {', '.join(EDGE_COLUMNS)}")
+        expected = edges.get(label, {}).get("properties")
+        columns = header[len(EDGE_COLUMNS):]
+    if expected is None:
+        warnings.append(f"'{label}' is not described in model.md")
+    else:
+        expected_columns = [column for column in expected if column != NODE_ID_COLUMN]
+        unknown = [column for column in columns if column not in expected_columns]
+        missing = [column for column in expected_columns if column not in columns]
+        if unknown:
+            warnings.append(f"columns missing from model.md: {', '.join(unknown)}")
+        if missing:
+            warnings.append(f"columns of model.md missing from the file: {', '.join(missing)}")
+    return errors, warnings
+
+def validate_file(kind, label, file_path, out_path, model, node_ids=None):
+    """
+    Check and normalize one label file. 'node_ids' maps node labels to their ids, needed for edges.
+    Returns a summary dict, with the ids of node files and the row errors as (line, message).
+    A file whose header is invalid isn't read further and has no clean copy, "header_errors" is then set
+    """
+    start_time = time.monotonic()
+    encoding = detect_encoding(file_path)
+    errors, ids = [], set()
+    rows_in = rows_out = 0
+    edge = model[1].get(label, {})
+
+    with open(file_path, encoding=encoding, newline="") as src:
+        reader = csv.reader(src)
+        header = [normalize_field(column) for column in next(reader, [])]
+        if header:
+            # A UTF-8 byte order mark left by a file that fell back to another encoding
+            header[0] = header[0].removeprefix("\ufeff").removeprefix("\u00ef\u00bb\u00bf")
+        header_errors, warnings = check_header(kind, label, header, model)
+        if header_errors:
+            return {
+                "kind": kind, "label": label, "encoding": encoding, "rows": 0, "written": 0,
+                "errors": [(1, message) for message in header_errors], "header_errors": True,
+                "warnings": warnings, "ids": ids, "seconds": time.monotonic() - start_time,
+            }
+
+        with open(out_path, "w", encoding="utf-8", newline="") as dst:
+            writer = csv.writer(dst, quoting=csv.QUOTE_MINIMAL, lineterminator="\n")
+            writer.writerow(header)
+            for row in reader:
+                rows_in += 1
+                line = reader.line_num
+                row = [normalize_field(value) for value in row]
+                problems = []
+                if len(row) != len(header):
+                    problems.append(f"{len(row)} fields, the header has {len(header)}")
+                elif kind == "nodes":
+                    row_id = row[0]
+                    # AGE builds the graph id of each vertex from this column
+                    if not row_id.isdigit():
+                        problems.append(f"id '{row_id}' is not a non-negative integer")
+                    elif row_id in ids:
+                        problems.append(f"duplicate id '{row_id}'")
+                    else:
+                        ids.add(row_id)
+                else:
+                    start_id, start_type, end_id, end_type = row[:4]
+                    for side, node_id, node_type in (("from", start_id, start_type), ("to", end_id, end_type)):
+                        if edge.get(side) and node_type != edge[side]:
+                            problems.append(f"{side} node type '{node_type}', model.md expects '{edge[side]}'")
+                        elif node_ids is not None and node_id not in node_ids.get(node_type, ()):
+                            problems.append(f"{side} node {node_type} '{node_id}' does not exist")
+
+                # Invalid rows are left out of the clean file, whether the load goes on is up to the caller
+                if problems:
+                    errors.append((line, "; ".join(problems)))
+                    continue
+                writer.writerow(row)
+                rows_out += 1
+
+    return {
+        "kind": kind, "label": label, "encoding": encoding, "rows": rows_in, "written": rows_out,
+        "errors": errors, "header_errors": False, "warnings": warnings, "ids": ids,
+        "seconds": time.monotonic() - start_time,
+    }
+
+def list_label_files(csv_dir):
+    """(label, path) of every CSV file in csv_dir, largest first so that workers finish together"""
+    files = [
+        (os.path.splitext(filename)[0], os.path.join(csv_dir, filename))
+        for filename in os.listdir(csv_dir) if filename.endswith(".csv")
+    ]
+    files.sort(key=lambda file: os.path.getsize(file[1]), reverse=True)
+    return files
+
+def report(results, report_path):
+    """Print a summary of the results, write every row error to report_path"""
+    with open(report_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["label", "line", "error"])
+        for result in results:
+            for line, message in result["errors"]:
+                writer.writerow([result["label"], line, message])
+
+    print(f"\n{'file':<30}{'rows':>10}{'written':>10}{'errors':>8}{'seconds':>9}  encoding")
+    for result in results:
+        print(f"{result['label']:<30}{result['rows']:>10}{result['written']:>10}"
+              f"{len(result['errors']):>8}{result['seconds']:>9.1f}  {result['encoding']}")
+        for warning in result["warnings"]:
+            print(f"    warning: {warning}")
+        for line, message in result["errors"][:PRINTED_ERRORS]:
+            print(f"    line {line}: {message}")
+        if len(result["errors"]) > PRINTED_ERRORS:
+            print(f"    ... {len(result['errors']) - PRINTED_ERRORS} more in {report_path}")
+
+def validate_csv_dir(csv_dir="./csv", out_dir="./csv_clean", workers=VALIDATOR_WORKERS):
+    """
+    Validate and normalize csv_dir/nodes and csv_dir/edges into out_dir, node files first since
+    edges are checked against their ids. Returns the number of invalid rows, which are left out
+    of the clean files. Raises RuntimeError when a header is invalid: none of the file's rows can be
+    loaded then, so SKIP_INVALID_ROWS doesn't apply
+    """
+    model = parse_model(os.path.join(csv_dir, "model.md"))
+    start_time = time.monotonic()
+    results = []
+    # Forked workers don't import the calling script again, csv_loader.py runs its load on import
+    mp_context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=max(workers, 1), mp_context=mp_context) as executor:
+        node_ids = {}
+        for kind in ("nodes", "edges"):
+            os.makedirs(os.path.join(out_dir, kind), exist_ok=True)
+            futures = [
+                executor.submit(
+                    validate_file, kind, label, file_path, os.path.join(out_dir, kind, f"{label}.csv"),
+                    model, node_ids if kind == "edges" else None
+                )
+                for label, file_path in list_label_files(os.path.join(csv_dir, kind))
+            ]
+            for future in futures:
+                result = future.result()
+                if kind == "nodes":
+                    node_ids[result["label"]] = result["ids"]
+                results.append(result)
+
+    report_path = os.path.join(out_dir, "validation_errors.csv")
+    report(results, report_path)
+    invalid = sum(len(result["errors"]) for result in results)
+    print(f"\nValidated {len(results)} files in {time.monotonic() - start_time:.1f}s, {invalid} invalid row(s)")
+    bad_headers = [result["label"] for result in results if result["header_errors"]]
+    if bad_headers:
+        raise RuntimeError(f"Invalid header in {', '.join(bad_headers)}, see {report_path}")
+    return invalid
+
+if __name__ == "__main__":
+    csv_dir = sys.argv[1] if len(sys.argv) > 1 else "./csv"
+    out_dir = sys.argv[2] if len(sys.argv) > 2 else "./csv_clean"
+    try:
+        invalid = validate_csv_dir(csv_dir, out_dir)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    sys.exit(1 if invalid else 0)
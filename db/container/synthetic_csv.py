@@ -0,0 +1,284 @@
+import argparse
+import bisect
+import csv
+import json
+import math
+import os
+import random
+import shutil
+import time
+
+from csv_validator import EDGE_COLUMNS, NODE_ID_COLUMN, parse_model
+
+# Synthetic graph CSV files following csv/model.md, to benchmark the loader, the embedder and
+# the API helpers at several times the size of the real data:
+#
+#   python synthetic_csv.py --scale 10 --out ./csv_synthetic
+#   python synthetic_csv.py --scale 0.1 --degrees poisson --target-skew 1.1 --out ./csv_small
+#   python synthetic_csv.py --scale 1 --degree HasContraindication=60 --out ./csv_dense
+#
+# The files pass csv_validator.py and load with csv_loader.py (CSV_DIR=./csv_synthetic).
+# The same arguments and seed always write the same files
+
+# Node counts at scale 1, roughly those of the Theriaque export
+BASE_NODE_COUNTS = {
+    "Drug": 15000,
+    "ROA": 60,
+    "ActiveIngredient": 3500,
+    "Excipient": 1000,
+    "GenericGroup": 4000,
+    "LegalSubstanceList": 5,
+    "Indication": 20000,
+    "Contraindication": 800,
+}
+# Fixed vocabularies, they don't grow with the number of drugs
+UNSCALED_LABELS = {"ROA", "LegalSubstanceList"}
+
+# Mean number of edges leaving each source node
+BASE_DEGREES = {
+    "IsAdministeredVia": 1.2,
+    "ContainsActiveIngredient": 1.5,
+    "ContainsExcipient": 8,
+    "IsPartOfGenericGroup": 0.6,
+    "IsReferenceDrugInGroup": 0.1,
+    "IsGenericDrugInGroup": 0.5,
+    "BelongsToLegalSubstanceList": 0.8,
+    "HasIndication": 4,
+    "HasContraindication": 30,
+}
+
+# Free text columns, filled with paragraphs of about --text-length characters
+LONG_TEXT_COLUMNS = {
+    "pharmacokinetics", "conservation", "posologies", "drug_interactions", "pregnancy",
+    "breastfeeding", "female_fertility", "details", "comment", "dispensing_modalities",
+}
+
+# Exponent of the power law degree distribution, the lower the heavier the tail
+POWERLAW_ALPHA = 2.0
+
+# Different paragraphs generated once and reused, drawing every text is too slow at large scales
+TEXT_POOL_SIZE = 2000
+
+SYLLABLES = [
+    "ba", "bi", "co", "da", "di", "fe", "ga", "la", "le", "li", "lo", "ma", "mi", "mo", "na", "ne",
+    "no", "pa", "pi", "pra", "ra", "ri", "ro", "sa", "se", "ta", "te", "ti", "to", "tra", "va", "xa", "zo",
+]
+SUFFIXES = ["ne", "ol", "ine", "ate", "ide", "ex", "ium", "il", "an", "one"]
+FORMS = ["comprimé", "comprimé pelliculé", "gélule", "solution buvable", "solution injectable",
+         "poudre pour suspension", "crème", "collyre", "sirop", "suppositoire"]
+UNITS = ["mg", "g", "µg", "ml", "UI", "%"]
+WORDS = [
+    "administration", "patient", "dose", "traitement", "risque", "surveillance", "rénale", "hépatique",
+    "grossesse", "enfant", "adulte", "jour", "prise", "effet", "association", "déconseillée", "précaution",
+    "concentration", "plasmatique", "demi-vie", "élimination", "absorption", "métabolisme", "voie", "orale",
+    "insuffisance", "allaitement", "posologie", "maximale", "recommandée", "durée", "semaines", "heures",
+]
+LEVELS = ["CONTRE-INDICATION ABSOLUE", "CONTRE-INDICATION RELATIVE", "MISE EN GARDE", "PRECAUTION D'EMPLOI"]
+
+
+def scaled_counts(scale):
+    return {
+        label: count if label in UNSCALED_LABELS else max(1, round(count * scale))
+        for label, count in BASE_NODE_COUNTS.items()
+    }
+
+def sample_degree(rng, mean, distribution):
+    """Number of edges of one source node, with the given mean"""
+    if mean <= 0:
+        return 0
+    if distribution == "fixed":
+        # Randomized rounding keeps the mean of fractional degrees
+        return int(mean) + (rng.random() < mean - int(mean))
+    if distribution == "powerlaw":
+        minimum = mean * (POWERLAW_ALPHA - 1) / POWERLAW_ALPHA
+        value = minimum * rng.paretovariate(POWERLAW_ALPHA)
+        return int(value) + (rng.random() < value - int(value))
+    # Poisson, Knuth's method for small means and a normal approximation for large ones
+    if mean > 30:
+        return max(0, round(rng.gauss(mean, math.sqrt(mean))))
+    limit, k, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        k += 1
+        product *= rng.random()
+    return k
+
+class TargetSampler:
+    """Distinct target nodes of one source, uniform or Zipf-skewed ('skew' > 0) by popularity"""
+
+    def __init__(self, count, skew):
+        self.count = count
+        self.cum_weights = None
+        if skew > 0:
+            self.cum_weights = list(accumulate_weights(count, skew))
+
+    def sample(self, rng, k):
+        k = min(k, self.count)
+        # Rejection would take forever to find the last rare targets when a node links to most of them
+        if self.cum_weights is None or 2 * k > self.count:
+            return rng.sample(range(1, self.count + 1), k)
+        chosen, total = set(), self.cum_weights[-1]
+        while len(chosen) < k:
+            chosen.add(bisect.bisect(self.cum_weights, rng.random() * total) + 1)
+        return list(chosen)
+
+def accumulate_weights(count, skew):
+    total = 0.0
+    for rank in range(1, count + 1):
+        total += rank ** -skew
+        yield total
+
+class ValueGenerator:
+    """Property values by column name, plausible enough to exercise parsing, embedding and name search"""
+
+    def __init__(self, rng, text_length):
+        self.rng = rng
+        self.texts = [self.paragraph(text_length) for _ in range(TEXT_POOL_SIZE)]
+
+    def word(self):
+        return "".join(self.rng.choice(SYLLABLES) for _ in range(self.rng.randint(1, 3))) + self.rng.choice(SUFFIXES)
+
+    def paragraph(self, length):
+        words, size = [], 0
+        target = max(1, round(self.rng.uniform(0.5, 1.5) * length))
+        while size < target:
+            word = self.rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        return " ".join(words).capitalize() + "."
+
+    def name(self, label, node_id):
+        if label == "Drug":
+            return f"{self.word().upper()} {self.rng.choice([1, 2, 5, 10, 20, 50, 100, 250, 500, 1000])} " \
+                   f"{self.rng.choice(UNITS)}, {self.rng.choice(FORMS)}"
+        if label == "Indication":
+            return f"{self.rng.choice(WORDS).capitalize()} {self.word()}"
+        return f"{self.word().upper()} {node_id}" if label == "GenericGroup" else self.word().upper()
+
+    def value(self, label, column, node_id):
+        if column == "name":
+            return self.name(label, node_id)
+        if column == "theriaque_id":
+            return str(100000 + node_id)
+        if column in LONG_TEXT_COLUMNS:
+            return self.rng.choice(self.texts)
+        if column in ("single_dose_unit", "strength"):
+            return f"{self.rng.choice([0.5, 1, 5, 10, 100, 500])} {self.rng.choice(UNITS)}"
+        if column == "doses_per_package":
+            return str(self.rng.choice([1, 10, 14, 20, 28, 30, 60, 90]))
+        if column == "retail_price":
+            return f"{self.rng.uniform(1, 200):.2f}"
+        if column == "retail_reimbursement_rate":
+            return self.rng.choice(["100%", "65%", "30%", "15%", ""])
+        if column == "type_of_packaging":
+            return self.rng.choice(["plaquette", "flacon", "tube", "sachet", "ampoule"])
+        if column == "relation_type":
+            return "REFERENCE" if "Reference" in label else "GENERIC"
+        if column == "level":
+            return self.rng.choice(LEVELS)
+        return self.word()
+
+def write_nodes(out_dir, label, columns, count, values, first_id=1):
+    header = [NODE_ID_COLUMN] + [column for column in columns if column != NODE_ID_COLUMN]
+    with open(os.path.join(out_dir, "nodes", f"{label}.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(header)
+        for node_id in range(first_id, first_id + count):
+            writer.writerow([node_id] + [values.value(label, column, node_id) for column in header[1:]])
+    return count
+
+def write_edges(out_dir, label, edge, counts, first_ids, degree, distribution, sampler, values, rng):
+    header = EDGE_COLUMNS + edge["properties"]
+    # The sampler draws targets in 1..count, shifted to the id range of the target label
+    end_offset = first_ids[edge["to"]] - 1
+    rows = 0
+    with open(os.path.join(out_dir, "edges", f"{label}.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(header)
+        first_id = first_ids[edge["from"]]
+        for start_id in range(first_id, first_id + counts[edge["from"]]):
+            for end_id in sampler.sample(rng, sample_degree(rng, degree, distribution)):
+                writer.writerow([start_id, edge["from"], end_id + end_offset, edge["to"]] +
+                                [values.value(label, column, None) for column in edge["properties"]])
+                rows += 1
+    return rows
+
+def generate(model_path, out_dir, scale=1.0, distribution="poisson", target_skew=0.0,
+             degrees=None, text_length=400, seed=0):
+    """
+    Write nodes/, edges/ and a copy of model.md to out_dir, returns a summary with the row counts
+    'degrees' overrides BASE_DEGREES for some edge labels
+    """
+    start_time = time.monotonic()
+    rng = random.Random(seed)
+    nodes, edges = parse_model(model_path)
+    counts = {label: count for label, count in scaled_counts(scale).items() if label in nodes}
+    for label in nodes:
+        counts.setdefault(label, max(1, round(1000 * scale)))
+    degrees = {**BASE_DEGREES, **(degrees or {})}
+
+    for kind in ("nodes", "edges"):
+        os.makedirs(os.path.join(out_dir, kind), exist_ok=True)
+    shutil.copyfile(model_path, os.path.join(out_dir, "model.md"))
+    values = ValueGenerator(rng, text_length)
+
+    # Each label gets its own id range: the ids key the vectors of every label in document_vectors
+    rows, first_ids, next_id = {}, {}, 1
+    for label, columns in nodes.items():
+        first_ids[label] = next_id
+        rows[label] = write_nodes(out_dir, label, columns, counts[label], values, next_id)
+        next_id += counts[label]
+    samplers = {}
+    for label, edge in edges.items():
+        if edge["from"] not in counts or edge["to"] not in counts:
+            print(f"Skipping {label}: its endpoints are not node labels of model.md")
+            continue
+        sampler = samplers.setdefault(edge["to"], TargetSampler(counts[edge["to"]], target_skew))
+        rows[label] = write_edges(
+            out_dir, label, edge, counts, first_ids, degrees.get(label, 1.0), distribution, sampler, values, rng
+        )
+
+    summary = {
+        "scale": scale,
+        "distribution": distribution,
+        "target_skew": target_skew,
+        "degrees": degrees,
+        "text_length": text_length,
+        "seed": seed,
+        "rows": rows,
+        "node_rows": sum(rows[label] for label in nodes),
+        "edge_rows": sum(count for label, count in rows.items() if label not in nodes),
+        "bytes": sum(
+            os.path.getsize(os.path.join(out_dir, kind, filename))
+            for kind in ("nodes", "edges") for filename in os.listdir(os.path.join(out_dir, kind))
+        ),
+        "seconds": time.monotonic() - start_time,
+    }
+    with open(os.path.join(out_dir, "synthetic.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    print(f"Wrote {summary['node_rows']} nodes and {summary['edge_rows']} edges to {out_dir} "
+          f"in {summary['seconds']:.1f}s")
+    return summary
+
+def parse_degrees(values):
+    """EdgeLabel=mean arguments to a dict"""
+    degrees = {}
+    for value in values or []:
+        label, _, mean = value.partition("=")
+        degrees[label] = float(mean)
+    return degrees
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic graph CSV files following model.md")
+    parser.add_argument("--out", default="./csv_synthetic")
+    parser.add_argument("--model", default="./csv/model.md")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier of the node counts")
+    parser.add_argument("--degrees", choices=["poisson", "fixed", "powerlaw"], default="poisson",
+                        help="Distribution of the number of edges of each source node")
+    parser.add_argument("--target-skew", type=float, default=0.0,
+                        help="Zipf exponent of the target popularity, 0 picks targets uniformly")
+    parser.add_argument("--degree", action="append", metavar="EDGE=MEAN", help="Mean degree of an edge label")
+    parser.add_argument("--text-length", type=int, default=400, help="Mean length of the free text properties")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.model, args.out, args.scale, args.degrees, args.target_skew,
+             parse_degrees(args.degree), args.text_length, args.seed)
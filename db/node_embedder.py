@@ -3,19 +3,30 @@ import psycopg
 from openai import OpenAI
 from pgvector.psycopg import register_vector
 import os
+import sys
 import uuid
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+# Shared with the API and the loader, see api/src/metrics.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api", "src"))
+import metrics
+from metrics import count, timed
+from vector_common import index_options
+
 load_dotenv()
 import os
 print(os.environ.get("PGPASSWORD"))
 
 conn = psycopg.connect(
-    dbname="fpkg",
+    dbname=os.environ.get("PGDATABASE", "fpkg"),
     user=os.environ.get("PGUSER"),
     password=os.environ.get("PGPASSWORD"),
-    host="localhost",
-    port="5431"
+    host=os.environ.get("PGHOST", "localhost"),
+    port=os.environ.get("PGPORT", "5431")
 )
 
 cursor = conn.cursor()
@@ -26,7 +37,324 @@ cursor.execute("LOAD 'age';")
 cursor.execute("SET search_path = ag_catalog, \"$user\", public;")
 conn.commit()
 
-def add_vector_embeddings():
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+def _int_env(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+# Embedding engine settings, overridable from the environment
+# The API accepts up to 2048 inputs and 300k tokens per request, we stay well below
+EMBED_BATCH_SIZE = _int_env('EMBED_BATCH_SIZE', 100)                    # inputs per API request
+EMBED_CONCURRENCY = _int_env('EMBED_CONCURRENCY', 4)                    # API requests in flight
+EMBED_MAX_TOKENS_PER_REQUEST = _int_env('EMBED_MAX_TOKENS_PER_REQUEST', 8000)
+EMBED_REQUESTS_PER_MINUTE = _int_env('EMBED_REQUESTS_PER_MINUTE', 3000)
+EMBED_TOKENS_PER_MINUTE = _int_env('EMBED_TOKENS_PER_MINUTE', 1000000)
+EMBED_MAX_RETRIES = _int_env('EMBED_MAX_RETRIES', 5)
+
+# Approximate nearest neighbour index on document_vectors
+VECTOR_INDEX_METHOD = os.getenv('VECTOR_INDEX_METHOD', 'hnsw')         # 'hnsw' or 'ivfflat'
+HNSW_M = _int_env('HNSW_M', 16)
+HNSW_EF_CONSTRUCTION = _int_env('HNSW_EF_CONSTRUCTION', 64)
+INDEX_MAINTENANCE_WORK_MEM = os.getenv('INDEX_MAINTENANCE_WORK_MEM', '1GB')
+# Also build one partial index per node label, used by label-filtered searches
+VECTOR_INDEX_PER_LABEL = os.getenv('VECTOR_INDEX_PER_LABEL', 'true').lower() in ['true', '1', 'yes', 'y']
+# Also index the binary quantization of the vectors, used by the two-stage search of api/src/utils.vsearch
+VECTOR_BINARY_INDEX = os.getenv('VECTOR_BINARY_INDEX', 'false').lower() in ['true', '1', 'yes', 'y']
+
+# Storage of a new document_vectors table: text-embedding-3 vectors can be shortened (the API returns
+# the first dimensions, renormalized) and stored in half precision ('halfvec'), e.g. 512 halfvec
+# dimensions take 1 KB instead of 6 KB. Existing tables keep their storage, vector_storage.py converts them
+EMBEDDING_DIMENSIONS = _int_env('EMBEDDING_DIMENSIONS', 1536)
+VECTOR_STORAGE = os.getenv('VECTOR_STORAGE', 'vector')                 # 'vector' or 'halfvec'
+# Native dimensions of EMBEDDING_MODEL, requests only ask for fewer when the table stores fewer
+MODEL_DIMENSIONS = 1536
+
+# The index only serves queries using the distance operator of its operator class
+# api/src/utils.vsearch_drug orders by L2 distance (<->)
+SEARCH_DISTANCE_OPERATOR = '<->'
+VECTOR_OPCLASSES = {
+    '<->': 'vector_l2_ops',
+    '<=>': 'vector_cosine_ops',
+    '<#>': 'vector_ip_ops',
+}
+
+def node_text(node_name, node_label):
+    """Text sent to the embedding model for a node (combine name and type for better context)"""
+    return f"{node_label}: {node_name}"
+
+def content_hash(text):
+    """Fingerprint of an embedded text, stored next to its vector to detect changes"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def estimate_tokens(text):
+    """Cheap upper bound of the token count, French text averages well above 3 chars per token"""
+    return len(text) // 3 + 1
+
+class RateLimiter:
+    """
+    Token bucket limiting both the number of requests and the number of tokens per minute.
+    acquire() blocks the calling thread until the request fits in both budgets.
+    """
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_allowance = float(requests_per_minute)
+        self.token_allowance = float(tokens_per_minute)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        self.request_allowance = min(
+            self.requests_per_minute,
+            self.request_allowance + elapsed * self.requests_per_minute / 60
+        )
+        self.token_allowance = min(
+            self.tokens_per_minute,
+            self.token_allowance + elapsed * self.tokens_per_minute / 60
+        )
+
+    def acquire(self, tokens):
+        # A single request larger than the whole budget would otherwise wait forever
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.request_allowance >= 1 and self.token_allowance >= tokens:
+                    self.request_allowance -= 1
+                    self.token_allowance -= tokens
+                    return
+                missing_requests = max(0, 1 - self.request_allowance) * 60 / self.requests_per_minute
+                missing_tokens = max(0, tokens - self.token_allowance) * 60 / self.tokens_per_minute
+                wait = max(missing_requests, missing_tokens)
+            time.sleep(wait)
+
+def make_request_batches(texts, max_inputs, max_tokens):
+    """
+    Group texts into API requests, bounded by number of inputs and estimated tokens.
+    Returns a list of batches, each batch being a list of indices into 'texts'
+    """
+    batches = []
+    current, current_tokens = [], 0
+    for index, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_inputs or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _embed_request(openai_client, texts, limiter, max_retries):
+    """Send a single batched request, retrying with exponential backoff"""
+    limiter.acquire(sum(estimate_tokens(text) for text in texts))
+    for attempt in range(max_retries + 1):
+        try:
+            # Shortened embeddings are only requested when the table stores fewer dimensions
+            options = {"dimensions": vector_dimensions} if vector_dimensions != MODEL_DIMENSIONS else {}
+            with timed("embedding_request", model=EMBEDDING_MODEL):
+                response = openai_client.embeddings.create(
+                    model=EMBEDDING_MODEL,
+                    input=texts,
+                    **options
+                )
+            count("embedding_inputs", len(texts))
+            if len(response.data) != len(texts):
+                raise ValueError(f"Expected {len(texts)} embeddings, got {len(response.data)}")
+            # The API returns one item per input, tagged with its position
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except Exception:
+            if attempt == max_retries:
+                raise
+            count("embedding_retries")
+            time.sleep(min(2 ** attempt, 30))
+            limiter.acquire(sum(estimate_tokens(text) for text in texts))
+
+def embed_texts(
+    openai_client,
+    texts,
+    limiter,
+    batch_size=EMBED_BATCH_SIZE,
+    concurrency=EMBED_CONCURRENCY,
+    max_tokens=EMBED_MAX_TOKENS_PER_REQUEST,
+    max_retries=EMBED_MAX_RETRIES
+):
+    """
+    Embed many texts with batched requests, keeping up to 'concurrency' requests in flight.
+    Returns a list aligned with 'texts', holding either the embedding or the exception
+    raised by the request that contained the text.
+    """
+    results = [None] * len(texts)
+    batches = make_request_batches(texts, batch_size, max_tokens)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            (batch, executor.submit(
+                _embed_request, openai_client, [texts[i] for i in batch], limiter, max_retries
+            ))
+            for batch in batches
+        ]
+        for batch, future in futures:
+            try:
+                embeddings = future.result()
+                for i, embedding in zip(batch, embeddings):
+                    results[i] = embedding
+            except Exception as e:
+                for i in batch:
+                    results[i] = e
+    return results
+
+def get_active_graph():
+    """Graph the 'fcsv' alias points to since the last reload of csv_loader.py"""
+    cursor.execute("SELECT to_regclass('public.graph_version') IS NOT NULL;")
+    if cursor.fetchone()[0]:
+        cursor.execute("""
+            SELECT COALESCE(to_jsonb(g) ->> 'active_graph', graph_name)
+            FROM public.graph_version g WHERE graph_name = 'fcsv';
+        """)
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+    return 'fcsv'
+
+def get_vector_column():
+    """(storage, dimensions) of document_vectors.embedding, e.g. ('halfvec', 512)"""
+    cursor.execute("""
+        SELECT t.typname, a.atttypmod FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid
+        WHERE a.attrelid = to_regclass('document_vectors') AND a.attname = 'embedding';
+    """)
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (VECTOR_STORAGE, EMBEDDING_DIMENSIONS)
+
+# Storage of the existing table, set by add_vector_embeddings and create_vector_index
+vector_storage, vector_dimensions = VECTOR_STORAGE, EMBEDDING_DIMENSIONS
+
+def create_staging_tables():
+    """
+    Temporary tables receiving COPY streams before being merged into the real tables.
+    Rows are discarded at the end of each transaction.
+    Vectors are staged as float32 'vector', the binary COPY format of halfvec isn't supported by pgvector-python
+    """
+    cursor.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS document_vectors_staging (
+            id TEXT,
+            node_name TEXT,
+            node_label TEXT,
+            embedding vector({vector_dimensions}),
+            content_hash TEXT,
+            model TEXT
+        ) ON COMMIT DELETE ROWS;
+    """)
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS embedding_progress_staging (
+            node_id TEXT,
+            node_label TEXT,
+            status TEXT,
+            error_message TEXT
+        ) ON COMMIT DELETE ROWS;
+    """)
+
+def copy_vectors(rows):
+    """
+    Bulk upsert (id, node_name, node_label, embedding, content_hash, model) rows into document_vectors.
+    Vectors are streamed with the binary pgvector encoding, then merged with a single statement.
+    """
+    if not rows:
+        return
+    with timed("copy_vectors"):
+        _copy_vectors(rows)
+    count("vectors_written", len(rows))
+
+def _copy_vectors(rows):
+    with cursor.copy("""
+        COPY document_vectors_staging (id, node_name, node_label, embedding, content_hash, model)
+        FROM STDIN (FORMAT BINARY)
+    """) as copy:
+        copy.set_types(['text', 'text', 'text', 'vector', 'text', 'text'])
+        for row in rows:
+            copy.write_row(row)
+    cursor.execute(f"""
+        INSERT INTO document_vectors (id, node_name, node_label, embedding, content_hash, model)
+        SELECT DISTINCT ON (id) id, node_name, node_label, embedding::{vector_storage}({vector_dimensions}),
+               content_hash, model
+        FROM document_vectors_staging
+        ON CONFLICT (id) DO UPDATE SET
+            node_name = EXCLUDED.node_name,
+            node_label = EXCLUDED.node_label,
+            embedding = EXCLUDED.embedding,
+            content_hash = EXCLUDED.content_hash,
+            model = EXCLUDED.model,
+            created_at = CURRENT_TIMESTAMP
+    """)
+    cursor.execute("TRUNCATE document_vectors_staging")
+
+def copy_progress_rows(rows):
+    """Stream (node_id, node_label, status, error_message) rows into the progress staging table"""
+    with cursor.copy("""
+        COPY embedding_progress_staging (node_id, node_label, status, error_message) FROM STDIN (FORMAT BINARY)
+    """) as copy:
+        copy.set_types(['text', 'text', 'text', 'text'])
+        for row in rows:
+            copy.write_row(row)
+
+def copy_pending_nodes(session_id, rows):
+    """Register (node_id, node_label) rows as pending for a session, in one merge"""
+    if not rows:
+        return
+    copy_progress_rows((node_id, node_label, 'pending', None) for node_id, node_label in rows)
+    cursor.execute("""
+        INSERT INTO embedding_progress (session_id, node_id, node_label, status)
+        SELECT %s, node_id, node_label, status
+        FROM embedding_progress_staging
+        ON CONFLICT (session_id, node_id) DO NOTHING
+    """, (session_id,))
+    cursor.execute("TRUNCATE embedding_progress_staging")
+
+def copy_status_updates(session_id, rows):
+    """Apply (node_id, status, error_message) changes to a session's progress, in one merge"""
+    if not rows:
+        return
+    copy_progress_rows((node_id, None, status, error_message) for node_id, status, error_message in rows)
+    cursor.execute("""
+        UPDATE embedding_progress ep
+        SET status = s.status, error_message = s.error_message, updated_at = CURRENT_TIMESTAMP
+        FROM embedding_progress_staging s
+        WHERE ep.session_id = %s AND ep.node_id = s.node_id
+    """, (session_id,))
+    cursor.execute("TRUNCATE embedding_progress_staging")
+
+def migrate_document_vectors():
+    """
+    Bring a document_vectors table created by earlier versions (or restored from full_db.dump) up to date:
+    add the new columns and the label index, and backfill the hashes.
+    Previous vectors were all embedded from "{label}: {name}" with the same model
+    """
+    cursor.execute("ALTER TABLE document_vectors ADD COLUMN IF NOT EXISTS content_hash TEXT;")
+    cursor.execute("ALTER TABLE document_vectors ADD COLUMN IF NOT EXISTS model TEXT;")
+    cursor.execute("""
+        ALTER TABLE document_vectors
+        ADD COLUMN IF NOT EXISTS label TEXT GENERATED ALWAYS AS (btrim(node_label, '[]" ')) STORED;
+    """)
+    cursor.execute("""
+        UPDATE document_vectors
+        SET content_hash = encode(sha256(convert_to(node_label || ': ' || node_name, 'UTF8')), 'hex'),
+            model = %s
+        WHERE content_hash IS NULL
+    """, (EMBEDDING_MODEL,))
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_document_vectors_label ON document_vectors(label);")
+
+def add_vector_embeddings(incremental=False):
+    """
+    Embed the graph's nodes into document_vectors.
+    In incremental mode, only new nodes and nodes whose embedded text or model changed are
+    embedded, and vectors of nodes that no longer exist in the graph are deleted.
+    """
+    global vector_storage, vector_dimensions
     print("\nAdding vector embeddings...")
     cursor.execute('CREATE EXTENSION IF NOT EXISTS vector')
 
@@ -40,17 +368,23 @@ def add_vector_embeddings():
     print("Creating document_vectors and embedding_progress tables...")
     try:
         # Main embeddings table
-        query = """
+        query = f"""
             CREATE TABLE IF NOT EXISTS document_vectors (
                 id TEXT PRIMARY KEY,
                 node_name TEXT,
                 node_label TEXT,
-                embedding vector(1536),  -- OpenAI text-embedding-3-small dimensionality
+                embedding {VECTOR_STORAGE}({EMBEDDING_DIMENSIONS}),  -- see EMBEDDING_DIMENSIONS
+                content_hash TEXT,       -- sha256 of the embedded text
+                model TEXT,              -- embedding model that produced the vector
+                -- bare label name (node_label holds the raw agtype returned by labels(v))
+                label TEXT GENERATED ALWAYS AS (btrim(node_label, '[]" ')) STORED,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
         """
         cursor.execute(query)
         
+        migrate_document_vectors()
+        
         # Progress tracking table
         progress_query = """
             CREATE TABLE IF NOT EXISTS embedding_progress (
@@ -71,6 +405,9 @@ def add_vector_embeddings():
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_embedding_progress_session_status ON embedding_progress(session_id, status);")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_embedding_progress_node_id ON embedding_progress(node_id);")
         
+        vector_storage, vector_dimensions = get_vector_column()
+        print(f"Storing {vector_dimensions} dimensions as {vector_storage}")
+        create_staging_tables()
         conn.commit()
         print("Tables created successfully")
     except Exception as e:
@@ -78,61 +415,68 @@ def add_vector_embeddings():
         return
     
     # Set up OpenAI client
+    # OPENAI_BASE_URL can point it to a local stub server (see stub_embedding_server.py)
     openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))  # Changed this line
+    limiter = RateLimiter(EMBED_REQUESTS_PER_MINUTE, EMBED_TOKENS_PER_MINUTE)
     
     # Generate or resume session ID
-    import time
     session_id = f"embedding_session_{int(time.time())}"
     print(f"Starting embedding session: {session_id}")
     
-    # Check if we should resume a previous session
-    cursor.execute("""
-        SELECT session_id, COUNT(*) as total, 
-               SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed,
-               SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed
-        FROM embedding_progress 
-        WHERE status != 'completed'
-        GROUP BY session_id 
-        ORDER BY MAX(created_at) DESC 
-        LIMIT 1
-    """)
+    if incremental:
+        # The delta computed from content hashes replaces resuming: unfinished work shows up again
+        print("Incremental mode: only new or changed nodes will be embedded")
+    else:
+        # Check if we should resume a previous session
+        cursor.execute("""
+            SELECT session_id, COUNT(*) as total, 
+                   SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) as completed,
+                   SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed
+            FROM embedding_progress 
+            WHERE status != 'completed'
+            GROUP BY session_id 
+            ORDER BY MAX(created_at) DESC 
+            LIMIT 1
+        """)
     
-    previous_session = cursor.fetchone()
-    if previous_session:
-        resume_session_id, total, completed, failed = previous_session
-        print(f"Found incomplete session: {resume_session_id}")
-        print(f"Progress: {completed}/{total} completed, {failed} failed")
+        previous_session = cursor.fetchone()
+        if previous_session:
+            resume_session_id, total, completed, failed = previous_session
+            print(f"Found incomplete session: {resume_session_id}")
+            print(f"Progress: {completed}/{total} completed, {failed} failed")
         
-        # Check environment variable or use interactive prompt
-        force_resume = os.getenv('RESUME_SESSION', '').lower() in ['true', '1', 'yes', 'y']
-        force_new = os.getenv('NEW_SESSION', '').lower() in ['true', '1', 'yes', 'y']
+            # Check environment variable or use interactive prompt
+            force_resume = os.getenv('RESUME_SESSION', '').lower() in ['true', '1', 'yes', 'y']
+            force_new = os.getenv('NEW_SESSION', '').lower() in ['true', '1', 'yes', 'y']
         
-        if force_resume:
-            session_id = resume_session_id
-            print(f"Resuming session (RESUME_SESSION=true): {session_id}")
-        elif force_new:
-            print(f"Starting new session (NEW_SESSION=true): {session_id}")
-        else:
-            # Interactive prompt
-            response = input("Resume previous session? (y/n): ").lower().strip()
-            if response == 'y':
+            if force_resume:
                 session_id = resume_session_id
-                print(f"Resuming session: {session_id}")
+                print(f"Resuming session (RESUME_SESSION=true): {session_id}")
+            elif force_new:
+                print(f"Starting new session (NEW_SESSION=true): {session_id}")
             else:
-                print(f"Starting new session: {session_id}")
-    else:
-        print(f"No previous incomplete sessions found. Starting new session: {session_id}")
+                # Interactive prompt
+                response = input("Resume previous session? (y/n): ").lower().strip()
+                if response == 'y':
+                    session_id = resume_session_id
+                    print(f"Resuming session: {session_id}")
+                else:
+                    print(f"Starting new session: {session_id}")
+        else:
+            print(f"No previous incomplete sessions found. Starting new session: {session_id}")
     
     # Get all nodes from the graph database
     print("Retrieving nodes from graph database...")
     try:
+        graph_name = get_active_graph()
+        print(f"Reading graph '{graph_name}'")
         # First, get all vertex label tables for the graph
         cursor.execute("""
             SELECT name, relation
             FROM ag_catalog.ag_label
             WHERE kind = 'v' AND name != '_ag_label_vertex'
-            AND graph = (SELECT graphid FROM ag_catalog.ag_graph WHERE name = 'fcsv')
-        """)
+            AND graph = (SELECT graphid FROM ag_catalog.ag_graph WHERE name = %s)
+        """, (graph_name,))
         vertex_labels = cursor.fetchall()
         
         if not vertex_labels:
@@ -142,23 +486,29 @@ def add_vector_embeddings():
         print(f"Found {len(vertex_labels)} vertex label types")
         
         all_nodes = []
+        # Labels whose nodes couldn't be read, their vectors must not be taken for deleted nodes
+        failed_labels = set()
         
         # Query each vertex label table
         for label_name, table_relation in vertex_labels:
             try:
                 # Now that we retrieved the label names, we can embed them
-                cursor.execute(f"""
-                    SELECT * FROM cypher('fcsv', $$
-                        MATCH (v:{label_name})
-                        RETURN v.id, v.name, labels(v)
-                    $$) AS (v_id agtype, v_name agtype, v_labels agtype);
-                """)
-                label_nodes = cursor.fetchall()
+                with timed("read_nodes", label=label_name):
+                    cursor.execute(f"""
+                        SELECT * FROM cypher('{graph_name}', $$
+                            MATCH (v:{label_name})
+                            RETURN v.id, v.name, labels(v)
+                        $$) AS (v_id agtype, v_name agtype, v_labels agtype);
+                    """)
+                    label_nodes = cursor.fetchall()
                 all_nodes.extend(label_nodes)
                 print(f"Found {len(label_nodes)} nodes in {label_name}")
                 
             except Exception as label_error:
                 print(f"Error querying {label_name}: {str(label_error)}")
+                # The failed query aborted the transaction, the next labels would fail too
+                conn.rollback()
+                failed_labels.add(label_name)
                 continue
         
         nodes = all_nodes
@@ -168,19 +518,45 @@ def add_vector_embeddings():
         print(f"Error retrieving nodes: {str(e)}")
         return
     
+    if incremental:
+        # Compare the graph with the stored hashes to find what needs to be (re-)embedded
+        cursor.execute("SELECT id, content_hash, model, label FROM document_vectors")
+        rows = cursor.fetchall()
+        stored = {row[0]: (row[1], row[2]) for row in rows}
+        stored_labels = {row[0]: row[3] for row in rows}
+        
+        graph_ids = {str(node_id) for node_id, node_name, node_label in nodes}
+        deleted_ids = [
+            node_id for node_id in stored
+            if node_id not in graph_ids and stored_labels[node_id] not in failed_labels
+        ]
+        nodes = [
+            (node_id, node_name, node_label)
+            for node_id, node_name, node_label in nodes
+            if stored.get(str(node_id)) != (content_hash(node_text(node_name, node_label)), EMBEDDING_MODEL)
+        ]
+        print(f"Delta: {len(nodes)} new or changed nodes, {len(deleted_ids)} deleted nodes")
+        if failed_labels:
+            print(f"Kept the vectors of the labels that couldn't be read: {', '.join(sorted(failed_labels))}")
+        
+        if deleted_ids:
+            cursor.execute("DELETE FROM document_vectors WHERE id = ANY(%s)", (deleted_ids,))
+            conn.commit()
+            print(f"Deleted {len(deleted_ids)} vectors of nodes no longer in the graph")
+    
     # Initialize progress tracking for new session
     if session_id.startswith("embedding_session_"):
         print("Initializing progress tracking...")
-        for node_id, node_name, node_label in nodes:
-            if node_name and node_name.strip():
-                try:
-                    cursor.execute("""
-                        INSERT INTO embedding_progress (session_id, node_id, node_label, status)
-                        VALUES (%s, %s, %s, 'pending')
-                        ON CONFLICT (session_id, node_id) DO NOTHING
-                    """, (session_id, str(node_id), str(node_label)))
-                except Exception as e:
-                    print(f"Error tracking node {node_id}: {str(e)}")
+        try:
+            copy_pending_nodes(session_id, [
+                (str(node_id), str(node_label))
+                for node_id, node_name, node_label in nodes
+                if node_name and node_name.strip()
+            ])
+        except Exception as e:
+            print(f"Error initializing progress tracking: {str(e)}")
+            conn.rollback()
+            return
         conn.commit()
         print("Progress tracking initialized")
     
@@ -195,17 +571,17 @@ def add_vector_embeddings():
     pending_nodes = cursor.fetchall()
     print(f"Found {len(pending_nodes)} nodes to process")
     
-    # Get the actual node data for pending nodes
-    nodes_to_process = []
-    for pending_node_id, pending_node_label, status in pending_nodes:
-        # Find the node data from our original query
-        for node_id, node_name, node_label in nodes:
-            if str(node_id) == pending_node_id:
-                nodes_to_process.append((node_id, node_name, node_label))
-                break
-    
-    # Process nodes in batches to avoid overwhelming the API
-    batch_size = 100
+    # Get the actual node data for pending nodes, through an index keyed by node id
+    nodes_by_id = {str(node[0]): node for node in nodes}
+    nodes_to_process = [
+        nodes_by_id[pending_node_id]
+        for pending_node_id, pending_node_label, status in pending_nodes
+        if pending_node_id in nodes_by_id
+    ]
+    
+    # Process nodes in windows: each window is split into batched API requests
+    # which are sent concurrently, then written and committed together
+    batch_size = EMBED_BATCH_SIZE * EMBED_CONCURRENCY
     embedded_count = 0
     
     # Get current progress
@@ -217,92 +593,87 @@ def add_vector_embeddings():
     
     print(f"Already completed: {already_completed}")
     print(f"Remaining to process: {len(nodes_to_process)}")
+    print(f"Embedding {EMBED_BATCH_SIZE} nodes per request, {EMBED_CONCURRENCY} requests in flight")
+    
+    start_time = time.monotonic()
     
     for i in range(0, len(nodes_to_process), batch_size):
         batch = nodes_to_process[i:i + batch_size]
         print(f"Processing batch {i//batch_size + 1}/{(len(nodes_to_process) + batch_size - 1)//batch_size}...")
         
+        status_updates = []
+        candidates = []
         for node_id, node_name, node_label in batch:
-            try:
-                # Skip if node_name is empty or None
-                if not node_name or node_name.strip() == '':
-                    # Mark as failed with reason
-                    cursor.execute("""
-                        UPDATE embedding_progress 
-                        SET status = 'failed', error_message = 'Empty node name', updated_at = CURRENT_TIMESTAMP
-                        WHERE session_id = %s AND node_id = %s
-                    """, (session_id, str(node_id)))
-                    continue
-                
-                # Check if already embedded (in case of duplicate processing)
-                cursor.execute("""
-                    SELECT 1 FROM document_vectors WHERE id = %s
-                """, (str(node_id),))
-                
-                if cursor.fetchone():
-                    # Mark as completed
-                    cursor.execute("""
-                        UPDATE embedding_progress 
-                        SET status = 'completed', updated_at = CURRENT_TIMESTAMP
-                        WHERE session_id = %s AND node_id = %s
-                    """, (session_id, str(node_id)))
-                    embedded_count += 1
-                    continue
-                
-                # Create text to embed (combine name and type for better context)
-                text_to_embed = f"{node_label}: {node_name}"
-                
-                # Generate embedding using OpenAI
-                response = openai_client.embeddings.create(
-                    model="text-embedding-3-small",
-                    input=text_to_embed
-                )
-                
-                embedding = response.data[0].embedding
-                
-                # Insert into document_vectors table
-                cursor.execute("""
-                    INSERT INTO document_vectors (id, node_name, node_label, embedding)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (id) DO UPDATE SET
-                        node_name = EXCLUDED.node_name,
-                        node_label = EXCLUDED.node_label,
-                        embedding = EXCLUDED.embedding
-                """, (str(node_id), str(node_name), str(node_label), embedding))
-                
-                # Mark as completed in progress table
-                cursor.execute("""
-                    UPDATE embedding_progress 
-                    SET status = 'completed', updated_at = CURRENT_TIMESTAMP
-                    WHERE session_id = %s AND node_id = %s
-                """, (session_id, str(node_id)))
-                
-                embedded_count += 1
-                
-                if embedded_count % 50 == 0:
-                    total_completed = already_completed + embedded_count
-                    print(f"  Embedded {embedded_count} in this session ({total_completed} total completed)...")
-                    
-            except Exception as e:
-                error_msg = str(e)
+            # Skip if node_name is empty or None
+            if not node_name or node_name.strip() == '':
+                # Mark as failed with reason
+                status_updates.append((str(node_id), 'failed', 'Empty node name'))
+                continue
+            candidates.append((node_id, node_name, node_label))
+        
+        # Check which nodes are already embedded with the same text and model
+        # (in case of duplicate processing), changed nodes are embedded again
+        cursor.execute("""
+            SELECT id, content_hash FROM document_vectors WHERE id = ANY(%s) AND model = %s
+        """, ([str(node_id) for node_id, node_name, node_label in candidates], EMBEDDING_MODEL))
+        already_embedded = dict(cursor.fetchall())
+        
+        to_embed = []
+        for node_id, node_name, node_label in candidates:
+            if already_embedded.get(str(node_id)) == content_hash(node_text(node_name, node_label)):
+                # Mark as completed
+                status_updates.append((str(node_id), 'completed', None))
+                continue
+            to_embed.append((node_id, node_name, node_label))
+        
+        # Create texts to embed (combine name and type for better context)
+        texts = [node_text(node_name, node_label) for node_id, node_name, node_label in to_embed]
+        
+        # Generate all embeddings of the batch using OpenAI
+        embeddings = embed_texts(openai_client, texts, limiter)
+        
+        vector_rows = []
+        for (node_id, node_name, node_label), text, embedding in zip(to_embed, texts, embeddings):
+            if isinstance(embedding, Exception):
+                error_msg = str(embedding)
                 print(f"Error embedding node {node_id} ({node_name}): {error_msg}")
+                count("embedding_failures", error=type(embedding).__name__)
                 
                 # Mark as failed in progress table
-                cursor.execute("""
-                    UPDATE embedding_progress 
-                    SET status = 'failed', error_message = %s, updated_at = CURRENT_TIMESTAMP
-                    WHERE session_id = %s AND node_id = %s
-                """, (error_msg, session_id, str(node_id)))
+                status_updates.append((str(node_id), 'failed', error_msg))
                 continue
+            
+            vector_rows.append((
+                str(node_id), str(node_name), str(node_label), embedding, content_hash(text), EMBEDDING_MODEL
+            ))
+            status_updates.append((str(node_id), 'completed', None))
+        
+        # Write the whole batch: vectors first, then progress, in the same transaction
+        try:
+            copy_vectors(vector_rows)
+            copy_status_updates(session_id, status_updates)
+        except Exception as e:
+            print(f"Error writing batch: {str(e)}")
+            conn.rollback()
+            continue
+        embedded_count += sum(1 for node_id, status, error_message in status_updates if status == 'completed')
         
         # Commit batch
         try:
             conn.commit()
-            print(f"  Committed batch {i//batch_size + 1}")
+            elapsed = time.monotonic() - start_time
+            total_completed = already_completed + embedded_count
+            rate = embedded_count / elapsed if elapsed > 0 else 0
+            print(f"  Committed batch {i//batch_size + 1}: {embedded_count} embedded in this session "
+                  f"({total_completed} total completed), {rate:.1f} nodes/s")
         except Exception as e:
             print(f"Error committing batch: {str(e)}")
             conn.rollback()
     
+    elapsed = time.monotonic() - start_time
+    if embedded_count:
+        print(f"\nEmbedded {embedded_count} nodes in {elapsed:.1f}s ({embedded_count / elapsed:.1f} nodes/s)")
+    
     # Final progress report
     cursor.execute("""
         SELECT status, COUNT(*) 
@@ -321,6 +692,80 @@ def add_vector_embeddings():
     print(f"Failed: {total_failed}")
     print(f"Still pending: {total_pending}")
     print("Vector embeddings processing completed!")
+    
+    # HNSW indexes are maintained on insert, so this is a no-op once the index exists
+    create_vector_index()
+
+def _drop_vector_indexes(prefix):
+    cursor.execute("""
+        SELECT indexname FROM pg_indexes
+        WHERE tablename = 'document_vectors' AND indexname LIKE %s
+    """, (prefix + '%',))
+    for (index_name,) in cursor.fetchall():
+        cursor.execute("DROP INDEX IF EXISTS " + index_name)
+
+def create_vector_index(method=VECTOR_INDEX_METHOD, distance_operator=SEARCH_DISTANCE_OPERATOR, rebuild=False):
+    """
+    Build the ANN index of document_vectors, with the operator class matching the search operator.
+    Unless VECTOR_INDEX_PER_LABEL is off, one partial index per node label is built too, so that
+    searches filtered on a single label (WHERE label = 'Drug') only visit that label's vectors.
+    Only one method is kept at a time: building HNSW indexes drops the IVFFlat ones and vice versa.
+    IVFFlat centroids are computed from existing rows, so it should be (re)built after loading.
+    With VECTOR_BINARY_INDEX, the binary quantization of the vectors is indexed the same way (Hamming distance),
+    the expression must stay identical to the one of api/src/utils.build_vsearch_query
+    """
+    global vector_storage, vector_dimensions
+    if method not in ('hnsw', 'ivfflat'):
+        print(f"Unknown index method '{method}', expected 'hnsw' or 'ivfflat'")
+        return
+    vector_storage, vector_dimensions = get_vector_column()
+    # halfvec columns need the halfvec variant of the operator class
+    opclass = VECTOR_OPCLASSES[distance_operator].replace('vector_', f'{vector_storage}_', 1)
+    other_method = 'ivfflat' if method == 'hnsw' else 'hnsw'
+    
+    # (index name prefix, indexed expression, operator class)
+    kinds = [(f"idx_document_vectors_embedding_{method}", "embedding", opclass)]
+    if VECTOR_BINARY_INDEX:
+        kinds.append((
+            f"idx_document_vectors_binary_{method}",
+            f"(binary_quantize(embedding)::bit({vector_dimensions}))",
+            "bit_hamming_ops",
+        ))
+    for kind in ("embedding", "binary"):
+        _drop_vector_indexes(f"idx_document_vectors_{kind}_{other_method}")
+        if rebuild:
+            _drop_vector_indexes(f"idx_document_vectors_{kind}_{method}")
+    
+    cursor.execute("SELECT label, COUNT(*) FROM document_vectors GROUP BY label")
+    label_counts = dict(cursor.fetchall())
+    
+    # (index name, row count, partial index predicate, expression, operator class)
+    indexes = []
+    for index_name, expression, index_opclass in kinds:
+        indexes.append((index_name, sum(label_counts.values()), "", expression, index_opclass))
+        if VECTOR_INDEX_PER_LABEL:
+            indexes.extend(
+                (f"{index_name}_{label.lower()}", count, f"WHERE label = '{label}'", expression, index_opclass)
+                for label, count in sorted(label_counts.items())
+                if label and label.isidentifier()
+            )
+    
+    cursor.execute(f"SET maintenance_work_mem = '{INDEX_MAINTENANCE_WORK_MEM}'")
+    for name, rows, predicate, expression, index_opclass in indexes:
+        options = index_options(method, rows, HNSW_M, HNSW_EF_CONSTRUCTION)
+        print(f"Building {name} ({index_opclass}, {options}) {predicate}...")
+        start_time = time.monotonic()
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS {name}
+            ON document_vectors USING {method} ({expression} {index_opclass})
+            WITH ({options})
+            {predicate}
+        """)
+        conn.commit()
+        print(f"  Index {name} ready in {time.monotonic() - start_time:.1f}s")
+    
+    cursor.execute("ANALYZE document_vectors")
+    conn.commit()
 
 def check_embedding_progress():
     """Check progress of all embedding sessions"""
@@ -385,7 +830,9 @@ def get_failed_nodes_summary(session_id):
         print(f"No failures found for session {session_id}")
 
 # Main execution
-import sys
+# FPKG_METRICS_FILE=embed_metrics.json (or .prom) writes the timings of the run, see api/src/metrics.py
+if metrics.METRICS_FILE:
+    metrics.enable_metrics()
 
 try:
     if len(sys.argv) > 1:
@@ -397,12 +844,26 @@ try:
             session_id = sys.argv[2]
             cleanup_failed_nodes(session_id)
             print(f"Failed nodes reset for session {session_id}. Run without arguments to continue.")
+        elif command == "incremental":
+            add_vector_embeddings(incremental=True)
+        elif command == "migrate":
+            migrate_document_vectors()
+            conn.commit()
+            print("document_vectors migrated")
+        elif command == "index":
+            method = sys.argv[2] if len(sys.argv) > 2 else VECTOR_INDEX_METHOD
+            # The per-label indexes filter on the label column
+            migrate_document_vectors()
+            create_vector_index(method, rebuild=True)
         elif command == "failures" and len(sys.argv) > 2:
             session_id = sys.argv[2]
             get_failed_nodes_summary(session_id)
         else:
             print("Usage:")
             print("  python node_embedder.py                    # Start/resume embedding")
+            print("  python node_embedder.py incremental        # Embed only new/changed nodes, drop deleted ones")
+            print("  python node_embedder.py migrate            # Upgrade document_vectors created by earlier versions or restored from the dump")
+            print("  python node_embedder.py index [hnsw|ivfflat] # (Re)build the vector search index")
             print("  python node_embedder.py progress           # Check all sessions progress")
             print("  python node_embedder.py retry <session_id> # Reset failed nodes to retry")
             print("  python node_embedder.py failures <session_id> # Show failure summary")
@@ -418,4 +879,6 @@ finally:
     # Close the connection
     cursor.close()
     conn.close()
-    print("\nDatabase connection closed.")
\ No newline at end of file
+    print("\nDatabase connection closed.")
+    if metrics.METRICS_FILE:
+        metrics.write_metrics(metrics.METRICS_FILE)
\ No newline at end of file
@@ -0,0 +1,90 @@
+import argparse
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal stand-in for the OpenAI embeddings endpoint, used to test and benchmark
+# the embedder without paying for API calls:
+#
+#   python stub_embedding_server.py --port 8089 --latency 0.2
+#   OPENAI_BASE_URL=http://localhost:8089/v1 OPENAI_API_KEY=stub python node_embedder.py
+#
+# Vectors are deterministic (seeded from the input text) so reruns produce the same embeddings
+
+def fake_embedding(text, dimensions):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = sum(x * x for x in vector) ** 0.5
+    return [x / norm for x in vector]
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    dimensions = 1536
+    latency = 0.0
+    stats = {"requests": 0, "inputs": 0}
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length))
+        inputs = payload["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dimensions = payload.get("dimensions") or self.dimensions
+
+        # Simulate the network round trip of the real API
+        if self.latency:
+            time.sleep(self.latency)
+
+        self.stats["requests"] += 1
+        self.stats["inputs"] += len(inputs)
+
+        body = json.dumps({
+            "object": "list",
+            "model": payload.get("model"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text, dimensions)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {
+                "prompt_tokens": sum(len(text) // 4 + 1 for text in inputs),
+                "total_tokens": sum(len(text) // 4 + 1 for text in inputs),
+            },
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the output readable, stats are printed on shutdown instead
+        pass
+
+def serve(port=8089, latency=0.0, dimensions=1536):
+    EmbeddingHandler.latency = latency
+    EmbeddingHandler.dimensions = dimensions
+    server = ThreadingHTTPServer(("localhost", port), EmbeddingHandler)
+    print(f"Stub embedding server listening on http://localhost:{port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stats = EmbeddingHandler.stats
+        print(f"\nServed {stats['requests']} requests, {stats['inputs']} inputs")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of the OpenAI embeddings API")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    args = parser.parse_args()
+    serve(port=args.port, latency=args.latency, dimensions=args.dimensions)
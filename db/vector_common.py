@@ -0,0 +1,37 @@
+import os
+import statistics
+
+import psycopg
+
+# Helpers shared by node_embedder.py, vector_index_benchmark.py and vector_storage.py.
+# Those are scripts that connect on import, this module doesn't so that they can all import it
+
+def connect():
+    """Connection to the database of document_vectors, PGDATABASE/PGHOST/PGPORT default to the local one"""
+    conn = psycopg.connect(
+        dbname=os.environ.get("PGDATABASE", "fpkg"),
+        user=os.environ.get("PGUSER"),
+        password=os.environ.get("PGPASSWORD"),
+        host=os.environ.get("PGHOST", "localhost"),
+        port=os.environ.get("PGPORT", "5431")
+    )
+    # document_vectors is created by node_embedder.py with the AGE search path
+    conn.execute("SET search_path = ag_catalog, \"$user\", public;")
+    conn.commit()
+    return conn
+
+def index_options(method, rows, hnsw_m=16, hnsw_ef_construction=64):
+    """WITH options of an ANN index of 'method' ('hnsw' or 'ivfflat') on 'rows' vectors"""
+    if method == 'hnsw':
+        return f"m = {hnsw_m}, ef_construction = {hnsw_ef_construction}"
+    # pgvector's recommendation: rows / 1000 lists up to 1M rows, sqrt(rows) above
+    lists = max(1, rows // 1000) if rows <= 1000000 else int(rows ** 0.5)
+    return f"lists = {lists}"
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
@@ -0,0 +1,105 @@
+import argparse
+import json
+import time
+
+from dotenv import load_dotenv
+from pgvector.psycopg import register_vector
+
+from vector_common import connect, summarize
+
+# Recall versus latency of the document_vectors ANN index, compared with an exact scan.
+# Query vectors are sampled from the table itself, so no embedding API call is needed:
+#
+#   python vector_index_benchmark.py --queries 200 --k 5
+#   python vector_index_benchmark.py --settings 10,40,100,200 --json results.json
+
+load_dotenv()
+
+conn = connect()
+register_vector(conn)
+cursor = conn.cursor()
+
+SEARCH_QUERY = """
+    SELECT id FROM document_vectors
+    ORDER BY embedding <-> %s
+    LIMIT %s
+"""
+
+def detect_index_method():
+    cursor.execute("""
+        SELECT indexname FROM pg_indexes
+        WHERE tablename = 'document_vectors' AND indexname LIKE 'idx_document_vectors_embedding_%'
+    """)
+    names = [row[0] for row in cursor.fetchall()]
+    for method in ('hnsw', 'ivfflat'):
+        if f"idx_document_vectors_embedding_{method}" in names:
+            return method
+    return None
+
+def timed_search(vector, k, settings):
+    """Run one search with transaction-local settings, return (ids, seconds)"""
+    for name, value in settings.items():
+        cursor.execute("SELECT set_config(%s, %s, true)", (name, str(value)))
+    start = time.perf_counter()
+    cursor.execute(SEARCH_QUERY, (vector, k))
+    ids = [row[0] for row in cursor.fetchall()]
+    elapsed = time.perf_counter() - start
+    conn.rollback()
+    return ids, elapsed
+
+def run(n_queries, k, settings_values):
+    method = detect_index_method()
+    if method is None:
+        print("No ANN index on document_vectors, build one with: python node_embedder.py index")
+        return None
+    setting_name = 'hnsw.ef_search' if method == 'hnsw' else 'ivfflat.probes'
+    print(f"Benchmarking {method} index ({setting_name}) with {n_queries} queries, k={k}")
+
+    cursor.execute("SELECT embedding FROM document_vectors ORDER BY random() LIMIT %s", (n_queries,))
+    queries = [row[0] for row in cursor.fetchall()]
+    conn.rollback()
+
+    # Ground truth: disabling index scans forces an exact sequential scan
+    exact_settings = {'enable_indexscan': 'off', 'enable_bitmapscan': 'off'}
+    truth, exact_latencies = [], []
+    for vector in queries:
+        ids, elapsed = timed_search(vector, k, exact_settings)
+        truth.append(set(ids))
+        exact_latencies.append(elapsed)
+
+    results = [{"mode": "exact", "setting": None, "recall": 1.0, **summarize(exact_latencies)}]
+
+    for value in settings_values:
+        latencies, found = [], 0
+        for vector, expected in zip(queries, truth):
+            ids, elapsed = timed_search(vector, k, {setting_name: value})
+            latencies.append(elapsed)
+            found += len(expected.intersection(ids))
+        recall = found / sum(len(expected) for expected in truth)
+        results.append({"mode": method, "setting": value, "recall": recall, **summarize(latencies)})
+
+    print(f"\n{'mode':<10}{setting_name:>18}{'recall@' + str(k):>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        setting = '-' if result['setting'] is None else result['setting']
+        print(f"{result['mode']:<10}{setting:>18}{result['recall']:>12.3f}"
+              f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall/latency benchmark of the document_vectors ANN index")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--settings", default="10,20,40,80,160",
+                        help="Comma separated ef_search (HNSW) or probes (IVFFlat) values")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    try:
+        results = run(args.queries, args.k, [int(value) for value in args.settings.split(",")])
+        if results and args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"\nResults written to {args.json}")
+    finally:
+        cursor.close()
+        conn.close()
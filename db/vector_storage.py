@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+from vector_common import connect, index_options, summarize
+
+# Compact storage of document_vectors: shortened text-embedding-3 vectors (the first dimensions,
+# renormalized, are what the embedding API returns when asked for fewer), in half precision, with an
+# optional index on their binary quantization for the two-stage search of api/src/utils.vsearch.
+# The compact copy is built next to the current table, compared with it, then swapped in:
+#
+#   python vector_storage.py build --dimensions 512 --storage halfvec --binary
+#   python vector_storage.py recall --queries 200 --k 10 --candidates 40,100,200
+#   python vector_storage.py swap        # document_vectors -> document_vectors_full, compact -> document_vectors
+#   python vector_storage.py restore     # the other way around
+#   python vector_storage.py drop-full   # once the compact table is kept
+#
+# Afterwards node_embedder.py follows the type of the table: new vectors are requested with its dimensions.
+# Truncation is only valid for text-embedding-3 models, vectors of other models must be embedded again.
+
+load_dotenv()
+
+conn = connect()
+cursor = conn.cursor()
+
+TABLE = "document_vectors"
+COMPACT_TABLE = "document_vectors_compact"
+FULL_TABLE = "document_vectors_full"
+
+INDEX_MAINTENANCE_WORK_MEM = os.getenv('INDEX_MAINTENANCE_WORK_MEM', '1GB')
+
+def table_exists(table):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+    return cursor.fetchone()[0]
+
+def vector_column(table):
+    """(storage, dimensions) of the embedding column of 'table'"""
+    cursor.execute("""
+        SELECT t.typname, a.atttypmod FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid
+        WHERE a.attrelid = to_regclass(%s) AND a.attname = 'embedding';
+    """, (table,))
+    return cursor.fetchone()
+
+def build(dimensions, storage, binary, method):
+    """Copy document_vectors into COMPACT_TABLE with shortened, renormalized vectors, then index it"""
+    if table_exists(COMPACT_TABLE):
+        print(f"{COMPACT_TABLE} already exists, drop it first to build it again")
+        return
+    source_storage, source_dimensions = vector_column(TABLE)
+    if dimensions > source_dimensions:
+        print(f"{TABLE} only has {source_dimensions} dimensions")
+        return
+    print(f"Copying {TABLE} ({source_dimensions} {source_storage}) into {COMPACT_TABLE} ({dimensions} {storage})...")
+    start_time = time.monotonic()
+    cursor.execute(f"""
+        CREATE TABLE {COMPACT_TABLE} (
+            id TEXT PRIMARY KEY,
+            node_name TEXT,
+            node_label TEXT,
+            embedding {storage}({dimensions}),
+            content_hash TEXT,
+            model TEXT,
+            label TEXT GENERATED ALWAYS AS (btrim(node_label, '[]" ')) STORED,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    # created_at is kept so that incremental exports of the local index keep working
+    cursor.execute(f"""
+        INSERT INTO {COMPACT_TABLE} (id, node_name, node_label, embedding, content_hash, model, created_at)
+        SELECT id, node_name, node_label,
+               l2_normalize(subvector(embedding::vector, 1, {dimensions}))::{storage}({dimensions}),
+               content_hash, model, created_at
+        FROM {TABLE};
+    """)
+    rows = cursor.rowcount
+    cursor.execute(f"CREATE INDEX idx_{COMPACT_TABLE}_label ON {COMPACT_TABLE}(label);")
+    conn.commit()
+    print(f"  {rows} vectors copied in {time.monotonic() - start_time:.1f}s")
+
+    cursor.execute(f"SELECT label, COUNT(*) FROM {COMPACT_TABLE} GROUP BY label")
+    label_counts = dict(cursor.fetchall())
+    # Same names, expressions and per-label partial indexes as node_embedder.create_vector_index,
+    # with the table prefix, so that they are renamed along with the table by swap
+    kinds = [("embedding", "embedding", f"{storage}_l2_ops")]
+    if binary:
+        kinds.append(("binary", f"(binary_quantize(embedding)::bit({dimensions}))", "bit_hamming_ops"))
+    cursor.execute(f"SET maintenance_work_mem = '{INDEX_MAINTENANCE_WORK_MEM}'")
+    for kind, expression, opclass in kinds:
+        index_name = f"idx_{COMPACT_TABLE}_{kind}_{method}"
+        indexes = [(index_name, rows, "")] + [
+            (f"{index_name}_{label.lower()}", count, f"WHERE label = '{label}'")
+            for label, count in sorted(label_counts.items())
+            if label and label.isidentifier()
+        ]
+        for name, count, predicate in indexes:
+            print(f"Building {name} ({opclass}) {predicate}...")
+            start_time = time.monotonic()
+            cursor.execute(f"""
+                CREATE INDEX {name} ON {COMPACT_TABLE} USING {method} ({expression} {opclass})
+                WITH ({index_options(method, count)})
+                {predicate}
+            """)
+            conn.commit()
+            print(f"  Index {name} ready in {time.monotonic() - start_time:.1f}s")
+
+    cursor.execute(f"ANALYZE {COMPACT_TABLE}")
+    conn.commit()
+    print_sizes()
+
+def print_sizes():
+    print(f"\n{'table':<28}{'rows':>10}{'table MB':>12}{'indexes MB':>12}")
+    for table in (TABLE, COMPACT_TABLE, FULL_TABLE):
+        if not table_exists(table):
+            continue
+        cursor.execute(f"""
+            SELECT COUNT(*), pg_table_size(%(table)s::regclass), pg_indexes_size(%(table)s::regclass) FROM {table}
+        """, {"table": table})
+        rows, table_size, indexes_size = cursor.fetchone()
+        print(f"{table:<28}{rows:>10}{table_size / 2**20:>12.1f}{indexes_size / 2**20:>12.1f}")
+    conn.rollback()
+
+def search_query(table, storage, dimensions, label, candidates=None):
+    """Nearest neighbour query of 'table', written like api/src/utils.build_vsearch_query"""
+    label_filter = "WHERE label = %(label)s" if label else ""
+    if not candidates:
+        return f"""
+            SELECT id FROM {table} {label_filter}
+            ORDER BY embedding <-> %(vector)s::{storage}({dimensions})
+            LIMIT %(k)s
+        """
+    return f"""
+        SELECT id FROM (
+            SELECT id, embedding FROM {table} {label_filter}
+            ORDER BY binary_quantize(embedding)::bit({dimensions}) <~> binary_quantize(%(vector)s::{storage}({dimensions}))
+            LIMIT {candidates}
+        ) candidates
+        ORDER BY embedding <-> %(vector)s::{storage}({dimensions})
+        LIMIT %(k)s
+    """
+
+def timed_search(query, params, settings):
+    for name, value in settings.items():
+        cursor.execute("SELECT set_config(%s, %s, true)", (name, str(value)))
+    start = time.perf_counter()
+    cursor.execute(query, params)
+    ids = [row[0] for row in cursor.fetchall()]
+    elapsed = time.perf_counter() - start
+    conn.rollback()
+    return ids, elapsed
+
+def recall(n_queries, k, candidates_values, label, ef_search):
+    """
+    Recall@k of the compact table's searches against an exact search of the full vectors.
+    Query vectors are sampled from the full table and shortened the same way as the stored ones
+    """
+    full_table = FULL_TABLE if table_exists(FULL_TABLE) else TABLE
+    compact_table = TABLE if full_table == FULL_TABLE else COMPACT_TABLE
+    if not table_exists(compact_table):
+        print(f"No {COMPACT_TABLE} table, build it first")
+        return None
+    full_storage, full_dimensions = vector_column(full_table)
+    storage, dimensions = vector_column(compact_table)
+    print(f"Comparing {full_table} ({full_dimensions} {full_storage}) with {compact_table} ({dimensions} {storage}), "
+          f"{n_queries} queries, k={k}" + (f", label {label}" if label else ""))
+
+    # Vectors are sent as text literals with explicit casts, no adapter is needed for halfvec
+    cursor.execute(f"""
+        SELECT embedding::vector::text,
+               l2_normalize(subvector(embedding::vector, 1, {dimensions}))::text
+        FROM {full_table} {"WHERE label = %(label)s" if label else ""}
+        ORDER BY random() LIMIT %(n)s
+    """, {"label": label, "n": n_queries})
+    queries = cursor.fetchall()
+    conn.rollback()
+
+    exact_settings = {'enable_indexscan': 'off', 'enable_bitmapscan': 'off'}
+    ann_settings = {'hnsw.ef_search': ef_search} if ef_search else {}
+    full_query = search_query(full_table, full_storage, full_dimensions, label)
+    compact_query = search_query(compact_table, storage, dimensions, label)
+
+    truth, latencies = [], []
+    for full_vector, _ in queries:
+        ids, elapsed = timed_search(full_query, {"vector": full_vector, "label": label, "k": k}, exact_settings)
+        truth.append(set(ids))
+        latencies.append(elapsed)
+    results = [{"mode": "full exact", "candidates": None, "recall": 1.0, **summarize(latencies)}]
+
+    # (mode, query, index of the query vector, rerank candidates)
+    modes = [("full ann", full_query, 0, None), ("compact ann", compact_query, 1, None)]
+    modes.extend(
+        ("binary rerank", search_query(compact_table, storage, dimensions, label, candidates), 1, candidates)
+        for candidates in candidates_values
+    )
+    for mode, query, vector_index, candidates in modes:
+        latencies, found = [], 0
+        for vectors, expected in zip(queries, truth):
+            params = {"vector": vectors[vector_index], "label": label, "k": k}
+            ids, elapsed = timed_search(query, params, ann_settings)
+            latencies.append(elapsed)
+            found += len(expected.intersection(ids))
+        results.append({
+            "mode": mode,
+            "candidates": candidates,
+            "recall": found / max(1, sum(len(expected) for expected in truth)),
+            **summarize(latencies),
+        })
+
+    print(f"\n{'mode':<16}{'candidates':>12}{'recall@' + str(k):>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        candidates = '-' if result['candidates'] is None else result['candidates']
+        print(f"{result['mode']:<16}{candidates:>12}{result['recall']:>12.3f}"
+              f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+    print_sizes()
+    return results
+
+def rename_table(old, new):
+    """Rename a table along with its primary key and its idx_<table>_ indexes"""
+    cursor.execute(f"ALTER TABLE {old} RENAME TO {new}")
+    cursor.execute(f"ALTER TABLE {new} RENAME CONSTRAINT {old}_pkey TO {new}_pkey")
+    cursor.execute("""
+        SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname LIKE %s
+    """, (new, f"idx_{old}_%"))
+    for (index_name,) in cursor.fetchall():
+        cursor.execute(f"ALTER INDEX {index_name} RENAME TO idx_{new}_{index_name[len(f'idx_{old}_'):]}")
+
+def swap():
+    """Serve the compact table as document_vectors, keeping the full one as FULL_TABLE"""
+    if not table_exists(COMPACT_TABLE) or table_exists(FULL_TABLE):
+        print(f"Nothing to swap: {COMPACT_TABLE} must exist and {FULL_TABLE} must not")
+        return
+    # A single transaction, searches never see a missing table
+    rename_table(TABLE, FULL_TABLE)
+    rename_table(COMPACT_TABLE, TABLE)
+    conn.commit()
+    print(f"{TABLE} is now the compact table, the previous one is kept as {FULL_TABLE}")
+
+def restore():
+    """Undo swap"""
+    if not table_exists(FULL_TABLE) or table_exists(COMPACT_TABLE):
+        print(f"Nothing to restore: {FULL_TABLE} must exist and {COMPACT_TABLE} must not")
+        return
+    rename_table(TABLE, COMPACT_TABLE)
+    rename_table(FULL_TABLE, TABLE)
+    conn.commit()
+    print(f"{TABLE} is the full table again, the compact one is kept as {COMPACT_TABLE}")
+
+def drop_full():
+    if not table_exists(FULL_TABLE):
+        print(f"No {FULL_TABLE} table")
+        return
+    cursor.execute(f"DROP TABLE {FULL_TABLE}")
+    conn.commit()
+    print(f"{FULL_TABLE} dropped")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact (shortened, half precision) storage of document_vectors")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help=f"Build {COMPACT_TABLE} from {TABLE}")
+    build_parser.add_argument("--dimensions", type=int, default=512)
+    build_parser.add_argument("--storage", default="halfvec", choices=["vector", "halfvec"])
+    build_parser.add_argument("--binary", action="store_true", help="Also index the binary quantized vectors")
+    build_parser.add_argument("--method", default="hnsw", choices=["hnsw", "ivfflat"])
+    recall_parser = subparsers.add_parser("recall", help="Recall and latency of the compact table's searches")
+    recall_parser.add_argument("--queries", type=int, default=100)
+    recall_parser.add_argument("--k", type=int, default=10)
+    recall_parser.add_argument("--candidates", default="40,100,200",
+                               help="Comma separated candidate counts of the binary rerank, empty to skip it")
+    recall_parser.add_argument("--label", help="Restrict the searches to a node label, e.g. Drug")
+    recall_parser.add_argument("--ef-search", type=int, help="hnsw.ef_search of the ANN searches")
+    recall_parser.add_argument("--json", help="Write the results to this file")
+    subparsers.add_parser("swap", help=f"Rename {COMPACT_TABLE} to {TABLE}, keeping the current one")
+    subparsers.add_parser("restore", help="Undo swap")
+    subparsers.add_parser("drop-full", help=f"Drop {FULL_TABLE}")
+    subparsers.add_parser("sizes", help="Row counts and sizes of the tables")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "build":
+            build(args.dimensions, args.storage, args.binary, args.method)
+        elif args.command == "recall":
+            candidates = [int(value) for value in args.candidates.split(",") if value]
+            results = recall(args.queries, args.k, candidates, args.label, args.ef_search)
+            if results and args.json:
+                with open(args.json, "w") as f:
+                    json.dump(results, f, indent=2)
+                print(f"\nResults written to {args.json}")
+        elif args.command == "swap":
+            swap()
+        elif args.command == "restore":
+            restore()
+        elif args.command == "drop-full":
+            drop_full()
+        elif args.command == "sizes":
+            print_sizes()
+    finally:
+        cursor.close()
+        conn.close()